@@ -0,0 +1,86 @@
+# app_auth.py
+"""
+Autenticación de aplicación (client credentials) para leer todos los buzones del tenant
+- Sin usuario interactivo: requiere un registro de aplicación con el permiso
+  Mail.ReadBasic.All o Mail.Read (de aplicación) y consentimiento de administrador
+- Credenciales en variables de entorno: GRAPH_TENANT_ID, GRAPH_CLIENT_ID, GRAPH_CLIENT_SECRET
+"""
+
+import os
+import time
+
+import requests
+
+# Margen (s) antes de la caducidad del token para pedir uno nuevo
+TOKEN_REFRESH_MARGIN = 300
+
+
+class ClientCredentialsAuthenticator:
+    """Autenticador de aplicación (sin usuario) para Microsoft Graph API"""
+    
+    def __init__(self, tenant_id=None, client_id=None, client_secret=None):
+        self.tenant = tenant_id or os.environ.get('GRAPH_TENANT_ID')
+        self.client_id = client_id or os.environ.get('GRAPH_CLIENT_ID')
+        self.client_secret = client_secret or os.environ.get('GRAPH_CLIENT_SECRET')
+        self.scopes = ["https://graph.microsoft.com/.default"]
+        self.access_token = None
+        self.expires_at = 0
+    
+    def authenticate(self):
+        """Obtiene un token de aplicación con las credenciales configuradas"""
+        missing = [
+            name for name, value in (
+                ('GRAPH_TENANT_ID', self.tenant),
+                ('GRAPH_CLIENT_ID', self.client_id),
+                ('GRAPH_CLIENT_SECRET', self.client_secret)
+            ) if not value
+        ]
+        if missing:
+            print(f"❌ Faltan credenciales de aplicación: {', '.join(missing)}")
+            return False
+        
+        print("🔐 Solicitando token de aplicación (client credentials)...")
+        return self._request_token()
+    
+    def _request_token(self):
+        """Pide un token nuevo al endpoint de Azure AD"""
+        token_url = f"https://login.microsoftonline.com/{self.tenant}/oauth2/v2.0/token"
+        token_data = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scope': ' '.join(self.scopes)
+        }
+        
+        try:
+            response = requests.post(token_url, data=token_data)
+            result = response.json()
+            
+            if response.status_code != 200:
+                print(f"❌ Error obteniendo token de aplicación: {result.get('error_description', response.status_code)}")
+                return False
+            
+            self.access_token = result['access_token']
+            self.expires_at = time.time() + int(result.get('expires_in', 3600))
+            print("🎉 Token de aplicación obtenido")
+            return True
+        
+        except Exception as e:
+            print(f"❌ Error en autenticación de aplicación: {str(e)}")
+            return False
+    
+    def get_access_token(self):
+        """Retorna el access token, renovándolo si está a punto de caducar"""
+        if self.access_token and time.time() > self.expires_at - TOKEN_REFRESH_MARGIN:
+            self._request_token()
+        return self.access_token
+    
+    def get_user_info(self):
+        """Los tokens de aplicación no tienen usuario; se identifica la aplicación"""
+        if self.access_token:
+            return {'nombre': 'Aplicación', 'email': self.client_id}
+        return None
+    
+    def is_authenticated(self):
+        """Verifica si está autenticado"""
+        return self.access_token is not None
@@ -0,0 +1,285 @@
+# backends.py
+"""
+Protocolo común de los gestores de correo (IMAP y Graph API) y modo automático
+- Cada backend declara sus capacidades y estima cuánto tardará cada trabajo
+- AutoBackend mide el tiempo de ida y vuelta, elige el más rápido y, si uno
+  empieza a fallar o a limitar peticiones, continúa con el otro sin repetir
+  lo ya entregado
+"""
+
+import time
+from abc import ABC, abstractmethod
+
+from dedup import MessageDeduplicator, message_key
+
+# Capacidades que puede declarar un backend
+CAP_INCREMENTAL = 'sincronizacion_incremental'  # Solo cambios desde la última consulta
+CAP_PUSH = 'notificaciones_push'                # El servidor avisa de los correos nuevos
+CAP_SERVER_COUNT = 'conteo_servidor'            # Conteos sin descargar mensajes
+CAP_HEADER_ONLY = 'solo_cabeceras'              # Descarga solo de los campos necesarios
+CAP_BATCH = 'peticiones_agrupadas'              # Varias consultas por petición HTTP
+
+# Trabajos y capacidades imprescindibles para cada uno
+JOB_DOWNLOAD = 'descarga'
+JOB_COUNTS = 'resumen'
+JOB_WATCH = 'vigilar'
+
+JOB_CAPABILITIES = {
+    JOB_DOWNLOAD: {CAP_HEADER_ONLY},
+    JOB_COUNTS: {CAP_SERVER_COUNT},
+    JOB_WATCH: {CAP_INCREMENTAL},
+}
+
+
+class MailBackend(ABC):
+    """
+    Interfaz común de EmailManager y GraphEmailManager
+    
+    Métodos que implementa cada backend:
+        get_user_info(), get_folder_list()
+        get_email_counts(start_date, end_date, folders)
+        get_emails_in_date_range / iter_emails_in_date_range(start_date, end_date, folders,
+            attachment_info=None, deduplicator=None, include_threads=False)
+        iter_new_emails(folders, deduplicator=None)
+        export_to_excel(emails, filename, include_threads=False)
+        export_bodies(emails, root=None, workers=4)
+        ping(), estimate_seconds(job, folders, days, rtt)
+        clone() (opcional; ver daemon.py)
+    
+    ping() y estimate_seconds() son abstractos: un backend que no los implementa
+    falla al crearse, no durante la medición de AutoBackend.
+    """
+    
+    BACKEND_NAME = None
+    CAPABILITIES = frozenset()
+    
+    # Errores y limitaciones (429/503) acumulados; AutoBackend los vigila
+    failures = 0
+    throttled = 0
+    
+    # Caracteres de la vista previa del cuerpo ('vista_previa'); None = sin vista previa
+    preview_length = None
+    
+    def supports(self, capability):
+        """Indica si el backend tiene la capacidad indicada"""
+        return capability in self.CAPABILITIES
+    
+    @abstractmethod
+    def ping(self):
+        """Hace una consulta mínima al servidor; True si respondió bien"""
+    
+    @abstractmethod
+    def estimate_seconds(self, job, folders, days, rtt):
+        """Tiempo estimado (s) de un trabajo a partir del tiempo de ida y vuelta medido"""
+    
+    def clone(self):
+        """Gestor equivalente que se puede usar a la vez en otro hilo; None si no es posible"""
+        return None
+
+
+def measure_rtt(backend, samples=3):
+    """
+    Mide el tiempo de ida y vuelta de un backend (mediana de varias consultas)
+    
+    Returns:
+        float: Segundos, o None si el backend no responde
+    """
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        try:
+            if not backend.ping():
+                return None
+        except Exception:
+            return None
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+class AutoBackend:
+    """Elige el backend más rápido para cada trabajo y cambia al otro si falla"""
+    
+    def __init__(self, backends, max_failures=3, max_throttled=5):
+        """
+        Args:
+            backends (list): Gestores ya autenticados (EmailManager, GraphEmailManager)
+            max_failures (int): Errores en una carpeta que provocan el cambio de backend
+            max_throttled (int): Respuestas 429/503 en una carpeta que provocan el cambio
+        """
+        self.backends = list(backends)
+        self.max_failures = max_failures
+        self.max_throttled = max_throttled
+        self.rtts = {}
+        self.authenticators = []
+    
+    @property
+    def preview_length(self):
+        return self.backends[0].preview_length if self.backends else None
+    
+    @preview_length.setter
+    def preview_length(self, length):
+        for backend in self.backends:
+            backend.preview_length = length
+    
+    def probe(self):
+        """Mide el tiempo de ida y vuelta de cada backend y descarta los que no responden"""
+        for backend in self.backends:
+            rtt = measure_rtt(backend)
+            self.rtts[backend.BACKEND_NAME] = rtt
+            if rtt is None:
+                print(f"   ❌ {backend.BACKEND_NAME}: sin respuesta")
+            else:
+                print(f"   📶 {backend.BACKEND_NAME}: {rtt * 1000:.0f} ms de ida y vuelta")
+        return self.rtts
+    
+    def rank(self, job, folders=(), days=1):
+        """
+        Ordena los backends disponibles del más rápido al más lento para un trabajo
+        
+        Returns:
+            list: Backends que responden y tienen las capacidades del trabajo
+        """
+        if not self.rtts:
+            self.probe()
+        
+        required = JOB_CAPABILITIES.get(job, set())
+        candidates = []
+        for backend in self.backends:
+            rtt = self.rtts.get(backend.BACKEND_NAME)
+            if rtt is None or not required <= backend.CAPABILITIES:
+                continue
+            candidates.append((backend.estimate_seconds(job, list(folders), days, rtt), backend))
+        
+        candidates.sort(key=lambda candidate: candidate[0])
+        for seconds, backend in candidates:
+            print(f"   ⏱️ {backend.BACKEND_NAME}: ~{seconds:.1f} s estimados para '{job}'")
+        return [backend for _, backend in candidates]
+    
+    def get_user_info(self):
+        for backend in self.rank(JOB_DOWNLOAD):
+            user_info = backend.get_user_info()
+            if user_info:
+                return user_info
+        return None
+    
+    def get_email_counts(self, start_date, end_date, folders=['inbox']):
+        """Conteos con el backend más rápido; si falla, se repiten con el siguiente"""
+        folders = [folders] if isinstance(folders, str) else list(folders)
+        days = (end_date.date() - start_date.date()).days + 1
+        
+        counts = None
+        for backend in self.rank(JOB_COUNTS, folders, days):
+            print(f"🤖 Contando con {backend.BACKEND_NAME}")
+            failures = backend.failures
+            counts = backend.get_email_counts(start_date, end_date, folders)
+            if backend.failures == failures:
+                return counts
+            print(f"⚠️ {backend.BACKEND_NAME} falló durante el conteo; probando otro backend")
+        return counts
+    
+    def get_emails_in_date_range(self, start_date, end_date, folders=['inbox'], attachment_info=None, deduplicator=None, include_threads=False):
+        return list(self.iter_emails_in_date_range(start_date, end_date, folders, attachment_info, deduplicator, include_threads))
+    
+    def iter_emails_in_date_range(self, start_date, end_date, folders=['inbox'], attachment_info=None, deduplicator=None, include_threads=False):
+        """
+        Descarga carpeta a carpeta con el backend más rápido
+        
+        Si el backend acumula errores o limitaciones, o lanza una excepción, la
+        carpeta en curso y las pendientes continúan con el siguiente backend;
+        los correos ya entregados no se repiten.
+        
+        Cada intento usa su propio de-duplicador: el del llamador solo registra
+        los correos que se entregan, así que lo que un backend revisó sin llegar
+        a entregar no cuenta como duplicado ni se pierde al repetir la carpeta.
+        """
+        folders = [folders] if isinstance(folders, str) else list(folders)
+        days = (end_date.date() - start_date.date()).days + 1
+        backends = self.rank(JOB_DOWNLOAD, folders, days)
+        delivered = set()
+        
+        for folder in folders:
+            for backend in list(backends):
+                print(f"🤖 '{folder}' con {backend.BACKEND_NAME}")
+                failures, throttled = backend.failures, backend.throttled
+                attempt_deduplicator = MessageDeduplicator() if deduplicator is not None else None
+                stream = backend.iter_emails_in_date_range(
+                    start_date, end_date, [folder], attachment_info, attempt_deduplicator, include_threads
+                )
+                
+                healthy = True
+                try:
+                    for email_data in stream:
+                        # Lo entregado se registra por carpeta: las copias en otras
+                        # carpetas las resuelve el de-duplicador del llamador
+                        key = (folder, message_key(email_data.get('message_id'), email_data))
+                        if key not in delivered:
+                            delivered.add(key)
+                            if self._deliver(email_data, folder, deduplicator):
+                                email_data['backend'] = backend.BACKEND_NAME
+                                yield email_data
+                        if not self._healthy(backend, failures, throttled):
+                            healthy = False
+                            break
+                    else:
+                        healthy = self._healthy(backend, failures, throttled)
+                except Exception as e:
+                    print(f"❌ {backend.BACKEND_NAME}: {str(e)}")
+                    healthy = False
+                finally:
+                    stream.close()
+                
+                if healthy:
+                    break
+                
+                # La carpeta se repite con el siguiente backend (sin duplicar lo entregado)
+                # y las carpetas restantes ya no empiezan por el que falla
+                print(f"⚠️ {backend.BACKEND_NAME} falla o limita peticiones en '{folder}'")
+                backends.remove(backend)
+                backends.append(backend)
+            else:
+                print(f"❌ Ningún backend pudo completar '{folder}'")
+    
+    def iter_new_emails(self, folders=['inbox'], deduplicator=None):
+        """Vigila con el backend de menor latencia; si se interrumpe, continúa con otro"""
+        folders = [folders] if isinstance(folders, str) else list(folders)
+        for backend in self.rank(JOB_WATCH, folders):
+            print(f"🤖 Vigilando con {backend.BACKEND_NAME}")
+            try:
+                yield from backend.iter_new_emails(folders, deduplicator)
+                return
+            except Exception as e:
+                print(f"⚠️ {backend.BACKEND_NAME} dejó de responder ({str(e)}); probando otro backend")
+    
+    def export_to_excel(self, emails, filename=None, include_threads=False):
+        return self.backends[0].export_to_excel(emails, filename, include_threads=include_threads)
+    
+    def export_bodies(self, emails, root=None, workers=4):
+        """Cada correo se exporta con el backend que lo descargó (el UID o ID solo vale en ese)"""
+        for backend in self.backends:
+            backend_emails = [email_data for email_data in emails if email_data.get('backend') == backend.BACKEND_NAME]
+            if backend_emails:
+                backend.export_bodies(backend_emails, root, workers)
+    
+    def disconnect(self):
+        """Cierra las conexiones de todos los autenticadores"""
+        for authenticator in self.authenticators:
+            if hasattr(authenticator, 'disconnect'):
+                authenticator.disconnect()
+    
+    @staticmethod
+    def _deliver(email_data, folder, deduplicator):
+        """Registra el correo en el de-duplicador del llamador; False si es un duplicado"""
+        if deduplicator is None:
+            return True
+        folders = deduplicator.check(folder, message_id=email_data.get('message_id'), email_data=email_data)
+        if folders is None:
+            return False
+        email_data['carpetas'] = folders
+        return True
+    
+    def _healthy(self, backend, failures, throttled):
+        return (
+            backend.failures - failures < self.max_failures
+            and backend.throttled - throttled < self.max_throttled
+        )
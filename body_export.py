@@ -0,0 +1,130 @@
+# body_export.py
+"""
+Exportación del cuerpo completo de los correos a archivos comprimidos
+- Un archivo por correo: <raíz>/<carpeta>/<id>.eml.gz (mensaje MIME original)
+- Varios hilos descargan a la vez; cada cuerpo se escribe por fragmentos,
+  sin tenerlo entero en memoria
+- Cada archivo se escribe como temporal y se renombra al completarse
+"""
+
+import gzip
+import hashlib
+import os
+import queue
+import threading
+from urllib.parse import quote
+
+# Directorio por defecto de los cuerpos exportados
+DEFAULT_BODY_ROOT = 'cuerpos_correos'
+
+# Tamaño de cada fragmento descargado (IMAP con BODY.PEEK[]<n.m>, Graph con iter_content)
+CHUNK_SIZE = 1024 * 1024
+
+
+def body_path(root, email_data, server_id):
+    """Ruta del archivo de un correo (los IDs largos de Graph se resumen con un hash)"""
+    folder = quote(email_data.get('carpeta') or 'inbox', safe=' -_.')
+    name = str(server_id)
+    if len(name) > 64 or not name.isalnum():
+        name = hashlib.blake2b(name.encode('utf-8'), digest_size=12).hexdigest()
+    return os.path.join(root, folder, f"{name}.eml.gz")
+
+
+def write_compressed(path, chunks):
+    """
+    Escribe los fragmentos en un .gz temporal y lo renombra al terminar
+    
+    Returns:
+        int: Bytes sin comprimir escritos
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    written = 0
+    try:
+        with gzip.open(temporary, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return written
+
+
+class BodyExportPool:
+    """Descarga y comprime los cuerpos con varios hilos, cada uno con su propio lector"""
+    
+    def __init__(self, open_reader, workers=4):
+        """
+        Args:
+            open_reader (callable): Crea un lector para un hilo; el lector es una
+                función (correo) -> (id en el servidor, iterador de fragmentos bytes)
+                y puede tener close()
+            workers (int): Hilos de descarga
+        """
+        self.open_reader = open_reader
+        self.workers = max(1, workers)
+        self.exported = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+    
+    def run(self, emails, root=DEFAULT_BODY_ROOT):
+        """
+        Exporta los cuerpos de los correos indicados
+        
+        A cada correo exportado se le añade 'archivo_cuerpo' con la ruta del archivo.
+        """
+        pending = queue.Queue(maxsize=self.workers * 4)
+        threads = [threading.Thread(target=self._worker, args=(pending, root), daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        
+        for email_data in emails:
+            pending.put(email_data)
+        for _ in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+        
+        size_mb = self.bytes_written / (1024 * 1024)
+        print(f"📄 Cuerpos exportados: {self.exported} ({size_mb:.1f} MB sin comprimir) en {root}")
+        if self.errors:
+            print(f"⚠️ Cuerpos que no se pudieron exportar: {self.errors}")
+    
+    def _worker(self, pending, root):
+        reader = None
+        try:
+            reader = self.open_reader()
+        except Exception as e:
+            print(f"❌ No se pudo abrir una conexión para exportar cuerpos: {str(e)}")
+        
+        while True:
+            email_data = pending.get()
+            if email_data is None:
+                break
+            if reader is None:
+                with self.lock:
+                    self.errors += 1
+                continue
+            
+            try:
+                server_id, chunks = reader(email_data)
+                path = body_path(root, email_data, server_id)
+                written = write_compressed(path, chunks)
+                email_data['archivo_cuerpo'] = path
+                with self.lock:
+                    self.exported += 1
+                    self.bytes_written += written
+            except Exception as e:
+                print(f"   ❌ Error exportando el cuerpo de '{email_data.get('asunto', '')}': {str(e)}")
+                with self.lock:
+                    self.errors += 1
+        
+        if reader is not None and hasattr(reader, 'close'):
+            try:
+                reader.close()
+            except Exception:
+                pass
@@ -0,0 +1,106 @@
+# body_preview.py
+"""
+Vista previa del cuerpo a partir de un fragmento parcial del mensaje
+- IMAP: solo se descargan los primeros bytes del cuerpo (BODY.PEEK[TEXT]<0.N>)
+- El fragmento puede cortar el MIME por la mitad: se decodifica la primera
+  parte de texto tolerando base64/quoted-printable y caracteres incompletos
+"""
+
+import base64
+import binascii
+import email
+import html
+import quopri
+import re
+
+# Longitud máxima de bodyPreview en Graph API (más larga requiere pedir body)
+GRAPH_PREVIEW_MAX = 255
+
+# Bytes máximos descargados para una vista previa IMAP
+MAX_PREVIEW_FETCH = 65536
+
+_TAG_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]*>', re.IGNORECASE | re.DOTALL)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def preview_fetch_size(length):
+    """
+    Bytes del cuerpo que hay que pedir para obtener length caracteres
+    
+    Margen para la codificación (base64 ocupa 4/3, UTF-8 hasta 4 bytes por
+    carácter) y para las cabeceras MIME de la primera parte.
+    """
+    return min(MAX_PREVIEW_FETCH, length * 4 + 2048)
+
+
+def html_to_text(markup):
+    """Texto visible aproximado de un fragmento HTML (sin scripts ni estilos)"""
+    return html.unescape(_TAG_RE.sub(' ', markup))
+
+
+def text_preview(headers, partial_body, length):
+    """
+    Primeros length caracteres del texto de un mensaje
+    
+    Args:
+        headers (bytes): Cabeceras del mensaje (al menos Content-Type y
+            Content-Transfer-Encoding)
+        partial_body (bytes): Comienzo del cuerpo (puede estar cortado)
+        length (int): Caracteres de la vista previa
+    
+    Returns:
+        str: Texto en una sola línea, o '' si no hay parte de texto
+    """
+    message = email.message_from_bytes((headers or b'').rstrip(b'\r\n') + b'\r\n\r\n' + (partial_body or b''))
+    part = _first_text_part(message)
+    if part is None:
+        return ''
+    
+    text = _decode_part(part)
+    if part.get_content_subtype() == 'html':
+        text = html_to_text(text)
+    
+    return _SPACE_RE.sub(' ', text).strip()[:length]
+
+
+def _first_text_part(message):
+    """Primera parte text/plain (o text/html si no hay) que no sea un adjunto"""
+    html_part = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_maintype() != 'text':
+            continue
+        if (part.get('Content-Disposition') or '').lower().startswith('attachment'):
+            continue
+        if part.get_content_subtype() == 'plain':
+            return part
+        if html_part is None:
+            html_part = part
+    return html_part
+
+
+def _decode_part(part):
+    """Decodifica una parte posiblemente truncada según su codificación y juego de caracteres"""
+    payload = part.get_payload(decode=False)
+    if isinstance(payload, list):
+        return ''
+    raw = payload.encode('ascii', errors='surrogateescape') if isinstance(payload, str) else payload
+    
+    encoding = (part.get('Content-Transfer-Encoding') or '').strip().lower()
+    if encoding == 'base64':
+        data = re.sub(rb'[^A-Za-z0-9+/=]', b'', raw)
+        data = data[:len(data) // 4 * 4]  # Descartar el bloque cortado
+        try:
+            raw = base64.b64decode(data)
+        except (binascii.Error, ValueError):
+            raw = b''
+    elif encoding == 'quoted-printable':
+        raw = quopri.decodestring(re.sub(rb'=[0-9A-Fa-f]?$', b'', raw))
+    
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        text = raw.decode(charset, errors='replace')
+    except LookupError:
+        text = raw.decode('utf-8', errors='replace')
+    
+    # Un carácter multibyte cortado al final aparece como reemplazo
+    return text.rstrip('�')
@@ -0,0 +1,337 @@
+# classification_rules.py
+"""
+Clasificación de los correos con reglas configurables (etiquetas)
+- Las reglas se leen de un archivo JSON: expresiones regulares, palabras clave
+  y listas de dominios sobre cualquier campo del correo (asunto, remitente...)
+- Todas las reglas de un mismo campo se compilan en una sola expresión con una
+  alternativa por regla; las palabras y los dominios se agrupan en un trie de
+  prefijos. Cada campo se recorre una sola vez, haya 3 reglas o 300
+- Se aplica sobre el flujo de correos de cualquier gestor o, para reprocesar
+  exportaciones antiguas, en un pool de procesos
+
+Formato del archivo:
+    {"reglas": [
+        {"campo": "asunto", "regex": "\\\\b([A-Z][A-Z0-9]+)-\\\\d+\\\\b",
+         "etiquetas": {"proyecto_jira": "\\\\1", "ticket": "\\\\0"}},
+        {"campo": "remitente_email", "palabras": ["noreply", "no-reply"],
+         "etiquetas": {"automatico": "Sí"}},
+        {"campo": "remitente_email", "dominios": ["atlassian.net", "github.com"],
+         "etiquetas": {"plataforma": "\\\\0"}}
+    ]}
+
+En los valores de las etiquetas, \\0 es el texto coincidente y \\1..\\9 los
+grupos de la expresión de la regla. Si dos reglas del mismo campo coinciden
+con el mismo texto, se aplica la primera del archivo: para sacar varias
+etiquetas de una coincidencia, una regla puede producir varias etiquetas.
+"""
+
+import json
+import os
+import re
+from collections import deque
+
+# Archivo de reglas que se aplica automáticamente en el modo interactivo
+DEFAULT_RULES_PATH = 'reglas_clasificacion.json'
+
+# Correos que procesa cada tarea del pool de procesos
+CHUNK_SIZE = 2000
+
+_TEMPLATE_RE = re.compile(r'\\(\d)')
+
+
+def load_rules(path=DEFAULT_RULES_PATH):
+    """
+    Lee las reglas de un archivo JSON
+    
+    Returns:
+        list: Reglas (diccionarios con 'campo', 'etiquetas' y 'regex',
+            'palabras' o 'dominios')
+    """
+    with open(path, encoding='utf-8') as rules_file:
+        data = json.load(rules_file)
+    return data['reglas'] if isinstance(data, dict) else data
+
+
+def _trie_pattern(words):
+    """
+    Expresión equivalente a la alternancia de las palabras, factorizada por prefijos
+    
+    ['no-reply', 'noreply', 'notifications'] -> no(?:\\-reply|reply|tifications):
+    el motor descarta ramas enteras con un solo carácter, como un autómata.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True  # Fin de palabra
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    
+    ends_here = '' in node
+    if len(branches) == 1 and not ends_here:
+        return branches[0]
+    
+    pattern = f"(?:{'|'.join(branches)})"
+    # Opcional: la palabra puede terminar aquí (la rama más larga se prueba antes)
+    return pattern + '?' if ends_here else pattern
+
+
+def _shift_group_references(pattern, offset):
+    """
+    Desplaza las referencias numeradas de una expresión que se combina con otras
+    
+    Dentro de la expresión combinada el grupo N de la regla pasa a ser el
+    N + offset, así que \\N y (?(N)...) se renumeran igual. Se sigue la misma
+    lectura que re: en una clase [...] o con tres dígitos octales, \\N es un
+    carácter y no una referencia.
+    
+    Raises:
+        re.error: Si una referencia desplazada pasa de \\99 (el máximo de re)
+    """
+    digits, octal = '0123456789', '01234567'
+    parts = []
+    position = 0
+    in_class = False
+    while position < len(pattern):
+        char = pattern[position]
+        
+        if char == '\\' and position + 1 < len(pattern):
+            escape = pattern[position:position + 2]
+            position += 2
+            if in_class or escape[1] not in digits[1:]:
+                parts.append(escape)
+                continue
+            
+            number = escape[1]
+            if position < len(pattern) and pattern[position] in digits:
+                number += pattern[position]
+                position += 1
+                if number[0] in octal and number[1] in octal and position < len(pattern) and pattern[position] in octal:
+                    parts.append('\\' + number + pattern[position])  # Escape octal \\ooo
+                    position += 1
+                    continue
+            
+            group = int(number) + offset
+            if group > 99:
+                raise re.error(f"la referencia \\{number} quedaría como \\{group} (máximo \\99)")
+            # Entre (?:...) para que un dígito que siga no se lea como parte del número
+            parts.append(f"(?:\\{group})")
+            continue
+        
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # ']' justo al abrir la clase (o tras '^') es un carácter más
+            end = position + 1
+            if pattern.startswith('^', end):
+                end += 1
+            if pattern.startswith(']', end):
+                end += 1
+            parts.append(pattern[position:end])
+            position = end
+            continue
+        elif pattern.startswith('(?(', position):
+            end = pattern.find(')', position)
+            reference = pattern[position + 3:end]
+            if end > 0 and reference.isascii() and reference.isdigit():
+                parts.append(f"(?({int(reference) + offset})")
+                position = end + 1
+                continue
+        
+        parts.append(char)
+        position += 1
+    return ''.join(parts)
+
+
+def rule_pattern(rule):
+    """
+    Expresión regular de una regla
+    
+    Las palabras clave coinciden como palabras completas y los dominios, con
+    el dominio o cualquiera de sus subdominios al final del campo. Palabras y
+    dominios no distinguen mayúsculas; las expresiones, solo con
+    "ignorar_mayusculas": true.
+    """
+    if 'regex' in rule:
+        pattern = rule['regex']
+        ignore_case = rule.get('ignorar_mayusculas', False)
+    elif 'palabras' in rule:
+        pattern = rf"(?<!\w){_trie_pattern(word.lower() for word in rule['palabras'])}(?!\w)"
+        ignore_case = rule.get('ignorar_mayusculas', True)
+    elif 'dominios' in rule:
+        domains = (domain.lower().strip('.') for domain in rule['dominios'])
+        pattern = rf"(?:^|(?<=[@.])){_trie_pattern(domains)}$"
+        ignore_case = rule.get('ignorar_mayusculas', True)
+    else:
+        raise ValueError(f"Regla sin 'regex', 'palabras' ni 'dominios': {rule}")
+    
+    return f"(?i:{pattern})" if ignore_case else pattern
+
+
+class RuleEngine:
+    """Reglas compiladas: una expresión combinada por campo"""
+    
+    def __init__(self, rules):
+        """
+        Args:
+            rules (list): Reglas (ver load_rules)
+        
+        Raises:
+            ValueError: Si una regla no es válida
+        """
+        self.rules = rules
+        self.tags = []  # Nombres de etiqueta en orden de aparición (columnas)
+        self.matchers = {}  # campo -> (expresión combinada, {índice de grupo: regla})
+        self.counts = {}  # etiqueta -> correos etiquetados
+        
+        alternatives = {}
+        for position, rule in enumerate(rules, 1):
+            if not rule.get('campo') or not rule.get('etiquetas'):
+                raise ValueError(f"La regla {position} necesita 'campo' y 'etiquetas'")
+            try:
+                pattern = rule_pattern(rule)
+                groups = re.compile(pattern).groups
+            except re.error as e:
+                raise ValueError(f"Expresión no válida en la regla {position}: {str(e)}")
+            
+            compiled_rule = {
+                'etiquetas': [(tag, self._compile_template(str(value))) for tag, value in rule['etiquetas'].items()],
+                'grupos': groups
+            }
+            alternatives.setdefault(rule['campo'], []).append((pattern, compiled_rule))
+            for tag in rule['etiquetas']:
+                if tag not in self.tags:
+                    self.tags.append(tag)
+                    self.counts[tag] = 0
+        
+        for field, field_rules in alternatives.items():
+            # Cada regla es un grupo externo; sus propios grupos (y sus referencias
+            # \N) van a continuación
+            by_group = {}
+            branches = []
+            group = 1
+            try:
+                for pattern, compiled_rule in field_rules:
+                    by_group[group] = compiled_rule
+                    compiled_rule['desplazamiento'] = group
+                    branches.append(f"({_shift_group_references(pattern, group)})")
+                    group += compiled_rule['grupos'] + 1
+                
+                self.matchers[field] = (re.compile('|'.join(branches)), by_group)
+            except re.error as e:
+                raise ValueError(f"Las reglas del campo '{field}' no se pueden combinar: {str(e)}")
+    
+    @classmethod
+    def from_file(cls, path=DEFAULT_RULES_PATH):
+        return cls(load_rules(path))
+    
+    @staticmethod
+    def _compile_template(value):
+        """Valor fijo, o lista de (texto, grupo) si usa \\0..\\9"""
+        if not _TEMPLATE_RE.search(value):
+            return value
+        parts = _TEMPLATE_RE.split(value)
+        return [(parts[index], int(parts[index + 1]) if index + 1 < len(parts) else None)
+                for index in range(0, len(parts), 2)]
+    
+    def classify(self, email_data):
+        """
+        Añade 'etiquetas' al correo: {etiqueta: valor}, con todas las etiquetas
+        presentes ('' si no coincide ninguna regla) para que las columnas sean fijas
+        
+        Si una etiqueta coincide varias veces, se unen los valores distintos con '; '.
+        """
+        found = {}
+        for field, (combined, by_group) in self.matchers.items():
+            text = email_data.get(field)
+            if not text:
+                continue
+            
+            for match in combined.finditer(str(text)):
+                # El grupo externo de la regla es el último en cerrarse
+                rule = by_group[match.lastindex]
+                offset = rule['desplazamiento']
+                for tag, template in rule['etiquetas']:
+                    value = template if isinstance(template, str) else ''.join(
+                        text_part + ((match.group(offset + group) or '') if group is not None else '')
+                        for text_part, group in template
+                    )
+                    values = found.setdefault(tag, [])
+                    if value and value not in values:
+                        values.append(value)
+        
+        tags = {}
+        for tag in self.tags:
+            values = found.get(tag)
+            tags[tag] = '; '.join(values) if values else ''
+            if values:
+                self.counts[tag] += 1
+        email_data['etiquetas'] = tags
+        return email_data
+    
+    def classify_stream(self, emails):
+        """Etiqueta los correos a medida que llegan (p. ej. del iterador de un gestor)"""
+        for email_data in emails:
+            yield self.classify(email_data)
+    
+    def classify_parallel(self, emails, workers=None, chunk_size=CHUNK_SIZE):
+        """
+        Etiqueta los correos en un pool de procesos, conservando el orden
+        
+        Para reprocesar exportaciones grandes: cada proceso compila las reglas
+        una vez y recibe los correos en bloques de chunk_size. Solo hay unos
+        pocos bloques en curso, así que la entrada puede ser un iterador enorme.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.rules,)) as executor:
+            pending = deque()
+            for chunk in _iter_chunks(emails, chunk_size):
+                pending.append(executor.submit(_classify_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield from self._count(pending.popleft().result())
+            while pending:
+                yield from self._count(pending.popleft().result())
+    
+    def _count(self, emails):
+        for email_data in emails:
+            for tag, value in email_data['etiquetas'].items():
+                if value:
+                    self.counts[tag] += 1
+            yield email_data
+    
+    def summary(self):
+        """Resumen legible de los correos etiquetados"""
+        return ', '.join(f"{tag}: {count}" for tag, count in self.counts.items())
+
+
+def _iter_chunks(emails, chunk_size):
+    chunk = []
+    for email_data in emails:
+        chunk.append(email_data)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+_worker_engine = None
+
+
+def _init_worker(rules):
+    """Compila las reglas una vez en cada proceso del pool"""
+    global _worker_engine
+    _worker_engine = RuleEngine(rules)
+
+
+def _classify_chunk(emails):
+    return [_worker_engine.classify(email_data) for email_data in emails]
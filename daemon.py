@@ -0,0 +1,457 @@
+# daemon.py
+"""
+Servicio residente: mantiene los gestores autenticados y responde por HTTP local
+- La autenticación, el login IMAP y el índice de carpetas se hacen una sola vez;
+  en segundo plano se renueva el token y se mantienen vivas las conexiones
+- API JSON en 127.0.0.1 (o en un socket Unix): GET /estado, POST /resumen y
+  POST /exportar
+- Cada petición lleva el token del archivo de token (solo legible por el
+  usuario), un Host local y, en POST, Content-Type: application/json; así una
+  página web abierta en el navegador no puede usar la API (CSRF, DNS rebinding)
+- Varias peticiones a la vez: cada una usa un gestor del pool (con Graph API
+  comparten la sesión HTTP y la caché de carpetas; con IMAP cada gestor tiene
+  su propia conexión ya abierta)
+"""
+
+import hmac
+import json
+import os
+import queue
+import secrets
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from export_columns import INTERNAL_KEYS
+
+# Puerto por defecto de la API local
+DEFAULT_DAEMON_PORT = 8765
+
+# Gestores que pueden atender peticiones a la vez
+DEFAULT_POOL_SIZE = 4
+
+# Segundos entre renovaciones del token y NOOP de las conexiones inactivas
+# (los servidores IMAP cierran las conexiones inactivas a los ~30 minutos)
+KEEPALIVE_INTERVAL = 240
+
+# Carpetas por defecto de las peticiones (las mismas que el modo interactivo)
+DEFAULT_FOLDERS = ['inbox', '1 - JIRA']
+
+# Tamaño máximo del cuerpo JSON de una petición
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# Directorio en el que /exportar escribe los archivos (relativo al directorio de trabajo)
+DEFAULT_EXPORT_DIR = 'exportaciones'
+
+# Archivo del token de la API en el directorio de datos del usuario
+TOKEN_FILENAME = 'servicio_token'
+
+# Nombres de host aceptados en la cabecera Host
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '[::1]')
+
+
+def default_token_path():
+    """Archivo del token de la API (en el directorio de datos del usuario)"""
+    from rate_limiter import user_cache_dir
+    return os.path.join(user_cache_dir(), TOKEN_FILENAME)
+
+
+def write_token(path):
+    """
+    Genera un token nuevo y lo guarda en un archivo legible solo por el usuario (0600)
+    
+    Returns:
+        str: Token que deben enviar los clientes en 'Authorization: Bearer <token>'
+    """
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as token_file:
+        token_file.write(token)
+    # O_CREAT no cambia los permisos de un archivo que ya existía
+    os.chmod(path, 0o600)
+    return token
+
+
+class ManagerPool:
+    """Gestores autenticados reutilizados entre peticiones (uno por petición en curso)"""
+    
+    def __init__(self, manager, size=DEFAULT_POOL_SIZE):
+        """
+        Args:
+            manager: Gestor ya autenticado; los demás se crean con su clone()
+                a medida que hacen falta (sin clone(), las peticiones se atienden de una en una)
+            size (int): Gestores máximos
+        """
+        self.template = manager
+        self.size = size if hasattr(manager, 'clone') else 1
+        self.created = 1
+        self.idle = queue.LifoQueue()  # El último usado es el que tiene la conexión más caliente
+        self.idle.put(manager)
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Toma un gestor libre, crea otro si aún cabe o espera a que se libere uno"""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self.lock:
+            can_create = self.created < self.size
+            if can_create:
+                self.created += 1
+        
+        if can_create:
+            manager = None
+            try:
+                manager = self.template.clone()
+            except Exception as e:
+                print(f"⚠️ No se pudo crear otro gestor: {str(e)}")
+            if manager is not None:
+                return manager
+            # No se puede clonar (p. ej. IMAP sin connection_factory): se comparte el existente
+            with self.lock:
+                self.created -= 1
+                self.size = self.created
+        
+        return self.idle.get()
+    
+    def release(self, manager):
+        self.idle.put(manager)
+    
+    def discard(self, manager):
+        """Descarta un gestor que ya no responde (se creará otro si hace falta)"""
+        with self.lock:
+            self.created -= 1
+    
+    def drain_idle(self):
+        """Saca todos los gestores libres (para comprobarlos y devolverlos con release)"""
+        managers = []
+        while True:
+            try:
+                managers.append(self.idle.get_nowait())
+            except queue.Empty:
+                return managers
+
+
+class MailDaemon:
+    """Atiende las peticiones de la API local con los gestores ya autenticados"""
+    
+    def __init__(self, email_manager, authenticator, pool_size=DEFAULT_POOL_SIZE, rule_engine=None,
+                 export_dir=DEFAULT_EXPORT_DIR, token_path=None):
+        """
+        Args:
+            email_manager: Gestor autenticado (EmailManager, GraphEmailManager o AutoBackend)
+            authenticator: Autenticador del gestor (renueva el token de Graph API)
+            pool_size (int): Peticiones atendidas a la vez
+            rule_engine (RuleEngine): Reglas de clasificación que se aplican a las exportaciones
+            export_dir (str): Directorio del que no pueden salir los archivos de /exportar
+            token_path (str): Archivo del token de la API (por defecto, default_token_path())
+        """
+        self.pool = ManagerPool(email_manager, pool_size)
+        self.authenticator = authenticator
+        self.rule_engine = rule_engine
+        self.export_dir = os.path.realpath(export_dir)
+        self.token_path = os.path.abspath(token_path) if token_path else default_token_path()
+        self.token = None
+        self.method = getattr(email_manager, 'BACKEND_NAME', None) or 'auto'
+        self.user_info = email_manager.get_user_info()
+        
+        # Índice de carpetas en caché antes de la primera petición (los clones lo comparten)
+        for backend in getattr(email_manager, 'backends', [email_manager]):
+            if hasattr(backend, '_resolve_folder_ids'):
+                backend._resolve_folder_ids(DEFAULT_FOLDERS)
+        
+        # El token de Graph API sale del autenticador emparejado con el gestor de Graph
+        if hasattr(email_manager, 'backends'):
+            pairs = list(zip(email_manager.backends, authenticator.authenticators))
+        else:
+            pairs = [(email_manager, authenticator)]
+        token_sources = [
+            source for backend, source in pairs
+            if hasattr(backend, 'set_access_token') and hasattr(source, 'get_access_token')
+        ]
+        self.token_source = token_sources[0] if token_sources else None
+        self.token_lock = threading.Lock()
+        
+        self.started = datetime.now()
+        self.requests = 0
+        self.active = 0
+        self.stats_lock = threading.Lock()
+        self.stop_event = threading.Event()
+    
+    def serve(self, port=DEFAULT_DAEMON_PORT, socket_path=None):
+        """Atiende peticiones hasta Ctrl+C (en localhost o en el socket Unix indicado)"""
+        self.token = write_token(self.token_path)
+        
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = UnixHTTPServer(socket_path, DaemonRequestHandler)
+            address = f"unix:{socket_path}"
+        else:
+            server = ThreadingHTTPServer(('127.0.0.1', port), DaemonRequestHandler)
+            address = f"http://127.0.0.1:{port}"
+        server.mail_daemon = self
+        
+        keepalive = threading.Thread(target=self._keepalive, daemon=True)
+        keepalive.start()
+        
+        print(f"🛰️ Servicio escuchando en {address} (Ctrl+C para terminar)")
+        print("   GET /estado · POST /resumen · POST /exportar")
+        print(f"   🔑 Token en {self.token_path} (cabecera 'Authorization: Bearer <token>')")
+        print(f"   📁 Exportaciones en {self.export_dir}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print(f"\n🛑 Servicio detenido: {self.requests} peticiones atendidas")
+        finally:
+            self.stop_event.set()
+            server.server_close()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+    
+    def status(self, params=None):
+        """Estado del servicio"""
+        return {
+            'metodo': self.method,
+            'usuario': self.user_info,
+            'activo_desde': self.started.isoformat(timespec='seconds'),
+            'peticiones': self.requests,
+            'en_curso': self.active,
+            'gestores': self.pool.created,
+            'etiquetas': self.rule_engine.tags if self.rule_engine else []
+        }
+    
+    def summary(self, params):
+        """Conteos por carpeta y día calculados en el servidor (sin descargar correos)"""
+        start_date, end_date, folders = self._parse_range(params)
+        with self._manager() as email_manager:
+            counts = email_manager.get_email_counts(start_date, end_date, folders)
+        return {'conteos': counts}
+    
+    def export(self, params):
+        """
+        Descarga los correos del rango; con 'archivo' los exporta a Excel y, si
+        no, los devuelve en la respuesta
+        """
+        from dedup import MessageDeduplicator
+        from search_index import SearchIndex
+        
+        start_date, end_date, folders = self._parse_range(params)
+        attachment_info = params.get('adjuntos')
+        if attachment_info not in (None, 'resumen', 'detalle'):
+            raise ValueError("'adjuntos' debe ser 'resumen' o 'detalle'")
+        include_threads = bool(params.get('hilos'))
+        preview_length = params.get('vista_previa')
+        if preview_length is not None and (not isinstance(preview_length, int) or preview_length <= 0):
+            raise ValueError("'vista_previa' debe ser un número de caracteres")
+        filename = params.get('archivo')
+        if filename is not None:
+            self._export_path(filename)
+        dedup_mode = params.get('deduplicacion', 'memoria')
+        if dedup_mode not in ('memoria', 'disco', 'bloom'):
+            raise ValueError("'deduplicacion' debe ser 'memoria', 'disco' o 'bloom'")
+        
+        # El modo 'disco' y el índice de búsqueda usan WAL con transacciones cortas:
+        # las peticiones simultáneas comparten sus archivos sin bloquearse
+        with self._manager() as email_manager, MessageDeduplicator(dedup_mode) as deduplicator:
+            email_manager.preview_length = preview_length
+            # Graph API: una consulta para todas las carpetas y $orderby solo si se pide
+            for backend in getattr(email_manager, 'backends', [email_manager]):
+                if hasattr(backend, 'cross_folder_query'):
+                    backend.cross_folder_query = params.get('consulta_unica', False)
+                    backend.ordered = params.get('ordenado', True)
+            email_stream = email_manager.iter_emails_in_date_range(
+                start_date, end_date, folders,
+                attachment_info=attachment_info, deduplicator=deduplicator,
+                include_threads=include_threads
+            )
+            if self.rule_engine:
+                email_stream = self.rule_engine.classify_stream(email_stream)
+            # El índice local de búsqueda se actualiza a medida que llegan los correos
+            with SearchIndex() as search_index:
+                emails = list(search_index.index_stream(email_stream))
+            
+            if filename:
+                path = self._export_path(filename)
+                email_manager.export_to_excel(emails, path, include_threads=include_threads)
+                return {'total': len(emails), 'archivo': path}
+        
+        records = [{key: value for key, value in email_data.items() if key not in INTERNAL_KEYS} for email_data in emails]
+        return {'total': len(records), 'correos': records}
+    
+    def _export_path(self, filename):
+        """Ruta absoluta de 'archivo', que debe quedar dentro del directorio de exportación"""
+        if not isinstance(filename, str) or not filename:
+            raise ValueError("'archivo' debe ser un nombre de archivo")
+        path = os.path.realpath(os.path.join(self.export_dir, filename))
+        try:
+            inside = os.path.commonpath([path, self.export_dir]) == self.export_dir and path != self.export_dir
+        except ValueError:
+            inside = False  # Otra unidad (Windows)
+        if not inside:
+            raise ValueError(f"'archivo' debe quedar dentro de {self.export_dir}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+    
+    def _parse_range(self, params):
+        """Fechas ('desde'/'hasta', YYYY-MM-DD; por defecto los últimos 7 días) y carpetas"""
+        try:
+            end_date = datetime.strptime(params['hasta'], '%Y-%m-%d') if params.get('hasta') else datetime.now()
+            end_date = end_date.replace(hour=23, minute=59, second=59)
+            start_date = datetime.strptime(params['desde'], '%Y-%m-%d') if params.get('desde') else end_date - timedelta(days=7)
+            start_date = start_date.replace(hour=0, minute=0, second=0)
+        except (TypeError, ValueError):
+            raise ValueError("Formato de fecha inválido. Usa YYYY-MM-DD")
+        
+        folders = params.get('carpetas') or DEFAULT_FOLDERS
+        if isinstance(folders, str):
+            folders = [folders]
+        return start_date, end_date, list(folders)
+    
+    @contextmanager
+    def _manager(self):
+        """Gestor del pool con el token vigente, devuelto al terminar la petición"""
+        email_manager = self.pool.acquire()
+        with self.stats_lock:
+            self.active += 1
+        try:
+            self._apply_token(email_manager)
+            yield email_manager
+        finally:
+            with self.stats_lock:
+                self.active -= 1
+            self.pool.release(email_manager)
+    
+    def _apply_token(self, email_manager):
+        """Pasa el token de Graph API (renovado si está a punto de caducar) al gestor"""
+        if self.token_source is None:
+            return
+        with self.token_lock:
+            token = self.token_source.get_access_token()
+        for backend in getattr(email_manager, 'backends', [email_manager]):
+            if hasattr(backend, 'set_access_token') and token and backend.access_token != token:
+                backend.set_access_token(token)
+    
+    def _keepalive(self):
+        """Renueva el token y comprueba las conexiones inactivas periódicamente"""
+        while not self.stop_event.wait(KEEPALIVE_INTERVAL):
+            for email_manager in self.pool.drain_idle():
+                try:
+                    self._apply_token(email_manager)
+                    alive = email_manager.ping()
+                except Exception:
+                    alive = False
+                
+                if alive or self.pool.size == 1:
+                    if not alive:
+                        print("⚠️ El gestor no responde; se reintentará en la próxima petición")
+                    self.pool.release(email_manager)
+                else:
+                    print("⚠️ Conexión inactiva cerrada por el servidor; se abrirá otra cuando haga falta")
+                    self.pool.discard(email_manager)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """Peticiones JSON de la API local"""
+    
+    server_version = 'CorreoDaemon/1.0'
+    
+    GET_ROUTES = {'/estado': 'status'}
+    POST_ROUTES = {'/resumen': 'summary', '/exportar': 'export'}
+    
+    def do_GET(self):
+        if self._authorized():
+            self._dispatch(self.GET_ROUTES, {})
+    
+    def do_POST(self):
+        if not self._authorized():
+            return
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self._send(415, {'error': 'El cuerpo debe enviarse con Content-Type: application/json'})
+            return
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_SIZE:
+            self._send(413, {'error': 'Petición demasiado grande'})
+            return
+        
+        try:
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send(400, {'error': 'El cuerpo debe ser JSON'})
+            return
+        if not isinstance(params, dict):
+            self._send(400, {'error': 'El cuerpo debe ser un objeto JSON'})
+            return
+        
+        self._dispatch(self.POST_ROUTES, params)
+    
+    def _authorized(self):
+        """Comprueba el Host (contra DNS rebinding) y el token; si fallan, responde con el error"""
+        host = (self.headers.get('Host') or '').lower()
+        # Sin el puerto: 'localhost:8765' -> 'localhost', '[::1]:8765' -> '[::1]'
+        hostname = host.rsplit(':', 1)[0] if host.rfind(':') > host.rfind(']') else host
+        if hostname not in LOCAL_HOSTS:
+            self._send(403, {'error': f"Host no permitido: {host or '(vacío)'}"})
+            return False
+        
+        # Las cabeceras llegan decodificadas en latin-1; se comparan como bytes en tiempo constante
+        expected = f"Bearer {self.server.mail_daemon.token}".encode('latin-1')
+        if not hmac.compare_digest((self.headers.get('Authorization') or '').encode('latin-1'), expected):
+            self._send(401, {'error': 'Falta el token o no es válido (Authorization: Bearer <token>)'})
+            return False
+        return True
+    
+    def _dispatch(self, routes, params):
+        handler_name = routes.get(self.path.split('?')[0])
+        if handler_name is None:
+            self._send(404, {'error': f"Ruta desconocida: {self.path}"})
+            return
+        
+        mail_daemon = self.server.mail_daemon
+        start = time.perf_counter()
+        try:
+            result = getattr(mail_daemon, handler_name)(params)
+            status = 200
+        except ValueError as e:
+            result, status = {'error': str(e)}, 400
+        except Exception as e:
+            print(f"❌ Error atendiendo {self.path}: {str(e)}")
+            result, status = {'error': str(e)}, 500
+        
+        with mail_daemon.stats_lock:
+            mail_daemon.requests += 1
+        result['segundos'] = round(time.perf_counter() - start, 3)
+        self._send(status, result)
+    
+    def _send(self, status, data):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        print(f"🌐 {self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """Servidor HTTP en un socket Unix (un hilo por petición)"""
+        
+        daemon_threads = True
+        
+        def get_request(self):
+            # Los sockets Unix no tienen dirección de cliente; http.server espera (host, puerto)
+            request, _ = super().get_request()
+            return request, ('local', 0)
+else:
+    UnixHTTPServer = None
@@ -0,0 +1,201 @@
+# dedup.py
+"""
+De-duplicación de correos entre carpetas y entre ejecuciones
+- Clave: Message-ID (IMAP) o internetMessageId (Graph API)
+- Alternativa: hash de asunto normalizado + fecha + remitente
+"""
+
+import hashlib
+import math
+import sqlite3
+
+from threads import normalize_subject
+
+# Archivo por defecto del modo en disco (persistente entre ejecuciones)
+DEFAULT_DEDUP_PATH = 'correos_vistos.db'
+
+# Segundos que el modo en disco espera a que otra descarga libere el archivo
+BUSY_TIMEOUT = 30
+
+# Modos disponibles
+MODE_MEMORY = 'memoria'
+MODE_DISK = 'disco'
+MODE_BLOOM = 'bloom'
+
+
+def message_key(message_id=None, email_data=None, scope=None):
+    """
+    Calcula la clave compacta (entero de 64 bits) que identifica un correo
+    
+    Args:
+        message_id (str): Message-ID / internetMessageId, si se conoce
+        email_data (dict): Correo procesado (para la clave alternativa)
+        scope (str): Ámbito de la clave (p. ej. el buzón): el mismo correo en
+            dos ámbitos distintos no se considera repetido
+    
+    Returns:
+        int: Clave del correo, o None si no hay datos suficientes
+    """
+    if message_id:
+        source = 'mid:' + message_id.strip().strip('<>').lower()
+    elif email_data:
+        subject = ' '.join(normalize_subject(email_data.get('asunto')).casefold().split())
+        source = '\x1f'.join([
+            'hash:',
+            subject,
+            str(email_data.get('fecha', '')),
+            str(email_data.get('remitente_email', '')).lower()
+        ])
+    else:
+        return None
+    
+    if scope:
+        source = f"{scope.lower()}\x1f{source}"
+    digest = hashlib.blake2b(source.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre claves de 64 bits (memoria fija, admite falsos positivos)"""
+    
+    def __init__(self, expected_items=5_000_000, error_rate=0.001):
+        self.size = max(8, int(-expected_items * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / expected_items * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, key):
+        # Doble hashing: h1 + i*h2 a partir de una única clave de 64 bits
+        key &= 0xFFFFFFFFFFFFFFFF
+        first = key & 0xFFFFFFFF
+        second = (key >> 32) | 1
+        for index in range(self.hash_count):
+            yield (first + index * second) % self.size
+    
+    def __contains__(self, key):
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                return False
+        return True
+    
+    def add(self, key):
+        """Añade la clave; devuelve True si (probablemente) ya estaba"""
+        present = True
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                present = False
+                self.bits[byte] |= 1 << bit
+        return present
+
+
+class MessageDeduplicator:
+    """Detecta correos repetidos y conserva la lista de carpetas en las que aparecen"""
+    
+    def __init__(self, mode=MODE_MEMORY, path=DEFAULT_DEDUP_PATH, expected_items=5_000_000, error_rate=0.001):
+        """
+        Args:
+            mode (str): 'memoria' (conjunto en memoria, por defecto), 'disco'
+                (SQLite persistente entre ejecuciones) o 'bloom' (memoria fija
+                para cargas de millones de correos; puede omitir algún correo
+                único con probabilidad error_rate)
+            path (str): Archivo SQLite del modo 'disco'
+            expected_items (int): Número de correos previsto (modo 'bloom')
+            error_rate (float): Tasa de falsos positivos admitida (modo 'bloom')
+        """
+        self.mode = mode
+        self.duplicates = 0
+        self.folders = {}
+        self.bloom = None
+        self.connection = None
+        
+        if mode == MODE_DISK:
+            # Cada escritura es su propia transacción (WAL): varias descargas a la vez
+            # (p. ej. peticiones del servicio residente) comparten el archivo sin
+            # mantenerlo bloqueado mientras esperan a la red
+            self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS vistos (clave INTEGER PRIMARY KEY, carpetas TEXT NOT NULL)"
+            )
+        elif mode == MODE_BLOOM:
+            self.bloom = BloomFilter(expected_items, error_rate)
+        elif mode != MODE_MEMORY:
+            raise ValueError(f"Modo de de-duplicación desconocido: {mode}")
+    
+    def contains(self, message_id=None, email_data=None, scope=None):
+        """
+        Indica si el correo ya se había registrado, sin registrarlo
+        
+        Permite omitir un duplicado antes de decodificarlo y dejar el registro
+        (check) para cuando el correo se entregue de verdad.
+        """
+        key = message_key(message_id, email_data, scope)
+        if key is None:
+            return False
+        if self.mode == MODE_MEMORY:
+            return key in self.folders
+        if self.mode == MODE_DISK:
+            return self.connection.execute("SELECT 1 FROM vistos WHERE clave = ?", (key,)).fetchone() is not None
+        return key in self.bloom
+    
+    def check(self, folder, message_id=None, email_data=None, scope=None):
+        """
+        Registra el correo y comprueba si ya se había visto
+        
+        Args:
+            folder (str): Carpeta en la que aparece el correo
+            message_id (str): Message-ID / internetMessageId (preferido)
+            email_data (dict): Correo procesado, si no hay message_id
+            scope (str): Ámbito de la clave (ver message_key)
+        
+        Returns:
+            list: Carpetas del correo si es nuevo (en modo 'memoria' la lista se
+                sigue completando con las carpetas de sus duplicados), o None si
+                es un duplicado que debe omitirse
+        """
+        key = message_key(message_id, email_data, scope)
+        if key is None:
+            return [folder]
+        
+        if self.mode == MODE_MEMORY:
+            folders = self.folders.get(key)
+            if folders is None:
+                folders = self.folders[key] = [folder]
+                return folders
+            if folder not in folders:
+                folders.append(folder)
+        
+        elif self.mode == MODE_DISK:
+            # INSERT OR IGNORE: si otra descarga lo registra a la vez, solo una lo entrega
+            inserted = self.connection.execute(
+                "INSERT OR IGNORE INTO vistos (clave, carpetas) VALUES (?, ?)", (key, folder)
+            ).rowcount
+            if inserted:
+                return [folder]
+            row = self.connection.execute("SELECT carpetas FROM vistos WHERE clave = ?", (key,)).fetchone()
+            folders = row[0].split('\x1f')
+            if folder not in folders:
+                folders.append(folder)
+                self.connection.execute(
+                    "UPDATE vistos SET carpetas = ? WHERE clave = ?", ('\x1f'.join(folders), key)
+                )
+        
+        elif not self.bloom.add(key):
+            return [folder]
+        
+        self.duplicates += 1
+        return None
+    
+    def close(self):
+        """Libera recursos (en modo 'disco' cada correo ya se guardó al registrarlo)"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
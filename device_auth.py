@@ -8,6 +8,8 @@ import time
 import json
 import webbrowser
 
+from app_auth import TOKEN_REFRESH_MARGIN
+
 class DeviceCodeAuthenticator:
     """Autenticador usando Device Code Flow (más compatible)"""
     
@@ -15,8 +17,11 @@ class DeviceCodeAuthenticator:
         # Cliente público de Microsoft que funciona con Device Code Flow
         self.client_id = "14d82eec-204b-4c2f-b7e8-296a70dab67e"  # Microsoft Graph PowerShell
         self.tenant = "common"
-        self.scopes = ["https://graph.microsoft.com/Mail.Read", "https://graph.microsoft.com/User.Read"]
+        # offline_access: refresh token para renovar el acceso sin repetir el Device Code
+        self.scopes = ["https://graph.microsoft.com/Mail.Read", "https://graph.microsoft.com/User.Read", "offline_access"]
         self.access_token = None
+        self.refresh_token = None
+        self.expires_at = 0
         self.user_info = None
     
     def authenticate(self):
@@ -103,7 +108,7 @@ class DeviceCodeAuthenticator:
                 
                 if response.status_code == 200:
                     # ¡Éxito!
-                    self.access_token = result['access_token']
+                    self._store_token(result)
                     print("\n🎉 ¡Autenticación exitosa!")
                     
                     # Obtener info del usuario
@@ -155,8 +160,42 @@ class DeviceCodeAuthenticator:
         except Exception as e:
             print(f"⚠️  Error obteniendo info del usuario: {str(e)}")
     
+    def _store_token(self, result):
+        """Guarda el token de acceso, su caducidad y el refresh token"""
+        self.access_token = result['access_token']
+        self.refresh_token = result.get('refresh_token', self.refresh_token)
+        self.expires_at = time.time() + int(result.get('expires_in', 3600))
+    
+    def _refresh_access_token(self):
+        """Renueva el token de acceso con el refresh token (sin intervención del usuario)"""
+        token_url = f"https://login.microsoftonline.com/{self.tenant}/oauth2/v2.0/token"
+        token_data = {
+            'grant_type': 'refresh_token',
+            'client_id': self.client_id,
+            'refresh_token': self.refresh_token,
+            'scope': ' '.join(self.scopes)
+        }
+        
+        try:
+            response = requests.post(token_url, data=token_data)
+            result = response.json()
+            
+            if response.status_code != 200:
+                print(f"⚠️  No se pudo renovar el token: {result.get('error_description', response.status_code)}")
+                return False
+            
+            self._store_token(result)
+            print("🔄 Token de acceso renovado")
+            return True
+            
+        except Exception as e:
+            print(f"⚠️  Error renovando el token: {str(e)}")
+            return False
+    
     def get_access_token(self):
-        """Retorna el access token"""
+        """Retorna el access token, renovándolo si está a punto de caducar"""
+        if self.refresh_token and time.time() > self.expires_at - TOKEN_REFRESH_MARGIN:
+            self._refresh_access_token()
         return self.access_token
     
     def get_user_info(self):
@@ -5,50 +5,365 @@ Módulo para gestionar correos electrónicos usando IMAP
 
 import imaplib
 import email
+import base64
 from email.header import decode_header
-from datetime import datetime, timezone
+from datetime import timedelta, timezone
 import re
+import queue
+import threading
+from urllib.parse import unquote
 
-# Importar openpyxl al inicio para evitar problemas de importación tardía
-try:
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    OPENPYXL_AVAILABLE = True
-except ImportError:
-    OPENPYXL_AVAILABLE = False
+from export_columns import (
+    get_export_columns, THREAD_COLUMNS
+)
+from threads import group_threads
+from public_suffix import registrable_domain
+from imap_compress import enable_deflate
+from rate_limiter import limit_imap_connection
+from body_preview import text_preview, preview_fetch_size
+from backends import (
+    MailBackend, JOB_DOWNLOAD, JOB_COUNTS,
+    CAP_INCREMENTAL, CAP_PUSH, CAP_SERVER_COUNT, CAP_HEADER_ONLY
+)
 
-class EmailManager:
+# Cabeceras que se descargan de cada correo (nunca los adjuntos; del cuerpo,
+# solo el comienzo si se pide vista previa)
+HEADER_FIELDS = 'DATE SUBJECT FROM MESSAGE-ID'
+
+# Cabeceras adicionales solo necesarias para reconstruir hilos
+THREAD_HEADER_FIELDS = 'IN-REPLY-TO REFERENCES'
+
+# Cabeceras que necesita la decodificación MIME de la vista previa
+PREVIEW_HEADER_FIELDS = 'CONTENT-TYPE CONTENT-TRANSFER-ENCODING'
+
+# Datos de STATUS que se piden para cada carpeta
+FOLDER_STATUS_ITEMS = '(MESSAGES UNSEEN UIDNEXT UIDVALIDITY)'
+
+
+def parse_imap_data(data):
+    """
+    Convierte datos IMAP (listas entre paréntesis, cadenas, literales, NIL) en objetos Python
+    
+    Args:
+        data (bytes): Datos tal y como los envía el servidor
+        
+    Returns:
+        list: Listas anidadas con bytes (átomos y cadenas) y None (NIL)
+    """
+    stack = [[]]
+    i = 0
+    length = len(data)
+    
+    while i < length:
+        char = data[i:i + 1]
+        
+        if char in (b' ', b'\r', b'\n'):
+            i += 1
+        elif char == b'(':
+            stack.append([])
+            i += 1
+        elif char == b')':
+            if len(stack) > 1:
+                closed = stack.pop()
+                stack[-1].append(closed)
+            i += 1
+        elif char == b'"':
+            # Cadena entre comillas con escapes
+            j = i + 1
+            value = bytearray()
+            while j < length and data[j:j + 1] != b'"':
+                if data[j:j + 1] == b'\\':
+                    j += 1
+                value += data[j:j + 1]
+                j += 1
+            stack[-1].append(bytes(value))
+            i = j + 1
+        elif char == b'{':
+            # Literal {n}\r\n seguido de n bytes
+            j = data.index(b'}', i)
+            size = int(data[i + 1:j])
+            start = j + 1
+            if data[start:start + 2] == b'\r\n':
+                start += 2
+            stack[-1].append(data[start:start + size])
+            i = start + size
+        else:
+            # Átomo (puede contener secciones como BODY[HEADER.FIELDS (DATE)]<0>)
+            j = i
+            depth = 0
+            while j < length:
+                current = data[j:j + 1]
+                if current == b'[':
+                    depth += 1
+                elif current == b']':
+                    depth -= 1
+                elif depth == 0 and current in (b' ', b'(', b')', b'\r', b'\n'):
+                    break
+                j += 1
+            atom = data[i:j]
+            stack[-1].append(None if atom.upper() == b'NIL' else atom)
+            i = j
+    
+    while len(stack) > 1:
+        closed = stack.pop()
+        stack[-1].append(closed)
+    
+    return stack[0]
+
+
+def join_imap_literals(msg_data):
+    """
+    Reconstruye cada respuesta IMAP completa a partir de los datos de imaplib
+    
+    imaplib separa los literales en tuplas (línea, literal) seguidas del resto
+    de la línea; aquí se vuelven a unir para poder usar parse_imap_data.
+    
+    Args:
+        msg_data (list): Datos devueltos por imaplib (bytes y tuplas con literales)
+        
+    Returns:
+        list: Una cadena de bytes por respuesta
+    """
+    raw_responses = []
+    current = None
+    in_literal = False
+    
+    for part in msg_data:
+        if part is None:
+            continue
+        if isinstance(part, tuple):
+            chunk = part[0] + b'\r\n' + part[1]
+            if in_literal:
+                current += chunk
+            else:
+                if current is not None:
+                    raw_responses.append(current)
+                current = chunk
+            in_literal = True
+        else:
+            if in_literal:
+                current += part
+            else:
+                if current is not None:
+                    raw_responses.append(current)
+                current = part
+            in_literal = False
+    
+    if current is not None:
+        raw_responses.append(current)
+    
+    return raw_responses
+
+
+def parse_fetch_response(msg_data):
+    """
+    Convierte la respuesta de imaplib a FETCH en diccionarios por mensaje
+    
+    Args:
+        msg_data (list): Datos devueltos por imaplib (bytes y tuplas con literales)
+        
+    Returns:
+        list: Lista de tuplas (número de secuencia, dict con los elementos del FETCH)
+    """
+    responses = []
+    for raw in join_imap_literals(msg_data):
+        tokens = parse_imap_data(raw)
+        if len(tokens) < 2 or not isinstance(tokens[1], list):
+            continue
+        
+        items = {}
+        values = tokens[1]
+        for index in range(0, len(values) - 1, 2):
+            key = values[index]
+            if isinstance(key, bytes):
+                items[key.decode('ascii', errors='ignore').upper()] = values[index + 1]
+        responses.append((tokens[0], items))
+    
+    return responses
+
+
+def decode_folder_name(name):
+    """Decodifica un nombre de carpeta en UTF-7 modificado (RFC 3501), p. ej. 'Espa&APE-a'"""
+    def decode_chunk(match):
+        chunk = match.group(1)
+        if not chunk:
+            return '&'
+        encoded = chunk.replace(',', '/')
+        encoded += '=' * (-len(encoded) % 4)
+        return base64.b64decode(encoded).decode('utf-16-be')
+    
+    try:
+        return re.sub(r'&([A-Za-z0-9+,]*)-', decode_chunk, name)
+    except (ValueError, UnicodeDecodeError):
+        return name
+
+
+def get_fetch_item(items, prefix):
+    """Obtiene el primer elemento del FETCH cuya clave empieza por prefix (p. ej. 'BODY[HEADER')"""
+    for key, value in items.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+class ImapBodyReader:
+    """Lee mensajes completos por fragmentos (BODY.PEEK[]<n.m>) con una conexión propia"""
+    
+    def __init__(self, connection, quote_folder, close_connection=False, chunk_size=1024 * 1024):
+        """
+        Args:
+            connection (imaplib.IMAP4): Conexión autenticada
+            quote_folder (callable): Convierte el nombre de carpeta para SELECT
+            close_connection (bool): Cerrar la conexión al terminar
+            chunk_size (int): Bytes de cada fragmento
+        """
+        self.connection = connection
+        self.quote_folder = quote_folder
+        self.close_connection = close_connection
+        self.chunk_size = chunk_size
+        self.selected = None
+    
+    def __call__(self, email_data):
+        """Devuelve (UID, iterador de fragmentos) del mensaje indicado"""
+        folder = email_data.get('carpeta') or 'INBOX'
+        if folder != self.selected:
+            typ, _ = self.connection.select(self.quote_folder(folder), readonly=True)
+            if typ != 'OK':
+                raise self.connection.error(f"No se pudo seleccionar {folder}")
+            self.selected = folder
+        return email_data['uid'], self._iter_chunks(email_data['uid'])
+    
+    def _iter_chunks(self, uid):
+        offset = 0
+        while True:
+            typ, data = self.connection.uid('FETCH', str(uid), f'(BODY.PEEK[]<{offset}.{self.chunk_size}>)')
+            responses = parse_fetch_response(data) if typ == 'OK' else []
+            if not responses:
+                raise self.connection.error(f"No se pudo leer el mensaje UID {uid}")
+            
+            chunk = get_fetch_item(responses[0][1], 'BODY[]') or b''
+            if chunk:
+                yield chunk
+            if len(chunk) < self.chunk_size:
+                return
+            offset += len(chunk)
+    
+    def close(self):
+        if self.close_connection:
+            self.connection.logout()
+
+class EmailManager(MailBackend):
     """Clase para gestionar operaciones con correos electrónicos usando IMAP"""
     
-    def __init__(self, imap_connection, email_address):
+    BACKEND_NAME = 'imap'
+    CAPABILITIES = frozenset({CAP_INCREMENTAL, CAP_PUSH, CAP_SERVER_COUNT, CAP_HEADER_ONLY})
+    
+    def __init__(self, imap_connection, email_address, connection_factory=None, compress=True, rate_bucket=None):
+        """
+        Args:
+            imap_connection (imaplib.IMAP4): Conexión IMAP autenticada
+            email_address (str): Dirección de la cuenta
+            connection_factory (callable): Abre otra conexión autenticada con la
+                misma cuenta (necesaria para vigilar varias carpetas a la vez)
+            compress (bool): Negociar COMPRESS=DEFLATE si el servidor lo soporta
+            rate_bucket (MailboxBucket): Presupuesto de comandos compartido con otros
+                procesos que usan el mismo buzón (ver rate_limiter.py)
+        """
+        self.rate_bucket = rate_bucket
+        if rate_bucket:
+            limit_imap_connection(imap_connection, rate_bucket)
+        
         self.imap_connection = imap_connection
         self.email_address = email_address
+        self.connection_factory = connection_factory
+        self.compress = compress
+        self.compression = None
+        self._compression_checked = False
+        
+        # Carpetas con al menos tantos mensajes se acotan por búsqueda binaria
+        # de INTERNALDATE en lugar de SEARCH (None para usar siempre SEARCH)
+        self.binary_search_threshold = 5000
+        
+        # Caracteres de vista previa del cuerpo (None = sin vista previa); solo
+        # se descarga el comienzo del cuerpo con BODY.PEEK[TEXT]<0.N>
+        self.preview_length = None
+        self.failures = 0
     
-    def get_emails_in_date_range(self, start_date, end_date, folder='INBOX'):
+    def get_emails_in_date_range(self, start_date, end_date, folders='INBOX', attachment_info=None, deduplicator=None, include_threads=False):
         """
         Obtiene correos electrónicos en un rango de fechas específico
         
+        Solo se descargan las cabeceras necesarias; con attachment_info se añaden
+        RFC822.SIZE y BODYSTRUCTURE, sin transferir nunca cuerpos ni adjuntos.
+        
         Args:
             start_date (datetime): Fecha de inicio
             end_date (datetime): Fecha de fin
-            folder (str): Carpeta de correo (INBOX, SENT, etc.)
+            folders (str|list): Carpeta o lista de carpetas (INBOX, SENT, etc.)
+            attachment_info (str): None, 'resumen' (tamaño y si tiene adjuntos)
+                o 'detalle' (además número, nombres y tipos de adjuntos)
+            deduplicator (MessageDeduplicator): Omite correos ya vistos (p. ej. copiados
+                por reglas en varias carpetas) antes de decodificarlos
+            include_threads (bool): Descargar también In-Reply-To y References
+                (necesarias para la columna y la hoja de hilos)
             
         Returns:
             list: Lista de diccionarios con información de los correos
         """
+        return list(self.iter_emails_in_date_range(start_date, end_date, folders, attachment_info, deduplicator, include_threads))
+    
+    def iter_emails_in_date_range(self, start_date, end_date, folders='INBOX', attachment_info=None, deduplicator=None, include_threads=False):
+        """
+        Igual que get_emails_in_date_range, pero entrega cada correo en cuanto se procesa
+        
+        Yields:
+            dict: Información de cada correo (incluye la carpeta)
+        """
+        folders = [folders] if isinstance(folders, str) else list(folders)
+        self._negotiate_compression()
+        
         print(f"Obteniendo correos desde {start_date.strftime('%Y-%m-%d')} hasta {end_date.strftime('%Y-%m-%d')}...")
         
+        total = 0
+        for folder_name in folders:
+            if len(folders) > 1:
+                print(f"\nProcesando carpeta: {folder_name}")
+            for processed_email in self._iter_emails_from_folder(start_date, end_date, folder_name, attachment_info, deduplicator, include_threads):
+                total += 1
+                yield processed_email
+        
+        print(f"Total de correos procesados: {total}")
+        if self.rate_bucket:
+            print(f"Presupuesto compartido: {self.rate_bucket.summary()}")
+    
+    def _iter_emails_from_folder(self, start_date, end_date, folder, attachment_info=None, deduplicator=None, include_threads=False):
+        """Obtiene (en streaming) los correos de una carpeta"""
         try:
             # Seleccionar carpeta
-            result = self.imap_connection.select(folder)
+            result = self.imap_connection.select(self._quote_folder(folder), readonly=True)
             if result[0] != 'OK':
                 print(f"Error seleccionando carpeta {folder}")
-                return []
+                self.failures += 1
+                return
+            
+            # Carpetas grandes: rango exacto de UIDs por INTERNALDATE, sin SEARCH
+            message_count = int(result[1][0] or 0) if result[1] and result[1][0] else 0
+            threshold = self.binary_search_threshold
+            if threshold is not None and message_count >= threshold:
+                located = self._fetch_located_range(start_date, end_date, folder, message_count, attachment_info, include_threads)
+                if located is not None:
+                    for items in located:
+                        try:
+                            processed_email = self._process_fetched(items, folder, attachment_info, deduplicator)
+                        except Exception as e:
+                            print(f"Error procesando correo de {folder}: {str(e)}")
+                            continue
+                        if processed_email:
+                            yield processed_email
+                    return
             
-            # Formatear fechas para búsqueda IMAP
+            # Formatear fechas para búsqueda IMAP (BEFORE es exclusivo: día siguiente al fin)
             start_date_str = start_date.strftime('%d-%b-%Y')
-            end_date_str = end_date.strftime('%d-%b-%Y')
+            end_date_str = (end_date + timedelta(days=1)).strftime('%d-%b-%Y')
             
             # Buscar correos en el rango de fechas
             search_criteria = f'(SINCE "{start_date_str}" BEFORE "{end_date_str}")'
@@ -58,7 +373,8 @@ class EmailManager:
             
             if result != 'OK':
                 print("Error en la búsqueda de correos")
-                return []
+                self.failures += 1
+                return
             
             # Obtener lista de IDs de mensajes
             message_id_list = message_ids[0].split()
@@ -67,43 +383,329 @@ class EmailManager:
             print(f"Se encontraron {total_emails} correos en el rango especificado")
             
             if total_emails == 0:
-                return []
+                return
             
-            emails = []
             processed = 0
             
             # Procesar cada correo (limitar a 100 para no sobrecargar)
             max_emails = min(100, total_emails)
             print(f"Procesando los primeros {max_emails} correos...")
             
+            fetch_items = self._fetch_items(attachment_info, include_threads)
+            
             for msg_id in message_id_list[-max_emails:]:  # Obtener los más recientes
                 try:
-                    # Obtener el correo
-                    result, msg_data = self.imap_connection.fetch(msg_id, '(RFC822)')
+                    # Obtener cabeceras (y metadatos) del correo
+                    result, msg_data = self.imap_connection.fetch(msg_id, fetch_items)
                     
                     if result == 'OK' and msg_data[0]:
-                        email_message = email.message_from_bytes(msg_data[0][1])
-                        processed_email = self._process_email(email_message)
-                        
-                        if processed_email:
-                            # Verificar que esté en el rango de fechas correcto
-                            if self._is_email_in_date_range(processed_email, start_date, end_date):
-                                emails.append(processed_email)
+                        responses = parse_fetch_response(msg_data)
+                        if not responses:
+                            continue
                         
                         processed += 1
                         if processed % 10 == 0:
                             print(f"Procesados {processed}/{max_emails} correos...")
+                        
+                        # SEARCH trabaja por días: el rango exacto se comprueba antes de registrar el correo
+                        processed_email = self._process_fetched(
+                            responses[0][1], folder, attachment_info, deduplicator, date_range=(start_date, end_date)
+                        )
+                        if processed_email:
+                            yield processed_email
                             
                 except Exception as e:
                     print(f"Error procesando correo ID {msg_id}: {str(e)}")
+                    self.failures += 1
                     continue
             
-            print(f"Total de correos procesados: {len(emails)}")
-            return emails
+        except Exception as e:
+            print(f"Error obteniendo correos de {folder}: {str(e)}")
+            self.failures += 1
+    
+    def _fetch_located_range(self, start_date, end_date, folder, message_count, attachment_info=None, include_threads=False):
+        """
+        Localiza el rango por búsqueda binaria de INTERNALDATE y lo descarga con un UID FETCH
+        
+        Returns:
+            list: Elementos FETCH de cada correo del rango (ya exacto al segundo,
+                sin filtrar por la cabecera Date), o None si hay que usar SEARCH
+                (carpeta no ordenada por llegada o error del servidor)
+        """
+        from imap_range import InternalDateLocator
+        
+        try:
+            locator = InternalDateLocator(self.imap_connection, message_count)
+            located = locator.locate(start_date, end_date)
+            if located is None:
+                print(f"Fechas de llegada desordenadas en {folder}: se usa SEARCH")
+                return None
+            
+            first, last = located
+            total_emails = max(0, last - first + 1)
+            print(f"Se encontraron {total_emails} correos en el rango especificado ({locator.round_trips} consultas de INTERNALDATE sobre {message_count} mensajes)")
+            if total_emails == 0:
+                return []
+            
+            # Igual que con SEARCH: como máximo los 100 más recientes
+            max_emails = min(100, total_emails)
+            print(f"Procesando los primeros {max_emails} correos...")
+            first_uid = locator.uid_at(last - max_emails + 1)
+            last_uid = locator.uid_at(last)
+            if not locator.ordered:
+                print(f"Fechas de llegada desordenadas en {folder}: se usa SEARCH")
+                return None
             
+            result, msg_data = self.imap_connection.uid(
+                'FETCH', f'{first_uid}:{last_uid}', self._fetch_items(attachment_info, include_threads)
+            )
+            if result != 'OK':
+                print(f"Error descargando el rango de correos de {folder}: se usa SEARCH")
+                return None
+            return [items for _, items in parse_fetch_response(msg_data)]
         except Exception as e:
-            print(f"Error obteniendo correos: {str(e)}")
-            return []
+            print(f"Error localizando el rango en {folder} ({str(e)}): se usa SEARCH")
+            return None
+    
+    def _fetch_items(self, attachment_info=None, include_threads=False):
+        """Elementos FETCH: UID, cabeceras y, si se piden, metadatos de adjuntos y vista previa"""
+        header_fields = f'{HEADER_FIELDS} {THREAD_HEADER_FIELDS}' if include_threads else HEADER_FIELDS
+        if self.preview_length:
+            header_fields = f'{header_fields} {PREVIEW_HEADER_FIELDS}'
+        fetch_items = f'UID BODY.PEEK[HEADER.FIELDS ({header_fields})]'
+        if self.preview_length:
+            fetch_items = f'{fetch_items} BODY.PEEK[TEXT]<0.{preview_fetch_size(self.preview_length)}>'
+        if attachment_info:
+            fetch_items = f'RFC822.SIZE BODYSTRUCTURE {fetch_items}'
+        return f'({fetch_items})'
+    
+    def _process_fetched(self, items, folder, attachment_info=None, deduplicator=None, date_range=None):
+        """
+        Convierte los elementos FETCH de un correo en el diccionario de salida
+        
+        Args:
+            date_range (tuple): (inicio, fin) que debe cumplir la fecha del correo
+        
+        Returns:
+            dict: Correo procesado con su carpeta, o None si es un duplicado, está
+                fuera del rango o no se pudo procesar
+        """
+        email_message = email.message_from_bytes(get_fetch_item(items, 'BODY[HEADER') or b'')
+        
+        # Omitir duplicados por Message-ID antes de decodificar el correo
+        raw_message_id = email_message.get('Message-ID')
+        message_id = str(raw_message_id) if raw_message_id else None
+        if deduplicator and message_id and deduplicator.contains(message_id=message_id):
+            deduplicator.check(folder, message_id=message_id)
+            return None
+        
+        processed_email = self._process_email(email_message)
+        if not processed_email:
+            return None
+        
+        # Solo se registran los correos que se entregan (un correo fuera del rango
+        # no debe contar como visto en las siguientes ejecuciones)
+        if date_range and not self._is_email_in_date_range(processed_email, *date_range):
+            return None
+        
+        # Sin Message-ID se usa la clave alternativa de asunto, fecha y remitente
+        folders = None
+        if deduplicator:
+            if message_id:
+                folders = deduplicator.check(folder, message_id=message_id)
+            else:
+                folders = deduplicator.check(folder, email_data=processed_email)
+            if folders is None:
+                return None
+        
+        if attachment_info:
+            processed_email.update(self._process_attachment_info(items, attachment_info))
+        
+        body_start = get_fetch_item(items, 'BODY[TEXT]')
+        if body_start is not None and self.preview_length:
+            processed_email['vista_previa'] = text_preview(
+                get_fetch_item(items, 'BODY[HEADER'), body_start, self.preview_length
+            )
+        
+        if items.get('UID'):
+            processed_email['uid'] = int(items['UID'])
+        processed_email['carpeta'] = folder
+        if folders is not None:
+            processed_email['carpetas'] = folders
+        return processed_email
+    
+    def iter_new_emails(self, folders='INBOX', deduplicator=None):
+        """
+        Vigila las carpetas con IDLE y entrega los correos nuevos según llegan
+        
+        Cada carpeta usa su propia conexión (IDLE bloquea la conexión en la que
+        se ejecuta), obtenida de connection_factory; sin ella solo se vigila la
+        primera carpeta con la conexión actual. Solo se descargan las cabeceras
+        de los UID nuevos que anuncia el servidor.
+        
+        Args:
+            folders (str|list): Carpeta o lista de carpetas
+            deduplicator (MessageDeduplicator): Omite correos ya entregados
+        
+        Yields:
+            dict: Información de cada correo nuevo (incluye la carpeta)
+        """
+        from imap_idle import ImapFolderWatcher
+        
+        folders = [folders] if isinstance(folders, str) else list(folders)
+        
+        if self.connection_factory:
+            if self.rate_bucket:
+                connect = lambda: limit_imap_connection(self.connection_factory(), self.rate_bucket)
+            else:
+                connect = self.connection_factory
+        else:
+            if len(folders) > 1:
+                print(f"Sin fábrica de conexiones solo se vigila '{folders[0]}'")
+            folders = folders[:1]
+            connect = lambda: self.imap_connection
+        
+        output = queue.Queue()
+        stop_event = threading.Event()
+        fetch_items = self._fetch_items()
+        
+        watchers = [
+            ImapFolderWatcher(
+                connect, folder, self._quote_folder(folder), fetch_items, output, stop_event,
+                close_connections=self.connection_factory is not None
+            )
+            for folder in folders
+        ]
+        for watcher in watchers:
+            watcher.start()
+        
+        try:
+            while True:
+                folder, items = output.get()
+                try:
+                    processed_email = self._process_fetched(items, folder, deduplicator=deduplicator)
+                except Exception as e:
+                    print(f"Error procesando correo nuevo de {folder}: {str(e)}")
+                    continue
+                if processed_email:
+                    yield processed_email
+        finally:
+            stop_event.set()
+            for watcher in watchers:
+                watcher.join(timeout=5)
+    
+    def get_email_counts(self, start_date, end_date, folders='INBOX'):
+        """
+        Obtiene el volumen de correos por carpeta y por día sin descargar mensajes
+        
+        Usa ESEARCH (SEARCH RETURN (COUNT)) si el servidor lo soporta, o SEARCH
+        normal en caso contrario, con una búsqueda por día. Los totales de cada
+        carpeta se obtienen con STATUS.
+        
+        Args:
+            start_date (datetime): Fecha de inicio
+            end_date (datetime): Fecha de fin
+            folders (str|list): Carpeta o lista de carpetas
+        
+        Returns:
+            dict: Totales por carpeta, por día y por carpeta/día
+        """
+        if isinstance(folders, str):
+            folders = [folders]
+        
+        print(f"Contando correos desde {start_date.strftime('%Y-%m-%d')} hasta {end_date.strftime('%Y-%m-%d')} (solo servidor)...")
+        self._negotiate_compression()
+        
+        counts = {
+            'total': 0,
+            'carpetas': {},
+            'dias': {},
+            'carpeta_dia': {},
+            'estado_carpetas': {}
+        }
+        
+        use_esearch = 'ESEARCH' in getattr(self.imap_connection, 'capabilities', ())
+        
+        for folder in folders:
+            quoted_folder = self._quote_folder(folder)
+            
+            try:
+                counts['estado_carpetas'][folder] = self._get_folder_status(quoted_folder)
+                
+                result = self.imap_connection.select(quoted_folder, readonly=True)
+                if result[0] != 'OK':
+                    print(f"Error seleccionando carpeta {folder}")
+                    self.failures += 1
+                    continue
+                
+                folder_days = {}
+                for day in self._iter_days(start_date, end_date):
+                    day_count = self._count_day(day, use_esearch)
+                    if day_count:
+                        day_key = day.strftime('%Y-%m-%d')
+                        folder_days[day_key] = day_count
+                        counts['dias'][day_key] = counts['dias'].get(day_key, 0) + day_count
+                
+                folder_total = sum(folder_days.values())
+                counts['carpetas'][folder] = folder_total
+                counts['carpeta_dia'][folder] = folder_days
+                counts['total'] += folder_total
+                
+                print(f"Carpeta {folder}: {folder_total} correos en el rango")
+            
+            except Exception as e:
+                print(f"Error contando correos de {folder}: {str(e)}")
+                self.failures += 1
+                continue
+        
+        return counts
+    
+    def _count_day(self, day, use_esearch):
+        """Cuenta los correos de un día usando ESEARCH o SEARCH"""
+        since = day.strftime('%d-%b-%Y')
+        before = (day + timedelta(days=1)).strftime('%d-%b-%Y')
+        criteria = f'(SINCE "{since}" BEFORE "{before}")'
+        
+        if use_esearch:
+            typ, data = self.imap_connection.xatom('SEARCH', 'RETURN (COUNT)', criteria)
+            typ, data = self.imap_connection._untagged_response(typ, data, 'ESEARCH')
+            if typ == 'OK' and data and data[0]:
+                match = re.search(rb'COUNT (\d+)', data[0])
+                return int(match.group(1)) if match else 0
+        
+        typ, data = self.imap_connection.search(None, criteria)
+        if typ != 'OK' or not data or not data[0]:
+            return 0
+        return len(data[0].split())
+    
+    def _get_folder_status(self, quoted_folder):
+        """Obtiene total y no leídos de una carpeta usando STATUS"""
+        try:
+            typ, data = self.imap_connection.status(quoted_folder, '(MESSAGES UNSEEN)')
+            if typ == 'OK' and data and data[0]:
+                messages = re.search(rb'MESSAGES (\d+)', data[0])
+                unseen = re.search(rb'UNSEEN (\d+)', data[0])
+                return {
+                    'total': int(messages.group(1)) if messages else 0,
+                    'unread': int(unseen.group(1)) if unseen else 0
+                }
+        except Exception:
+            pass
+        return {'total': 0, 'unread': 0}
+    
+    def _iter_days(self, start_date, end_date):
+        """Genera los días (date) comprendidos en el rango, ambos incluidos"""
+        day = start_date.date()
+        last_day = end_date.date()
+        while day <= last_day:
+            yield day
+            day += timedelta(days=1)
+    
+    def _quote_folder(self, folder):
+        """Entrecomilla el nombre de la carpeta para comandos IMAP (p. ej. '1 - JIRA')"""
+        if folder.startswith('"'):
+            return folder
+        return '"' + folder.replace('\\', '\\\\').replace('"', '\\"') + '"'
     
     def _process_email(self, email_message):
         """
@@ -145,18 +747,129 @@ class EmailManager:
             # Extraer dominio del correo del remitente
             domain = self._extract_domain(sender_email)
             
+            # Identidad del mensaje y referencias para reconstruir hilos
+            message_ids = self._extract_message_ids(email_message.get('Message-ID'))
+            in_reply_to = self._extract_message_ids(email_message.get('In-Reply-To'))
+            
             return {
                 'fecha': date_formatted,
                 'asunto': subject,
                 'remitente_email': sender_email,
                 'dominio_remitente': domain,
-                'fecha_objeto': parsed_date if 'parsed_date' in locals() else None
+                'dominio_registrable': registrable_domain(domain),
+                'fecha_objeto': parsed_date if 'parsed_date' in locals() else None,
+                'message_id': message_ids[0] if message_ids else None,
+                'in_reply_to': in_reply_to[0] if in_reply_to else None,
+                'referencias': self._extract_message_ids(email_message.get('References'))
             }
             
         except Exception as e:
             print(f"Error procesando correo: {str(e)}")
             return None
     
+    def _process_attachment_info(self, items, attachment_info):
+        """
+        Extrae tamaño y adjuntos a partir de RFC822.SIZE y BODYSTRUCTURE
+        
+        Args:
+            items (dict): Elementos del FETCH del correo
+            attachment_info (str): 'resumen' o 'detalle'
+            
+        Returns:
+            dict: Columnas de tamaño y adjuntos
+        """
+        size = items.get('RFC822.SIZE')
+        attachments = []
+        structure = items.get('BODYSTRUCTURE')
+        if isinstance(structure, list):
+            self._collect_attachments(structure, attachments)
+        
+        info = {
+            'tamano': int(size) if size else None,
+            'tiene_adjuntos': bool(attachments)
+        }
+        
+        if attachment_info == 'detalle':
+            info['num_adjuntos'] = len(attachments)
+            info['adjuntos_nombres'] = [name for name, _ in attachments]
+            info['adjuntos_tipos'] = [content_type for _, content_type in attachments]
+        
+        return info
+    
+    def _collect_attachments(self, part, attachments):
+        """Recorre BODYSTRUCTURE y añade (nombre, tipo MIME) de cada adjunto"""
+        if not part:
+            return
+        
+        # Multiparte: las subpartes son listas y van antes del subtipo
+        if isinstance(part[0], list):
+            for subpart in part:
+                if not isinstance(subpart, list):
+                    break
+                self._collect_attachments(subpart, attachments)
+            return
+        
+        maintype = (part[0] or b'').decode('ascii', errors='ignore').lower()
+        subtype = (part[1] or b'').decode('ascii', errors='ignore').lower() if len(part) > 1 else ''
+        params = self._bodystructure_params(part[2] if len(part) > 2 else None)
+        
+        # Los datos de extensión empiezan tras los campos básicos (más líneas en text/*
+        # y sobre, cuerpo y líneas en message/rfc822); el primero es MD5 y luego disposition
+        if maintype == 'text':
+            extension_index = 8
+        elif maintype == 'message' and subtype == 'rfc822':
+            extension_index = 10
+        else:
+            extension_index = 7
+        
+        disposition = part[extension_index + 1] if len(part) > extension_index + 1 else None
+        disposition_type = ''
+        disposition_params = {}
+        if isinstance(disposition, list) and disposition:
+            disposition_type = (disposition[0] or b'').decode('ascii', errors='ignore').lower()
+            disposition_params = self._bodystructure_params(disposition[1] if len(disposition) > 1 else None)
+        
+        name = (disposition_params.get('filename') or disposition_params.get('filename*')
+                or params.get('name') or params.get('name*'))
+        
+        is_attachment = (
+            disposition_type == 'attachment'
+            or (maintype == 'message' and subtype == 'rfc822')
+            or (name and maintype != 'text')
+        )
+        
+        if is_attachment:
+            attachments.append((name or 'Sin nombre', f"{maintype}/{subtype}"))
+    
+    def _bodystructure_params(self, params):
+        """Convierte la lista de parámetros de BODYSTRUCTURE en diccionario decodificado"""
+        result = {}
+        if not isinstance(params, list):
+            return result
+        
+        for index in range(0, len(params) - 1, 2):
+            key = params[index]
+            value = params[index + 1]
+            if not isinstance(key, bytes) or not isinstance(value, bytes):
+                continue
+            key = key.decode('ascii', errors='ignore').lower()
+            value = value.decode('utf-8', errors='replace')
+            
+            if key.endswith('*'):
+                # RFC 2231: charset'idioma'valor%20codificado
+                charset, _, encoded = value.partition("'")
+                _, _, encoded = encoded.partition("'")
+                try:
+                    value = unquote(encoded, encoding=charset or 'utf-8', errors='replace')
+                except LookupError:
+                    value = unquote(encoded)
+            else:
+                value = self._decode_header(value)
+            
+            result[key] = value
+        
+        return result
+    
     def _decode_header(self, header_value):
         """Decodifica headers de correo que pueden estar codificados"""
         if not header_value:
@@ -196,6 +909,12 @@ class EmailManager:
         else:
             return decoded_from.strip()
     
+    def _extract_message_ids(self, header_value):
+        """Extrae los identificadores <...> de Message-ID, In-Reply-To o References"""
+        if not header_value:
+            return []
+        return re.findall(r'<[^<>\s]+>', str(header_value))
+    
     def _extract_domain(self, email_address):
         """
         Extrae el dominio de una dirección de correo electrónico
@@ -220,112 +939,99 @@ class EmailManager:
         if not processed_email.get('fecha_objeto'):
             return True  # Si no podemos verificar la fecha, incluirlo
         
+        # Las fechas sin zona horaria se interpretan en hora local
         email_date = processed_email['fecha_objeto']
-        return start_date <= email_date <= end_date
+        return start_date.astimezone() <= email_date <= end_date.astimezone()
+    
+    def export_bodies(self, emails, root=None, workers=4):
+        """
+        Guarda el mensaje completo de cada correo en un .eml.gz, por fragmentos
+        
+        Cada hilo usa su propia conexión de connection_factory; sin ella se
+        exporta con un solo hilo sobre la conexión actual.
+        
+        Args:
+            emails (list): Correos descargados (con su UID)
+            root (str): Directorio de salida (por defecto cuerpos_correos)
+            workers (int): Conexiones simultáneas
+        """
+        from body_export import BodyExportPool, DEFAULT_BODY_ROOT
+        
+        if self.connection_factory:
+            def open_reader():
+                connection = self.connection_factory()
+                if self.rate_bucket:
+                    limit_imap_connection(connection, self.rate_bucket)
+                return ImapBodyReader(connection, self._quote_folder, close_connection=True)
+        else:
+            workers = 1
+            open_reader = lambda: ImapBodyReader(self.imap_connection, self._quote_folder)
+        
+        emails = [email_data for email_data in emails if email_data.get('uid')]
+        BodyExportPool(open_reader, workers).run(emails, root or DEFAULT_BODY_ROOT)
     
-    def export_to_excel(self, emails, filename='correos_exportados.xlsx'):
+    def export_to_excel(self, emails, filename='correos_exportados.xlsx', include_threads=False):
         """
         Exporta la lista de correos a un archivo Excel
         
         Args:
             emails (list): Lista de correos
             filename (str): Nombre del archivo de salida
+            include_threads (bool): Añadir la hoja "Hilos" con el resumen por hilo
         """
+        if not emails:
+            print("No hay correos para exportar")
+            return
+        
         try:
-            import pandas as pd
+            from xlsx_writer import write_xlsx
             
-            if not emails:
-                print("No hay correos para exportar")
-                return
-            
-            # Crear DataFrame
-            df = pd.DataFrame(emails)
-            # Remover la columna de fecha_objeto si existe
-            if 'fecha_objeto' in df.columns:
-                df = df.drop('fecha_objeto', axis=1)
+            # Los hilos se calculan antes para que cada correo tenga su columna "Hilo"
+            threads = group_threads(emails) if include_threads else None
             
-            # Guardar como Excel
-            df.to_excel(filename, index=False, engine='openpyxl')
+            # Cada hoja se serializa por bloques de filas en varios procesos
+            sheets = [("Correos", emails, get_export_columns(emails, default_folder='INBOX'))]
+            if threads:
+                sheets.append(("Hilos", threads, THREAD_COLUMNS))
+            write_xlsx(filename, sheets)
             print(f"Correos exportados a: {filename}")
             
-        except ImportError:
-            print("Pandas no disponible. Exportando en formato Excel simple...")
-            self._export_to_simple_excel(emails, filename)
         except Exception as e:
             print(f"Error exportando a Excel: {str(e)}")
     
-    def _export_to_simple_excel(self, emails, filename):
+    def clone(self):
         """
-        Exporta correos a Excel sin usar pandas
+        Gestor para otro hilo con una conexión nueva de connection_factory
+        (mismo buzón y presupuesto de comandos); None si no hay connection_factory
+        """
+        if not self.connection_factory:
+            return None
         
-        Args:
-            emails (list): Lista de correos
-            filename (str): Nombre del archivo
+        manager = EmailManager(
+            self.connection_factory(), self.email_address,
+            connection_factory=self.connection_factory, compress=self.compress, rate_bucket=self.rate_bucket
+        )
+        manager.binary_search_threshold = self.binary_search_threshold
+        manager.preview_length = self.preview_length
+        return manager
+    
+    def ping(self):
+        """Consulta mínima (NOOP) para medir el tiempo de ida y vuelta"""
+        typ, _ = self.imap_connection.noop()
+        return typ == 'OK'
+    
+    def estimate_seconds(self, job, folders, days, rtt):
         """
-        if not OPENPYXL_AVAILABLE:
-            print("❌ Error: openpyxl no está disponible")
-            return
-            
-        try:
-            # Crear workbook y hoja
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Correos"
-            
-            # Definir encabezados
-            headers = ["Fecha", "Fecha Completa", "Asunto", "Remitente", "Dominio", "Carpeta"]
-            
-            # Escribir encabezados con formato
-            header_font = Font(bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-            
-            # Escribir datos
-            for row, email_data in enumerate(emails, 2):
-                # Extraer solo la fecha sin hora en formato DD/MM/YYYY
-                fecha_completa = email_data['fecha']
-                try:
-                    # Parsear la fecha completa y convertir a DD/MM/YYYY
-                    fecha_obj = datetime.strptime(fecha_completa.split(' ')[0], '%Y-%m-%d')
-                    fecha_solo = fecha_obj.strftime('%d/%m/%Y')
-                except:
-                    fecha_solo = 'Fecha inválida'
-                
-                # Escribir datos en las columnas
-                ws.cell(row=row, column=1, value=fecha_solo)
-                ws.cell(row=row, column=2, value=email_data['fecha'])
-                ws.cell(row=row, column=3, value=email_data['asunto'])
-                ws.cell(row=row, column=4, value=email_data['remitente_email'])
-                ws.cell(row=row, column=5, value=email_data['dominio_remitente'])
-                ws.cell(row=row, column=6, value=email_data.get('carpeta', 'INBOX'))
-            
-            # Ajustar ancho de columnas automáticamente
-            for column in ws.columns:
-                max_length = 0
-                column_letter = get_column_letter(column[0].column)
-                
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                
-                # Limitar el ancho máximo para evitar columnas demasiado anchas
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-            
-            # Guardar archivo
-            wb.save(filename)
-            print(f"Correos exportados a: {filename}")
-            
-        except Exception as e:
-            print(f"Error exportando archivo: {str(e)}")
+        Tiempo estimado de un trabajo: IMAP necesita una ida y vuelta por orden
+        (SELECT, SEARCH, un FETCH por correo, una búsqueda por día al contar)
+        """
+        folder_count = max(1, len(folders))
+        if job == JOB_DOWNLOAD:
+            return folder_count * (2 + 100) * rtt
+        if job == JOB_COUNTS:
+            return folder_count * (2 + days) * rtt
+        # Vigilar: IDLE avisa en cuanto llega el correo
+        return rtt
     
     def get_user_info(self):
         """
@@ -341,20 +1047,115 @@ class EmailManager:
     
     def get_folder_list(self):
         """
-        Obtiene la lista de carpetas disponibles
+        Obtiene las carpetas con sus estadísticas en una sola ida y vuelta
+        
+        Usa LIST ... RETURN (STATUS ...) si el servidor anuncia LIST-STATUS; si no,
+        envía todos los STATUS seguidos (sin esperar cada respuesta).
         
         Returns:
-            list: Lista de carpetas
+            list: Diccionarios con id (nombre IMAP para SELECT), name, path,
+                delimiter, total, unread, uidnext y uidvalidity (None si la
+                carpeta no se puede seleccionar)
         """
         try:
-            result, folders = self.imap_connection.list()
-            if result == 'OK':
-                folder_list = []
-                for folder in folders:
-                    # Decodificar nombre de carpeta
-                    folder_name = folder.decode().split('"')[-2] if '"' in folder.decode() else folder.decode().split()[-1]
-                    folder_list.append(folder_name)
-                return folder_list
-            return ['INBOX']
-        except:
-            return ['INBOX']
\ No newline at end of file
+            self._negotiate_compression()
+            connection = self.imap_connection
+            
+            if 'LIST-STATUS' in connection.capabilities:
+                typ, data = connection.xatom('LIST', '""', '*', 'RETURN', f'(STATUS {FOLDER_STATUS_ITEMS})')
+                statuses = connection.untagged_responses.pop('STATUS', [])
+                typ, data = connection._untagged_response(typ, data, 'LIST')
+            else:
+                typ, data = connection.list()
+                statuses = []
+            
+            if typ != 'OK' or not data or data == [None]:
+                return [self._default_folder_info()]
+            
+            folders = [self._parse_list_response(raw) for raw in join_imap_literals(data)]
+            folders = [folder for folder in folders if folder]
+            
+            if not statuses:
+                statuses = self._pipelined_status([
+                    folder['id'] for folder in folders if folder['selectable']
+                ])
+            
+            folder_status = {}
+            for raw in join_imap_literals(statuses):
+                tokens = parse_imap_data(raw)
+                if len(tokens) >= 2 and isinstance(tokens[1], list):
+                    name = tokens[0].decode('utf-8', errors='replace') if tokens[0] else ''
+                    values = tokens[1]
+                    folder_status[name] = {
+                        values[index].decode().upper(): int(values[index + 1])
+                        for index in range(0, len(values) - 1, 2)
+                    }
+            
+            for folder in folders:
+                status = folder_status.get(folder['id'], {})
+                folder['total'] = status.get('MESSAGES')
+                folder['unread'] = status.get('UNSEEN')
+                folder['uidnext'] = status.get('UIDNEXT')
+                folder['uidvalidity'] = status.get('UIDVALIDITY')
+                del folder['selectable']
+            
+            return folders
+        except Exception as e:
+            print(f"Error obteniendo carpetas: {str(e)}")
+            return [self._default_folder_info()]
+    
+    def _parse_list_response(self, raw):
+        """Convierte una línea de LIST en el diccionario de la carpeta"""
+        tokens = parse_imap_data(raw)
+        if len(tokens) < 3 or not isinstance(tokens[0], list) or tokens[2] is None:
+            return None
+        
+        flags = [flag.decode().lower() for flag in tokens[0] if flag]
+        delimiter = tokens[1].decode() if tokens[1] else None
+        raw_name = tokens[2].decode('utf-8', errors='replace')
+        path = decode_folder_name(raw_name)
+        
+        return {
+            'id': raw_name,
+            'name': path.split(delimiter)[-1] if delimiter else path,
+            'path': path,
+            'delimiter': delimiter,
+            'selectable': '\\noselect' not in flags and '\\nonexistent' not in flags
+        }
+    
+    def _pipelined_status(self, folder_names):
+        """
+        Envía un STATUS por carpeta sin esperar respuesta y luego las recoge todas
+        
+        Returns:
+            list: Respuestas STATUS sin etiquetar (datos de imaplib)
+        """
+        connection = self.imap_connection
+        tags = [
+            connection._command('STATUS', self._quote_folder(name), FOLDER_STATUS_ITEMS)
+            for name in folder_names
+        ]
+        for tag in tags:
+            try:
+                connection._command_complete('STATUS', tag)
+            except connection.error as e:
+                print(f"Error en STATUS: {str(e)}")
+        return connection.untagged_responses.pop('STATUS', [])
+    
+    def _default_folder_info(self):
+        return {
+            'id': 'INBOX', 'name': 'INBOX', 'path': 'INBOX', 'delimiter': None,
+            'total': 0, 'unread': 0, 'uidnext': None, 'uidvalidity': None
+        }
+    
+    def _negotiate_compression(self):
+        """Activa COMPRESS=DEFLATE una sola vez por conexión (si está habilitado y soportado)"""
+        if not self.compress or self._compression_checked:
+            return
+        self._compression_checked = True
+        try:
+            self.compression = enable_deflate(self.imap_connection)
+            if self.compression:
+                print("Compresión IMAP (DEFLATE) activada")
+        except Exception as e:
+            print(f"No se pudo activar la compresión IMAP: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,208 @@
+# export_columns.py
+"""
+Columnas de la exportación a Excel (comunes a IMAP y Graph API)
+"""
+
+from datetime import datetime
+from functools import partial
+from operator import itemgetter
+
+from public_suffix import registrable_domain
+
+# Estilo de los encabezados (azul con texto blanco)
+HEADER_FONT_COLOR = "FFFFFF"
+HEADER_FILL_COLOR = "366092"
+
+# Ancho máximo de columna para evitar columnas demasiado anchas
+MAX_COLUMN_WIDTH = 50
+
+
+def _fecha_solo(email_data):
+    """Extrae solo la fecha sin hora en formato DD/MM/YYYY"""
+    try:
+        fecha_obj = datetime.strptime(email_data['fecha'].split(' ')[0], '%Y-%m-%d')
+        return fecha_obj.strftime('%d/%m/%Y')
+    except:
+        return 'Fecha inválida'
+
+
+def _si_no(value):
+    """Convierte un booleano en 'Sí'/'No' (vacío si no se conoce)"""
+    if value is None:
+        return ''
+    return 'Sí' if value else 'No'
+
+
+def _dominio_registrable(email_data):
+    """Dominio registrable (calculado si el correo no lo trae, p. ej. del índice local)"""
+    return email_data.get('dominio_registrable') or registrable_domain(email_data['dominio_remitente'])
+
+
+def _join(values):
+    """Une una lista de valores en una sola celda"""
+    return '; '.join(str(value) for value in values or [] if value)
+
+
+# Las funciones de las columnas son funciones de módulo, partial o itemgetter
+# (no lambdas) para que xlsx_writer pueda enviarlas a otros procesos
+def _optional(key, email_data):
+    """Valor de una clave opcional del correo (None si no la trae)"""
+    return email_data.get(key)
+
+
+def _optional_si_no(key, email_data):
+    return _si_no(email_data.get(key))
+
+
+def _optional_join(key, email_data):
+    return _join(email_data.get(key))
+
+
+def _carpeta(default_folder, email_data):
+    return email_data.get('carpeta', default_folder)
+
+
+def _etiqueta(tag, email_data):
+    return (email_data.get('etiquetas') or {}).get(tag, '')
+
+
+# Columnas siempre presentes: (encabezado, función que obtiene el valor)
+BASE_COLUMNS = [
+    ("Fecha", _fecha_solo),
+    ("Fecha Completa", itemgetter('fecha')),
+    ("Asunto", itemgetter('asunto')),
+    ("Remitente", itemgetter('remitente_email')),
+    ("Dominio", itemgetter('dominio_remitente')),
+    ("Dominio Registrable", _dominio_registrable),
+]
+
+# Columnas opcionales: solo se exportan si algún correo trae la clave indicada
+OPTIONAL_COLUMNS = [
+    ('tamano', "Tamaño (bytes)", partial(_optional, 'tamano')),
+    ('tiene_adjuntos', "Con Adjuntos", partial(_optional_si_no, 'tiene_adjuntos')),
+    ('num_adjuntos', "Nº Adjuntos", partial(_optional, 'num_adjuntos')),
+    ('adjuntos_nombres', "Nombres Adjuntos", partial(_optional_join, 'adjuntos_nombres')),
+    ('adjuntos_tipos', "Tipos Adjuntos", partial(_optional_join, 'adjuntos_tipos')),
+    ('hilo', "Hilo", partial(_optional, 'hilo')),
+    ('carpetas', "Carpetas", partial(_optional_join, 'carpetas')),
+    ('buzon', "Buzón", partial(_optional, 'buzon')),
+    ('vista_previa', "Vista Previa", partial(_optional, 'vista_previa')),
+    ('archivo_cuerpo', "Archivo Cuerpo", partial(_optional, 'archivo_cuerpo')),
+]
+
+# Campos de Graph API ($select) que necesita cada columna; las columnas de
+# tamaño y adjuntos se obtienen con $expand (ver GraphEmailManager)
+GRAPH_FIELDS = {
+    "Fecha": ('receivedDateTime',),
+    "Fecha Completa": ('receivedDateTime',),
+    "Asunto": ('subject',),
+    "Remitente": ('from',),
+    "Dominio": ('from',),
+    "Dominio Registrable": ('from',),
+    "Con Adjuntos": ('hasAttachments',),
+    "Hilo": ('conversationId', 'internetMessageId'),
+    "Carpetas": ('internetMessageId',),
+    "Vista Previa": ('bodyPreview',),
+}
+
+# Claves internas de los correos que nunca se exportan como columna
+INTERNAL_KEYS = (
+    'fecha_objeto', 'message_id', 'in_reply_to', 'referencias', 'conversation_id', 'uid', 'graph_id', 'backend'
+)
+
+# Columnas de la hoja de resumen de hilos (ver threads.group_threads)
+THREAD_COLUMNS = [
+    ("Hilo", itemgetter('hilo')),
+    ("Asunto", itemgetter('asunto')),
+    ("Mensajes", itemgetter('mensajes')),
+    ("Primer Mensaje", itemgetter('primer_mensaje')),
+    ("Último Mensaje", itemgetter('ultimo_mensaje')),
+    ("Carpetas", itemgetter('carpetas')),
+    ("Remitentes", itemgetter('remitentes')),
+]
+
+
+def get_export_columns(emails, default_folder='inbox'):
+    """
+    Obtiene las columnas a exportar para una lista de correos
+    
+    Args:
+        emails (list): Lista de correos
+        default_folder (str): Carpeta a mostrar si el correo no la indica
+    
+    Returns:
+        list: Lista de tuplas (encabezado, función que obtiene el valor)
+    """
+    columns = list(BASE_COLUMNS)
+    columns.append(("Carpeta", partial(_carpeta, default_folder)))
+    
+    present_keys = set()
+    for email_data in emails:
+        present_keys.update(email_data.keys())
+    
+    for key, header, getter in OPTIONAL_COLUMNS:
+        if key in present_keys:
+            columns.append((header, getter))
+    
+    # Una columna por etiqueta de las reglas de clasificación (ver classification_rules.py)
+    if 'etiquetas' in present_keys:
+        tags = {}
+        for email_data in emails:
+            tags.update(dict.fromkeys(email_data.get('etiquetas') or {}))
+        columns += [(tag, tag_getter(tag)) for tag in tags]
+    
+    return columns
+
+
+def tag_getter(tag):
+    """Función que obtiene el valor de una etiqueta de clasificación"""
+    return partial(_etiqueta, tag)
+
+
+def planned_export_columns(attachment_info=None, include_threads=False, deduplicate=False, preview=False):
+    """
+    Encabezados que escribirá la exportación con las opciones elegidas
+    
+    Args:
+        attachment_info (str): None, 'resumen' o 'detalle'
+        include_threads (bool): Se exporta la columna "Hilo" (y la hoja "Hilos")
+        deduplicate (bool): Se de-duplica y se exporta la columna "Carpetas"
+        preview (bool): Se exporta la columna "Vista Previa"
+    
+    Returns:
+        list: Encabezados de columna
+    """
+    headers = [header for header, _ in BASE_COLUMNS] + ["Carpeta"]
+    
+    optional_keys = []
+    if attachment_info:
+        optional_keys += ['tamano', 'tiene_adjuntos']
+    if attachment_info == 'detalle':
+        optional_keys += ['num_adjuntos', 'adjuntos_nombres', 'adjuntos_tipos']
+    if include_threads:
+        optional_keys.append('hilo')
+    if deduplicate:
+        optional_keys.append('carpetas')
+    if preview:
+        optional_keys.append('vista_previa')
+    
+    headers += [header for key, header, _ in OPTIONAL_COLUMNS if key in optional_keys]
+    return headers
+
+
+def graph_select_fields(headers):
+    """
+    Lista $select de Graph API con solo los campos que necesitan las columnas
+    
+    Args:
+        headers (list): Encabezados (p. ej. de planned_export_columns)
+    
+    Returns:
+        str: Campos separados por comas, sin repetir y en orden
+    """
+    fields = []
+    for header in headers:
+        for field in GRAPH_FIELDS.get(header, ()):
+            if field not in fields:
+                fields.append(field)
+    return ','.join(fields)
@@ -0,0 +1,79 @@
+# fast_json.py
+"""
+Decodificación JSON de las respuestas de Graph API con medición de bytes y tiempo
+- Usa orjson si está instalado (más rápido); si no, el módulo json estándar
+"""
+
+import json
+import time
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def loads(data):
+    """Decodifica JSON (bytes o str) con el parser más rápido disponible"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parser_name():
+    """Nombre del parser JSON en uso"""
+    return 'orjson' if ORJSON_AVAILABLE else 'json'
+
+
+class TransferStats:
+    """Acumula bytes recibidos y tiempo de decodificación de las respuestas"""
+    
+    def __init__(self):
+        self.responses = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.decode_ms = 0.0
+    
+    def decode(self, response, label=''):
+        """
+        Decodifica el JSON de una respuesta de requests y registra sus métricas
+        
+        Args:
+            response: Respuesta de requests (ya descomprimida si llegó con gzip)
+            label (str): Texto que identifica la respuesta en el informe
+        
+        Returns:
+            dict: JSON decodificado ({} si la respuesta no tiene cuerpo)
+        """
+        content = response.content
+        start = time.perf_counter()
+        data = loads(content) if content else {}
+        decode_ms = (time.perf_counter() - start) * 1000
+        
+        # Con Content-Encoding, Content-Length es el tamaño comprimido recibido
+        wire_bytes = len(content)
+        encoding = response.headers.get('Content-Encoding')
+        if encoding and response.headers.get('Content-Length'):
+            try:
+                wire_bytes = int(response.headers['Content-Length'])
+            except ValueError:
+                pass
+        
+        self.responses += 1
+        self.bytes += len(content)
+        self.wire_bytes += wire_bytes
+        self.decode_ms += decode_ms
+        
+        compressed = f" ({wire_bytes / 1024:.1f} KB {encoding})" if encoding else ''
+        print(f"      📦 {label}{len(content) / 1024:.1f} KB{compressed}, JSON {decode_ms:.1f} ms")
+        
+        return data
+    
+    def summary(self):
+        """Resumen de una línea con los totales acumulados"""
+        return (
+            f"{self.responses} respuestas, {self.bytes / 1024:.1f} KB "
+            f"({self.wire_bytes / 1024:.1f} KB transferidos), "
+            f"JSON {self.decode_ms:.1f} ms con {parser_name()}"
+        )
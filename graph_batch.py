@@ -0,0 +1,202 @@
+# graph_batch.py
+"""
+Agrupación de peticiones GET de Microsoft Graph en POST /$batch (hasta 20 por lote)
+"""
+
+import time
+
+# Límite de Graph API de peticiones por lote
+MAX_BATCH_SIZE = 20
+
+# Estados que se reintentan (limitación de peticiones o servicio no disponible)
+RETRYABLE_STATUS = (429, 503, 504)
+
+# Estado que devuelve Graph cuando falla una petición de la que se depende
+FAILED_DEPENDENCY = 424
+
+# Espera en segundos si una respuesta limitada no trae Retry-After
+DEFAULT_RETRY_AFTER = 5
+
+
+def retry_after(headers, default=DEFAULT_RETRY_AFTER):
+    """Segundos indicados en la cabecera Retry-After (o la espera por defecto)"""
+    for key, value in (headers or {}).items():
+        if key.lower() == 'retry-after':
+            try:
+                return max(1, int(float(value)))
+            except (TypeError, ValueError):
+                break
+    return default
+
+
+class GraphBatch:
+    """Ejecuta peticiones GET independientes (o con dependsOn) usando /$batch"""
+    
+    def __init__(self, base_url, headers, max_retries=5, default_retry_after=DEFAULT_RETRY_AFTER, session=None, stats=None, rate_bucket=None):
+        """
+        Args:
+            base_url (str): URL base de Graph (p. ej. https://graph.microsoft.com/v1.0)
+            headers (dict): Cabeceras comunes (Authorization)
+            max_retries (int): Reintentos por subpetición ante 429/503/504
+            default_retry_after (int): Espera en segundos si no llega Retry-After
+            session (requests.Session): Sesión HTTP a reutilizar (p. ej. con gzip)
+            stats (TransferStats): Registro de bytes y tiempo de decodificación JSON
+            rate_bucket (MailboxBucket): Presupuesto de peticiones compartido entre
+                procesos (cada subpetición consume una ficha)
+        """
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers
+        self.session = session
+        self.stats = stats
+        self.rate_bucket = rate_bucket
+        self.max_retries = max_retries
+        self.default_retry_after = default_retry_after
+        self.http_requests = 0
+        self.sub_requests = 0
+        self.throttled = 0  # Respuestas 429/503/504 recibidas (lotes o subpeticiones)
+    
+    def execute(self, batch_requests):
+        """
+        Ejecuta una lista de peticiones agrupándolas en lotes de hasta 20
+        
+        Solo se reenvían las subpeticiones que fallan con 429/503/504 (y las que
+        dependían de ellas), respetando el Retry-After más largo recibido.
+        
+        Args:
+            batch_requests (list): Diccionarios con 'id', 'url' (absoluta o relativa
+                a base_url) y opcionalmente 'headers' y 'dependsOn' (lista de ids)
+        
+        Returns:
+            dict: id -> {'status': int, 'headers': dict, 'body': dict}
+        """
+        order = {}
+        pending = []
+        for position, request in enumerate(batch_requests):
+            request_id = str(request['id'])
+            order[request_id] = position
+            entry = {'id': request_id, 'method': 'GET', 'url': self._relative_url(request['url'])}
+            if request.get('headers'):
+                entry['headers'] = request['headers']
+            if request.get('dependsOn'):
+                entry['dependsOn'] = [str(dependency) for dependency in request['dependsOn']]
+            pending.append(entry)
+        
+        results = {}
+        attempts = {}
+        
+        while pending:
+            chunk, deferred = self._take_chunk(pending, results)
+            if not chunk:
+                # Dependencias imposibles de resolver: se dan por fallidas
+                for entry in deferred:
+                    results[entry['id']] = self._failed(FAILED_DEPENDENCY)
+                break
+            
+            responses, wait = self._post_chunk(chunk)
+            
+            retry = []
+            for entry in chunk:
+                response = responses.get(entry['id'])
+                status = response['status'] if response else 0
+                retryable = status in RETRYABLE_STATUS or (status == FAILED_DEPENDENCY and entry.get('dependsOn'))
+                
+                if status in RETRYABLE_STATUS:
+                    self.throttled += 1
+                
+                if (response is None or retryable) and attempts.get(entry['id'], 0) < self.max_retries:
+                    attempts[entry['id']] = attempts.get(entry['id'], 0) + 1
+                    retry.append(entry)
+                    if response:
+                        wait = max(wait, retry_after(response.get('headers'), self.default_retry_after))
+                else:
+                    results[entry['id']] = response or self._failed(0)
+            
+            pending = sorted(retry + deferred, key=lambda entry: order[entry['id']])
+            
+            if retry and wait:
+                if self.rate_bucket:
+                    self.rate_bucket.penalize(wait)
+                print(f"   ⏳ Graph limita peticiones: reintentando {len(retry)} en {wait} s...")
+                time.sleep(wait)
+        
+        return results
+    
+    def _take_chunk(self, pending, results):
+        """Selecciona hasta 20 peticiones cuyas dependencias ya se conocen o van en el mismo lote"""
+        chunk = []
+        chunk_ids = set()
+        deferred = []
+        
+        for entry in pending:
+            dependencies = entry.get('dependsOn') or []
+            
+            if any(dependency in results and not self._succeeded(results[dependency]) for dependency in dependencies):
+                results[entry['id']] = self._failed(FAILED_DEPENDENCY)
+                continue
+            
+            unresolved = [dependency for dependency in dependencies if dependency not in results]
+            if len(chunk) < MAX_BATCH_SIZE and all(dependency in chunk_ids for dependency in unresolved):
+                entry = dict(entry)
+                if unresolved:
+                    entry['dependsOn'] = unresolved
+                else:
+                    entry.pop('dependsOn', None)
+                chunk.append(entry)
+                chunk_ids.add(entry['id'])
+            else:
+                deferred.append(entry)
+        
+        return chunk, deferred
+    
+    def _post_chunk(self, chunk):
+        """Envía un lote; devuelve (respuestas por id, espera sugerida en segundos)"""
+        self.http_requests += 1
+        self.sub_requests += len(chunk)
+        
+        # Graph cuenta cada subpetición contra el límite del buzón
+        if self.rate_bucket:
+            self.rate_bucket.acquire(len(chunk))
+        
+        try:
+            http = self.session
+            if http is None:
+                import requests as http
+            response = http.post(f"{self.base_url}/$batch", headers=self.headers, json={'requests': chunk})
+        except Exception as e:
+            print(f"   ❌ Error enviando lote a Graph: {str(e)}")
+            return {}, self.default_retry_after
+        
+        if response.status_code in RETRYABLE_STATUS:
+            # Todo el lote fue rechazado: se reintentan todas sus peticiones
+            self.throttled += 1
+            return {}, retry_after(response.headers, self.default_retry_after)
+        
+        if response.status_code != 200:
+            print(f"   ❌ Error API en lote: {response.status_code}")
+            return {entry['id']: self._failed(response.status_code) for entry in chunk}, 0
+        
+        if self.stats:
+            data = self.stats.decode(response, f"lote de {len(chunk)}: ")
+        else:
+            data = response.json()
+        
+        responses = {}
+        for item in data.get('responses', []):
+            responses[str(item.get('id'))] = {
+                'status': item.get('status', 0),
+                'headers': item.get('headers') or {},
+                'body': item.get('body') or {}
+            }
+        return responses, 0
+    
+    def _relative_url(self, url):
+        """Convierte una URL absoluta (p. ej. @odata.nextLink) en relativa a la versión de Graph"""
+        if url.startswith(self.base_url):
+            url = url[len(self.base_url):]
+        return url if url.startswith('/') else '/' + url
+    
+    def _succeeded(self, result):
+        return 200 <= result['status'] < 300
+    
+    def _failed(self, status):
+        return {'status': status, 'headers': {}, 'body': {}}
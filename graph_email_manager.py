@@ -3,32 +3,93 @@
 Gestor de correos usando Microsoft Graph API (alternativa a IMAP)
 """
 
-import requests
 import json
-from datetime import datetime, timezone
-from urllib.parse import quote
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, urlencode
 
-# Importar openpyxl al inicio para evitar problemas de importación tardía
-try:
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    OPENPYXL_AVAILABLE = True
-except ImportError:
-    OPENPYXL_AVAILABLE = False
+from export_columns import (
+    get_export_columns, THREAD_COLUMNS,
+    planned_export_columns, graph_select_fields
+)
+from threads import group_threads
+from public_suffix import registrable_domain
+from graph_batch import GraphBatch, MAX_BATCH_SIZE, RETRYABLE_STATUS, retry_after
+from body_preview import GRAPH_PREVIEW_MAX, html_to_text
+from fast_json import TransferStats
+from backends import (
+    MailBackend, JOB_DOWNLOAD, JOB_COUNTS,
+    CAP_INCREMENTAL, CAP_SERVER_COUNT, CAP_HEADER_ONLY, CAP_BATCH
+)
 
-class GraphEmailManager:
+# Intervalo mínimo (s) entre consultas delta del modo vigilancia
+DEFAULT_WATCH_INTERVAL = 5
+
+# Máximo de IDs recordados en vigilancia para descartar correos repetidos por el delta
+MAX_WATCH_SEEN_IDS = 10000
+
+# Propiedad MAPI PidTagMessageSize (tamaño del mensaje en bytes)
+MESSAGE_SIZE_PROPERTY = 'Integer 0x0E08'
+
+class GraphEmailManager(MailBackend):
     """Gestor de correos usando Microsoft Graph API"""
     
-    def __init__(self, access_token):
+    BACKEND_NAME = 'graph'
+    CAPABILITIES = frozenset({CAP_INCREMENTAL, CAP_SERVER_COUNT, CAP_HEADER_ONLY, CAP_BATCH})
+    
+    def __init__(self, access_token, mailbox=None, session=None, rate_bucket=None):
+        """
+        Args:
+            access_token (str): Token de acceso de Graph API
+            mailbox (str): ID o UPN del buzón (permisos de aplicación); None para
+                el usuario autenticado (/me)
+            session (requests.Session): Sesión HTTP compartida (p. ej. entre buzones)
+            rate_bucket (MailboxBucket): Presupuesto de peticiones del buzón compartido
+                con otros procesos (ver rate_limiter.py)
+        """
         self.access_token = access_token
         self.headers = {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
         self.base_url = "https://graph.microsoft.com/v1.0"
+        self.mailbox = mailbox
+        self.user_path = f"/users/{quote(mailbox, safe='@')}" if mailbox else '/me'
+        
+        # Sesión HTTP reutilizable con respuestas comprimidas (gzip); requests
+        # se importa aquí para no cargarlo en los comandos que no usan Graph
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.headers.update({'Accept-Encoding': 'gzip'})
+        self.session = session
+        self.transfer_stats = TransferStats()
+        
+        # Peticiones agrupadas en /$batch (hasta 20 GET por petición HTTP)
+        self.rate_bucket = rate_bucket
+        self.batch = GraphBatch(
+            self.base_url, self.headers, session=self.session, stats=self.transfer_stats, rate_bucket=rate_bucket
+        )
+        self.use_batch = True
+        self.max_pages_per_folder = 5  # Máximo 5 páginas (500 correos) por carpeta
+        self.date_slices = 1  # Tramos de fechas consultados a la vez por carpeta
+        self.preview_length = None  # Caracteres de la vista previa del cuerpo (None = sin vista previa)
+        
+        # Varias carpetas en una sola consulta a /messages (filtrada por parentFolderId)
+        # y orden por fecha; $orderby obliga a Graph a ordenar en el servidor, así
+        # que si el orden no importa las páginas llegan antes con ordered = False
+        self.cross_folder_query = False
+        self.ordered = True
+        
+        # Cachés: índice de carpetas (nombre -> ID) e información del usuario
+        self._folder_ids = {}
+        self._well_known_ids = {}  # 'inbox' o ID indicado -> ID real (parentFolderId nunca trae el alias)
+        self._root_folders = None
+        self._user_info = None
+        self.failures = 0
     
-    def get_emails_in_date_range(self, start_date, end_date, folders=['inbox']):
+    def get_emails_in_date_range(self, start_date, end_date, folders=['inbox'], attachment_info=None, deduplicator=None, include_threads=False):
         """
         Obtiene correos en un rango de fechas usando Graph API
         
@@ -36,10 +97,30 @@ class GraphEmailManager:
             start_date (datetime): Fecha de inicio
             end_date (datetime): Fecha de fin
             folders (list): Lista de carpetas a buscar (por defecto solo 'inbox')
+            attachment_info (str): None, 'resumen' (tamaño y si tiene adjuntos)
+                o 'detalle' (además número, nombres y tipos de adjuntos)
+            deduplicator (MessageDeduplicator): Omite correos ya vistos (p. ej. copiados
+                por reglas en varias carpetas) antes de procesarlos
+            include_threads (bool): Pedir también conversationId (columna y hoja de hilos)
             
         Returns:
             list: Lista de correos procesados
         """
+        return list(self.iter_emails_in_date_range(start_date, end_date, folders, attachment_info, deduplicator, include_threads))
+    
+    def iter_emails_in_date_range(self, start_date, end_date, folders=['inbox'], attachment_info=None, deduplicator=None, include_threads=False):
+        """
+        Igual que get_emails_in_date_range, pero entrega cada correo en cuanto se procesa
+        
+        Las páginas de todas las carpetas (y tramos de fechas) se piden a la vez:
+        cada ronda agrupa la siguiente página de cada carpeta en un único /$batch.
+        Con cross_folder_query, todas las carpetas se leen con una sola consulta
+        a /messages filtrada por parentFolderId (máximo max_pages_per_folder
+        páginas por cada carpeta incluida).
+        
+        Yields:
+            dict: Información de cada correo (incluye la carpeta)
+        """
         print(f"📥 Obteniendo correos desde {start_date.strftime('%Y-%m-%d')} hasta {end_date.strftime('%Y-%m-%d')}...")
         print("🌐 Usando Microsoft Graph API (compatible con cuentas sin IMAP)")
         
@@ -48,83 +129,505 @@ class GraphEmailManager:
         
         print(f"📂 Carpetas a revisar: {', '.join(folders)}")
         
-        all_emails = []
-        
+        folder_ids = self._resolve_folder_ids(folders)
         for folder in folders:
-            print(f"\n📁 Procesando carpeta: {folder}")
-            folder_emails = self._get_emails_from_folder(start_date, end_date, folder)
-            all_emails.extend(folder_emails)
+            if not folder_ids.get(folder):
+                print(f"   ❌ Carpeta '{folder}' no encontrada")
+        found = [folder for folder in folders if folder_ids.get(folder)]
         
-        print(f"\n📧 Total de correos obtenidos de todas las carpetas: {len(all_emails)}")
-        return all_emails
-    
-    def _get_emails_from_folder(self, start_date, end_date, folder):
-        """Obtiene correos de una carpeta específica"""
-        try:
-            # Convertir fechas a formato ISO UTC
-            start_iso = start_date.astimezone(timezone.utc).isoformat()
-            end_iso = end_date.astimezone(timezone.utc).isoformat()
-            
-            # Construir filtro de fecha
-            date_filter = f"receivedDateTime ge {start_iso} and receivedDateTime le {end_iso}"
-            
-            # Buscar carpeta por nombre si no es 'inbox'
-            folder_id = folder
-            if folder != 'inbox' and not folder.startswith('AAMk'):  # Si no es un ID directo
-                folder_id = self._find_folder_by_name(folder)
-                if not folder_id:
-                    print(f"   ❌ Carpeta '{folder}' no encontrada")
-                    return []
-            
-            # URL de la API
-            url = f"{self.base_url}/me/mailFolders/{folder_id}/messages"
-            
-            # Parámetros
-            params = {
-                '$filter': date_filter,
-                '$select': 'receivedDateTime,subject,from,sender,bodyPreview',
-                '$orderby': 'receivedDateTime desc',
-                '$top': 100  # Limitar para mejor rendimiento
-            }
-            
-            emails = []
-            page_count = 1
+        # Consulta única: se necesita el ID real de cada carpeta para parentFolderId
+        folder_by_id = None
+        if self.cross_folder_query and len(found) > 1:
+            folder_by_id = self._parent_folder_index(found, folder_ids)
+        
+        params = self._message_params(
+            attachment_info, include_threads, deduplicator is not None, cross_folder=folder_by_id is not None
+        )
+        print(f"🧾 Campos solicitados: {params['$select']}")
+        
+        # Un cursor por carpeta (o uno para todas) y tramo de fechas; cada uno avanza por sus páginas
+        cursors = []
+        for slice_start, slice_end in self._iter_date_slices(start_date, end_date):
+            date_filter = f"receivedDateTime ge {slice_start} and receivedDateTime le {slice_end}"
+            if folder_by_id is not None:
+                cursors.append({'folder': None, 'url': self._cross_folder_url(params, date_filter, folder_by_id)})
+                continue
+            for folder in found:
+                slice_params = dict(params, **{'$filter': date_filter})
+                url = f"{self._messages_url(folder_ids[folder])}?{urlencode(slice_params, safe='$', quote_via=quote)}"
+                cursors.append({'folder': folder, 'url': url})
+        
+        if folder_by_id is not None:
+            print(f"🔗 Consulta única para {len(found)} carpetas ({'ordenada' if self.ordered else 'sin $orderby'})")
+            max_pages = self.max_pages_per_folder * len(found)
+        else:
+            max_pages = self.max_pages_per_folder
+        
+        message_headers = self._message_headers()
+        
+        pages = {}
+        folder_totals = {folder: 0 for folder in folders}
+        total = 0
+        
+        while cursors:
+            results = self._execute_gets([
+                {'id': str(position), 'url': cursor['url'], 'headers': message_headers}
+                for position, cursor in enumerate(cursors)
+            ])
             
-            while url and page_count <= 5:  # Máximo 5 páginas (500 correos) por carpeta
-                print(f"   📄 Procesando página {page_count}...")
+            next_cursors = []
+            for position, cursor in enumerate(cursors):
+                folder = cursor['folder']
+                label = folder or 'todas las carpetas'
+                result = results.get(str(position), {'status': 0})
                 
-                response = requests.get(url, headers=self.headers, params=params if page_count == 1 else None)
-                
-                if response.status_code == 200:
-                    data = response.json()
+                if result['status'] == 200:
+                    data = result['body']
                     page_emails = data.get('value', [])
+                    pages[label] = pages.get(label, 0) + 1
                     
-                    for email_data in page_emails:
-                        processed = self._process_email(email_data)
-                        if processed:
-                            processed['carpeta'] = folder  # Agregar info de carpeta
-                            emails.append(processed)
+                    if folder is None:
+                        processed_emails = self._process_cross_folder_page(page_emails, folder_by_id, attachment_info, deduplicator)
+                    else:
+                        processed_emails = self._process_page(page_emails, folder, attachment_info, deduplicator)
+                    for processed in processed_emails:
+                        folder_totals[processed['carpeta']] += 1
+                        total += 1
+                        yield processed
+                    
+                    print(f"   📄 '{label}' página {pages[label]}: {len(page_emails)} correos")
                     
-                    print(f"      ✅ {len(page_emails)} correos en esta página")
+                    # Siguiente página (máximo max_pages_per_folder por carpeta)
+                    next_url = data.get('@odata.nextLink')
+                    if next_url and pages[label] < max_pages:
+                        next_cursors.append({'folder': folder, 'url': next_url})
+                    
+                elif result['status'] == 404:
+                    print(f"   ❌ Carpeta '{label}' no encontrada (404)")
+                    self.failures += 1
+                else:
+                    print(f"   ❌ Error API en '{label}': {result['status']}")
+                    self.failures += 1
+            
+            cursors = next_cursors
+        
+        for folder in found:
+            print(f"   📧 Total de correos obtenidos de '{folder}': {folder_totals[folder]}")
+        
+        print(f"\n📧 Total de correos obtenidos de todas las carpetas: {total}")
+        if self.use_batch:
+            print(f"🌐 Peticiones HTTP a Graph: {self.batch.http_requests} ({self.batch.sub_requests} consultas agrupadas en /$batch)")
+        print(f"📦 Transferencia: {self.transfer_stats.summary()}")
+        if self.rate_bucket:
+            print(f"🚦 Presupuesto compartido: {self.rate_bucket.summary()}")
+    
+    def iter_new_emails(self, folders=['inbox'], deduplicator=None, min_interval=DEFAULT_WATCH_INTERVAL, max_interval=60):
+        """
+        Sondea la consulta delta de cada carpeta y entrega los correos nuevos según llegan
+        
+        La primera consulta solo pide correos recibidos desde ahora; después se
+        usa el deltaLink de cada carpeta, que devuelve únicamente los cambios.
+        Todas las carpetas se consultan en un mismo /$batch. El intervalo se
+        duplica mientras no llega nada (hasta max_interval) y vuelve al mínimo
+        en cuanto llega un correo.
+        
+        Args:
+            folders (list): Carpetas a vigilar
+            deduplicator (MessageDeduplicator): Omite correos ya entregados
+            min_interval (int): Segundos mínimos entre consultas
+            max_interval (int): Segundos máximos entre consultas
+        
+        Yields:
+            dict: Información de cada correo nuevo (incluye la carpeta)
+        """
+        if isinstance(folders, str):
+            folders = [folders]
+        
+        folder_ids = self._resolve_folder_ids(folders)
+        select = self._message_params(deduplicate=deduplicator is not None)['$select']
+        message_headers = self._message_headers()
+        
+        def start_url(folder, since):
+            params = {'$select': select, '$filter': f"receivedDateTime ge {since}"}
+            return f"{self._messages_url(folder_ids[folder])}/delta?{urlencode(params, safe='$', quote_via=quote)}"
+        
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        cursors = {}
+        synced_at = {}
+        for folder in folders:
+            if not folder_ids.get(folder):
+                print(f"   ❌ Carpeta '{folder}' no encontrada")
+                continue
+            cursors[folder] = start_url(folder, now)
+            synced_at[folder] = now
+        
+        if not cursors:
+            return
+        
+        print(f"👀 Vigilando {', '.join(cursors)} (consulta delta cada {min_interval}-{max_interval} s)")
+        
+        # Graph repite en el delta los correos modificados (p. ej. al leerlos);
+        # se recuerdan los últimos MAX_WATCH_SEEN_IDS en orden de llegada
+        seen = {}
+        interval = min_interval
+        
+        while True:
+            round_started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            watched = list(cursors)
+            results = self._execute_gets([
+                {'id': str(position), 'url': cursors[folder], 'headers': message_headers}
+                for position, folder in enumerate(watched)
+            ])
+            
+            new_emails = 0
+            more_pages = False
+            for position, folder in enumerate(watched):
+                result = results.get(str(position), {'status': 0})
+                
+                if result['status'] == 200:
+                    data = result['body']
+                    page_emails = [
+                        email_data for email_data in data.get('value', [])
+                        if '@removed' not in email_data and email_data.get('id') not in seen
+                    ]
+                    for email_data in page_emails:
+                        seen[email_data.get('id')] = None
+                    while len(seen) > MAX_WATCH_SEEN_IDS:
+                        del seen[next(iter(seen))]
                     
-                    # Siguiente página
-                    url = data.get('@odata.nextLink')
-                    page_count += 1
-                    params = None  # Solo usar params en primera página
+                    for processed in self._process_page(page_emails, folder, deduplicator=deduplicator):
+                        new_emails += 1
+                        yield processed
                     
-                elif response.status_code == 404:
-                    print(f"   ❌ Carpeta '{folder}' no encontrada (404)")
-                    break
+                    if data.get('@odata.nextLink'):
+                        cursors[folder] = data['@odata.nextLink']
+                        more_pages = True
+                    elif data.get('@odata.deltaLink'):
+                        cursors[folder] = data['@odata.deltaLink']
+                        synced_at[folder] = round_started
+                
+                elif result['status'] == 410:
+                    # Estado de sincronización caducado: se reinicia desde la última consulta completa
+                    print(f"   🔄 Reiniciando la consulta delta de '{folder}'")
+                    cursors[folder] = start_url(folder, synced_at[folder])
                 else:
-                    print(f"   ❌ Error API: {response.status_code}")
-                    break
+                    print(f"   ❌ Error API vigilando '{folder}': {result['status']}")
+                    self.failures += 1
+            
+            # Las páginas pendientes de una misma consulta se piden sin esperar
+            if more_pages:
+                continue
+            
+            interval = min_interval if new_emails else min(interval * 2, max_interval)
+            time.sleep(interval)
+    
+    def _message_params(self, attachment_info=None, include_threads=False, deduplicate=False, cross_folder=False):
+        """
+        Parámetros OData comunes de las consultas de mensajes (sin $filter)
+        
+        $select se deriva de las columnas que escribirá la exportación, de modo
+        que no se transfieren campos que nunca se usan (p. ej. bodyPreview). La
+        consulta única de varias carpetas necesita además parentFolderId.
+        """
+        columns = planned_export_columns(attachment_info, include_threads, deduplicate, bool(self.preview_length))
+        select = graph_select_fields(columns)
+        
+        # bodyPreview tiene como máximo 255 caracteres; para más se pide el
+        # cuerpo completo como texto (ver _message_headers)
+        if self.preview_length and self.preview_length > GRAPH_PREVIEW_MAX:
+            select = select.replace('bodyPreview', 'body')
+        
+        if cross_folder:
+            select += ',parentFolderId'
+        
+        params = {'$select': select}
+        if self.ordered:
+            params['$orderby'] = 'receivedDateTime desc'
+        params['$top'] = 100  # Limitar para mejor rendimiento
+        
+        # Metadatos de adjuntos: nunca se descargan los bytes (contentBytes)
+        if attachment_info:
+            expand = [f"singleValueExtendedProperties($filter=id eq '{MESSAGE_SIZE_PROPERTY}')"]
+            if attachment_info == 'detalle':
+                expand.append('attachments($select=name,contentType,size)')
+            params['$expand'] = ','.join(expand)
+        
+        return params
+    
+    def _message_headers(self):
+        """Cabeceras de las consultas de mensajes: el cuerpo se pide como texto si se selecciona"""
+        if self.preview_length and self.preview_length > GRAPH_PREVIEW_MAX:
+            return {'Prefer': 'outlook.body-content-type="text"'}
+        return {}
+    
+    def clone(self):
+        """
+        Gestor para otro hilo que comparte la sesión HTTP, el presupuesto de
+        peticiones y las cachés de carpetas y usuario (no hace ninguna petición)
+        """
+        manager = GraphEmailManager(self.access_token, self.mailbox, session=self.session, rate_bucket=self.rate_bucket)
+        manager._folder_ids = self._folder_ids
+        manager._well_known_ids = self._well_known_ids
+        manager._root_folders = self._root_folders
+        manager._user_info = self._user_info
+        manager.use_batch = self.use_batch
+        manager.max_pages_per_folder = self.max_pages_per_folder
+        manager.date_slices = self.date_slices
+        manager.cross_folder_query = self.cross_folder_query
+        manager.ordered = self.ordered
+        manager.preview_length = self.preview_length
+        return manager
+    
+    def set_access_token(self, access_token):
+        """Sustituye el token (p. ej. renovado) en las cabeceras compartidas con /$batch"""
+        self.access_token = access_token
+        self.headers['Authorization'] = f'Bearer {access_token}'
+    
+    def _messages_url(self, folder_id):
+        """URL absoluta de los mensajes de una carpeta del buzón"""
+        return f"{self.base_url}{self.user_path}/mailFolders/{folder_id}/messages"
+    
+    def _process_page(self, page_emails, folder, attachment_info=None, deduplicator=None):
+        """Procesa (en streaming) los correos de una página de resultados"""
+        for email_data in page_emails:
+            # Omitir duplicados por internetMessageId antes de procesar el correo
+            message_id = email_data.get('internetMessageId')
+            folders = None
+            if deduplicator and message_id:
+                folders = deduplicator.check(folder, message_id=message_id, scope=self.mailbox)
+                if folders is None:
+                    continue
             
-            print(f"   📧 Total de correos obtenidos de '{folder}': {len(emails)}")
-            return emails
+            processed = self._process_email(email_data)
             
+            # Sin internetMessageId: clave alternativa de asunto, fecha y remitente
+            if processed and deduplicator and not message_id:
+                folders = deduplicator.check(folder, email_data=processed, scope=self.mailbox)
+                if folders is None:
+                    continue
+            
+            if processed and attachment_info:
+                processed.update(self._process_attachment_info(email_data, attachment_info))
+            if processed:
+                processed['carpeta'] = folder  # Agregar info de carpeta
+                if self.mailbox:
+                    processed['buzon'] = self.mailbox
+                if folders is not None:
+                    processed['carpetas'] = folders
+                yield processed
+    
+    def _parent_folder_index(self, folders, folder_ids):
+        """
+        Índice ID real -> nombre pedido, para asignar la carpeta de cada correo
+        de la consulta única
+        
+        Los IDs que no están en el índice de carpetas (alias como 'inbox' o IDs
+        indicados directamente) se consultan una vez, en un único /$batch, y
+        quedan en caché junto al índice.
+        
+        Returns:
+            dict: parentFolderId -> carpeta, o None si alguna carpeta no se pudo resolver
+        """
+        known_ids = set(self._folder_ids.values())
+        aliases = [folder_ids[folder] for folder in folders if folder_ids[folder] not in known_ids]
+        missing = [alias for alias in dict.fromkeys(aliases) if alias not in self._well_known_ids]
+        if missing:
+            results = self._execute_gets([
+                {'id': str(position), 'url': f"{self.user_path}/mailFolders/{alias}?$select=id"}
+                for position, alias in enumerate(missing)
+            ])
+            for position, alias in enumerate(missing):
+                result = results.get(str(position), {'status': 0})
+                if result['status'] == 200 and result['body'].get('id'):
+                    self._well_known_ids[alias] = result['body']['id']
+        
+        index = {}
+        for folder in folders:
+            folder_id = folder_ids[folder]
+            if folder_id not in known_ids:
+                folder_id = self._well_known_ids.get(folder_id)
+            if not folder_id:
+                print(f"   ⚠️ No se pudo resolver el ID de '{folder}'; se consulta carpeta a carpeta")
+                return None
+            index.setdefault(folder_id, folder)
+        return index
+    
+    def _cross_folder_url(self, params, date_filter, folder_by_id):
+        """URL de la consulta única a /messages filtrada por fechas y carpetas"""
+        folder_list = ','.join(f"'{folder_id}'" for folder_id in folder_by_id)
+        query = dict(params, **{'$filter': f"{date_filter} and parentFolderId in ({folder_list})"})
+        return f"{self.user_path}/messages?{urlencode(query, safe='$', quote_via=quote)}"
+    
+    def _process_cross_folder_page(self, page_emails, folder_by_id, attachment_info=None, deduplicator=None):
+        """Procesa una página de la consulta única, asignando a cada correo su carpeta"""
+        for email_data in page_emails:
+            folder = folder_by_id.get(email_data.get('parentFolderId'))
+            if folder is not None:
+                yield from self._process_page((email_data,), folder, attachment_info, deduplicator)
+    
+    def _iter_date_slices(self, start_date, end_date):
+        """Divide el rango en date_slices tramos (ISO UTC) que se consultan a la vez"""
+        slices = max(1, self.date_slices)
+        step = (end_date - start_date) / slices
+        
+        for index in range(slices):
+            slice_start = start_date + step * index
+            slice_end = end_date if index == slices - 1 else start_date + step * (index + 1) - timedelta(microseconds=1)
+            yield (
+                slice_start.astimezone(timezone.utc).isoformat(),
+                slice_end.astimezone(timezone.utc).isoformat()
+            )
+    
+    def _execute_gets(self, get_requests):
+        """
+        Ejecuta varios GET de Graph: en lotes /$batch o, si use_batch es False, uno a uno
+        
+        Args:
+            get_requests (list): Diccionarios con 'id', 'url' y opcionalmente 'headers'
+                y 'dependsOn'
+        
+        Returns:
+            dict: id -> {'status': int, 'headers': dict, 'body': dict}
+        """
+        if self.use_batch:
+            return self.batch.execute(get_requests)
+        
+        return {str(request['id']): self._get(request['url'], request.get('headers')) for request in get_requests}
+    
+    def _get(self, url, extra_headers=None):
+        """
+        GET individual a Graph (URL absoluta o relativa a base_url)
+        
+        Returns:
+            dict: {'status': int, 'headers': dict, 'body': dict}; status 0 si falla la conexión
+        """
+        if not url.startswith('http'):
+            url = self.base_url + url
+        headers = dict(self.headers)
+        headers.update(extra_headers or {})
+        
+        if self.rate_bucket:
+            self.rate_bucket.acquire()
+        
+        try:
+            response = self.session.get(url, headers=headers)
+            if response.status_code in RETRYABLE_STATUS and self.rate_bucket:
+                self.rate_bucket.penalize(retry_after(response.headers, self.batch.default_retry_after))
+            body = self.transfer_stats.decode(response)
+            return {'status': response.status_code, 'headers': dict(response.headers), 'body': body}
         except Exception as e:
-            print(f"   ❌ Error obteniendo correos de '{folder}': {str(e)}")
-            return []
+            print(f"   ❌ Error en petición a Graph: {str(e)}")
+            self.failures += 1
+            return {'status': 0, 'headers': {}, 'body': {}}
+    
+    def get_email_counts(self, start_date, end_date, folders=['inbox']):
+        """
+        Obtiene el volumen de correos por carpeta y por día sin descargar mensajes
+        
+        Usa $count=true (con ConsistencyLevel: eventual) por cada día y el
+        totalItemCount de cada carpeta; todas las consultas van agrupadas en /$batch.
+        
+        Args:
+            start_date (datetime): Fecha de inicio
+            end_date (datetime): Fecha de fin
+            folders (list): Lista de carpetas a contar
+        
+        Returns:
+            dict: Totales por carpeta, por día y por carpeta/día
+        """
+        print(f"📊 Contando correos desde {start_date.strftime('%Y-%m-%d')} hasta {end_date.strftime('%Y-%m-%d')} (solo servidor)...")
+        
+        if isinstance(folders, str):
+            folders = [folders]
+        
+        counts = {
+            'total': 0,
+            'carpetas': {},
+            'dias': {},
+            'carpeta_dia': {},
+            'estado_carpetas': {}
+        }
+        
+        folder_ids = self._resolve_folder_ids(folders)
+        count_requests = []
+        
+        for folder in folders:
+            folder_id = folder_ids.get(folder)
+            if not folder_id:
+                print(f"   ❌ Carpeta '{folder}' no encontrada")
+                continue
+            
+            count_requests.append({
+                'id': str(len(count_requests)),
+                'tipo': 'estado',
+                'carpeta': folder,
+                'url': f"{self.user_path}/mailFolders/{folder_id}?$select=totalItemCount,unreadItemCount"
+            })
+            
+            for day_key, day_start, day_end in self._iter_day_buckets(start_date, end_date):
+                params = {
+                    '$filter': f"receivedDateTime ge {day_start} and receivedDateTime lt {day_end}",
+                    '$count': 'true',
+                    '$top': 1,
+                    '$select': 'id'
+                }
+                count_requests.append({
+                    'id': str(len(count_requests)),
+                    'tipo': 'dia',
+                    'carpeta': folder,
+                    'dia': day_key,
+                    'url': f"{self.user_path}/mailFolders/{folder_id}/messages?{urlencode(params, safe='$', quote_via=quote)}",
+                    'headers': {'ConsistencyLevel': 'eventual'}
+                })
+        
+        results = self._execute_gets(count_requests)
+        
+        for request in count_requests:
+            result = results.get(request['id'], {'status': 0})
+            folder = request['carpeta']
+            
+            if result['status'] != 200:
+                print(f"   ❌ Error API contando '{folder}' {request.get('dia', '')}: {result['status']}")
+                self.failures += 1
+                continue
+            
+            if request['tipo'] == 'estado':
+                counts['estado_carpetas'][folder] = {
+                    'total': result['body'].get('totalItemCount', 0),
+                    'unread': result['body'].get('unreadItemCount', 0)
+                }
+                counts['carpetas'].setdefault(folder, 0)
+                counts['carpeta_dia'].setdefault(folder, {})
+                continue
+            
+            day_key = request['dia']
+            day_count = result['body'].get('@odata.count', 0)
+            if day_count:
+                counts['carpeta_dia'].setdefault(folder, {})[day_key] = day_count
+                counts['carpetas'][folder] = counts['carpetas'].get(folder, 0) + day_count
+                counts['dias'][day_key] = counts['dias'].get(day_key, 0) + day_count
+                counts['total'] += day_count
+        
+        for folder, folder_total in counts['carpetas'].items():
+            print(f"   📧 '{folder}': {folder_total} correos en el rango")
+        
+        return counts
+    
+    def _iter_day_buckets(self, start_date, end_date):
+        """Genera (día, inicio ISO UTC, fin ISO UTC) para cada día local del rango"""
+        day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        range_end = end_date + timedelta(microseconds=1)
+        
+        while day < range_end:
+            next_day = day + timedelta(days=1)
+            bucket_start = max(day, start_date)
+            bucket_end = min(next_day, range_end)
+            yield (
+                day.strftime('%Y-%m-%d'),
+                bucket_start.astimezone(timezone.utc).isoformat(),
+                bucket_end.astimezone(timezone.utc).isoformat()
+            )
+            day = next_day
     
     def _process_email(self, email_data):
         """Procesa un correo individual"""
@@ -149,65 +652,152 @@ class GraphEmailManager:
             # Dominio
             domain = self._extract_domain(sender_email)
             
-            return {
+            processed = {
                 'fecha': formatted_date,
                 'asunto': subject,
                 'remitente_email': sender_email,
-                'dominio_remitente': domain
+                'dominio_remitente': domain,
+                'dominio_registrable': registrable_domain(domain),
+                'message_id': email_data.get('internetMessageId'),
+                'conversation_id': email_data.get('conversationId'),
+                'graph_id': email_data.get('id')
             }
+            if self.preview_length:
+                processed['vista_previa'] = self._preview_text(email_data)
+            return processed
             
         except Exception as e:
             print(f"⚠️  Error procesando correo: {str(e)}")
             return None
     
+    def _preview_text(self, email_data):
+        """Vista previa de preview_length caracteres (bodyPreview o el cuerpo en texto)"""
+        body = email_data.get('body')
+        if body:
+            text = body.get('content') or ''
+            if body.get('contentType') == 'html':
+                text = html_to_text(text)
+        else:
+            text = email_data.get('bodyPreview') or ''
+        return ' '.join(text.split())[:self.preview_length]
+    
+    def _process_attachment_info(self, email_data, attachment_info):
+        """Extrae tamaño y adjuntos de hasAttachments, la propiedad de tamaño y attachments"""
+        size = None
+        for prop in email_data.get('singleValueExtendedProperties', []):
+            if prop.get('id', '').lower() == MESSAGE_SIZE_PROPERTY.lower():
+                try:
+                    size = int(prop.get('value'))
+                except (TypeError, ValueError):
+                    size = None
+        
+        info = {
+            'tamano': size,
+            'tiene_adjuntos': email_data.get('hasAttachments')
+        }
+        
+        if attachment_info == 'detalle':
+            attachments = email_data.get('attachments', [])
+            info['num_adjuntos'] = len(attachments)
+            info['adjuntos_nombres'] = [attachment.get('name') or 'Sin nombre' for attachment in attachments]
+            info['adjuntos_tipos'] = [attachment.get('contentType') or '' for attachment in attachments]
+            if attachments:
+                info['tiene_adjuntos'] = True
+        
+        return info
+    
     def _find_folder_by_name(self, folder_name):
         """Busca una carpeta por su nombre y retorna su ID"""
+        return self._resolve_folder_ids([folder_name]).get(folder_name)
+    
+    def _resolve_folder_ids(self, folders):
+        """
+        Obtiene el ID de cada carpeta buscando por nombre en todos los niveles
+        
+        Las subcarpetas se recorren por niveles: todas las peticiones childFolders
+        de un mismo nivel van en un único /$batch. Lo que no aparece por nombre se
+        prueba como ID o alias (GET /mailFolders/{valor}), también en un /$batch.
+        Los resultados quedan en caché.
+        
+        Args:
+            folders (list): Nombres de carpeta, IDs (de cualquier tipo de cuenta) o alias como 'inbox'
+        
+        Returns:
+            dict: nombre -> ID (None si no se encuentra)
+        """
+        resolved = {}
+        missing = set()
+        
+        for folder in folders:
+            if folder == 'inbox' or folder in self._well_known_ids:  # Alias o ID ya comprobado
+                resolved[folder] = folder
+            elif folder.lower() in self._folder_ids:
+                resolved[folder] = self._folder_ids[folder.lower()]
+            else:
+                missing.add(folder.lower())
+        
+        if not missing:
+            return resolved
+        
         try:
-            response = requests.get(f"{self.base_url}/me/mailFolders", headers=self.headers)
+            if self._root_folders is None:
+                result = self._execute_gets([{
+                    'id': 'carpetas',
+                    'url': f"{self.user_path}/mailFolders?$top=100&$select=id,displayName,childFolderCount"
+                }])['carpetas']
+                self._root_folders = result['body'].get('value', []) if result['status'] == 200 else []
+                self._index_folders(self._root_folders)
             
-            if response.status_code == 200:
-                data = response.json()
+            # Recorrer subcarpetas nivel a nivel hasta encontrar todas
+            level = [folder for folder in self._root_folders if folder.get('childFolderCount')]
+            while level and not missing.issubset(self._folder_ids):
+                results = self._execute_gets([
+                    {
+                        'id': str(position),
+                        'url': f"{self.user_path}/mailFolders/{folder['id']}/childFolders?$top=100&$select=id,displayName,childFolderCount"
+                    }
+                    for position, folder in enumerate(level)
+                ])
                 
-                for folder in data.get('value', []):
-                    if folder.get('displayName', '').lower() == folder_name.lower():
-                        print(f"   ✅ Carpeta '{folder_name}' encontrada: {folder.get('displayName')}")
-                        return folder.get('id')
+                next_level = []
+                for position in range(len(level)):
+                    result = results.get(str(position), {'status': 0})
+                    if result['status'] == 200:
+                        children = result['body'].get('value', [])
+                        self._index_folders(children)
+                        next_level.extend(child for child in children if child.get('childFolderCount'))
+                level = next_level
+                
+            # Sin coincidencia por nombre: puede ser un ID (AAMk..., AQMk...) o un alias
+            unnamed = [folder for folder in dict.fromkeys(folders) if folder not in resolved and folder.lower() not in self._folder_ids]
+            if unnamed:
+                results = self._execute_gets([
+                    {'id': str(position), 'url': f"{self.user_path}/mailFolders/{quote(folder, safe='')}?$select=id"}
+                    for position, folder in enumerate(unnamed)
+                ])
+                for position, folder in enumerate(unnamed):
+                    result = results.get(str(position), {'status': 0})
+                    if result['status'] == 200 and result['body'].get('id'):
+                        self._well_known_ids[folder] = result['body']['id']
+                        resolved[folder] = folder
                 
-                # Buscar en subcarpetas si no se encuentra en el nivel raíz
-                return self._search_subfolders(folder_name, data.get('value', []))
-            
-            return None
-            
         except Exception as e:
-            print(f"   ❌ Error buscando carpeta '{folder_name}': {str(e)}")
-            return None
-    
-    def _search_subfolders(self, folder_name, folders):
-        """Busca recursivamente en subcarpetas"""
+            print(f"   ❌ Error buscando carpetas: {str(e)}")
+        
         for folder in folders:
-            folder_id = folder.get('id')
-            
-            try:
-                # Obtener subcarpetas
-                response = requests.get(f"{self.base_url}/me/mailFolders/{folder_id}/childFolders", headers=self.headers)
-                
-                if response.status_code == 200:
-                    subfolders_data = response.json()
-                    
-                    for subfolder in subfolders_data.get('value', []):
-                        if subfolder.get('displayName', '').lower() == folder_name.lower():
-                            print(f"   ✅ Carpeta '{folder_name}' encontrada en subcarpetas: {subfolder.get('displayName')}")
-                            return subfolder.get('id')
-                    
-                    # Buscar recursivamente en subcarpetas
-                    result = self._search_subfolders(folder_name, subfolders_data.get('value', []))
-                    if result:
-                        return result
-                        
-            except Exception:
-                continue
+            if folder not in resolved:
+                resolved[folder] = self._folder_ids.get(folder.lower())
+                if resolved[folder]:
+                    print(f"   ✅ Carpeta '{folder}' encontrada")
         
-        return None
+        return resolved
+    
+    def _index_folders(self, folders):
+        """Añade carpetas al índice nombre (minúsculas) -> ID sin pisar las ya conocidas"""
+        for folder in folders:
+            name = (folder.get('displayName') or '').lower()
+            if name and name not in self._folder_ids:
+                self._folder_ids[name] = folder.get('id')
     
     def _extract_domain(self, email_address):
         """Extrae dominio del email"""
@@ -219,104 +809,126 @@ class GraphEmailManager:
         except:
             return 'Dominio desconocido'
     
-    def export_to_excel(self, emails, filename=None):
-        """Exporta correos a Excel incluyendo información de carpeta"""
+    def export_bodies(self, emails, root=None, workers=4):
+        """
+        Guarda el mensaje MIME completo ($value) de cada correo en un .eml.gz
+        
+        La respuesta se lee por fragmentos (stream=True), sin cargarla entera.
+        
+        Args:
+            emails (list): Correos descargados (con su ID de Graph)
+            root (str): Directorio de salida (por defecto cuerpos_correos)
+            workers (int): Descargas simultáneas (comparten la sesión HTTP)
+        """
+        from body_export import BodyExportPool, DEFAULT_BODY_ROOT, CHUNK_SIZE
+        
+        def read_body(email_data):
+            if self.rate_bucket:
+                self.rate_bucket.acquire()
+            response = self.session.get(
+                f"{self.base_url}{self.user_path}/messages/{quote(email_data['graph_id'], safe='')}/$value",
+                headers=self.headers, stream=True
+            )
+            if response.status_code != 200:
+                response.close()
+                if response.status_code in RETRYABLE_STATUS and self.rate_bucket:
+                    self.rate_bucket.penalize(retry_after(response.headers, self.batch.default_retry_after))
+                raise RuntimeError(f"Error API {response.status_code}")
+            return email_data['graph_id'], self._iter_response(response, CHUNK_SIZE)
+        
+        emails = [email_data for email_data in emails if email_data.get('graph_id')]
+        BodyExportPool(lambda: read_body, workers).run(emails, root or DEFAULT_BODY_ROOT)
+    
+    @staticmethod
+    def _iter_response(response, chunk_size):
+        """Fragmentos de una respuesta en streaming (la conexión se libera al terminar)"""
+        try:
+            for chunk in response.iter_content(chunk_size):
+                if chunk:
+                    yield chunk
+        finally:
+            response.close()
+    
+    def export_to_excel(self, emails, filename=None, include_threads=False):
+        """Exporta correos a Excel incluyendo información de carpeta (y hoja "Hilos" si se pide)"""
         if not emails:
             print("📝 No hay correos para exportar")
             return
         
-        # Verificar si openpyxl está disponible
-        if not OPENPYXL_AVAILABLE:
-            print("❌ Error: openpyxl no está instalado. Instalando...")
-            try:
-                import subprocess
-                subprocess.check_call([
-                    "C:/Users/mpacheco/Documents/GITHUB/PYTHON/Python_Correo/.venv/Scripts/python.exe",
-                    "-m", "pip", "install", "openpyxl"
-                ])
-                print("✅ openpyxl instalado correctamente. Reinicia la aplicación.")
-                return
-            except Exception as e:
-                print(f"❌ Error instalando openpyxl: {e}")
-                return
-        
         # Generar nombre de archivo con timestamp si no se proporciona
         if not filename:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"correos_{timestamp}.xlsx"
         
         try:
-            # Crear workbook y hoja
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Correos"
-            
-            # Definir encabezados
-            headers = ["Fecha", "Fecha Completa", "Asunto", "Remitente", "Dominio", "Carpeta"]
+            from xlsx_writer import write_xlsx
             
-            # Escribir encabezados con formato
-            header_font = Font(bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-            
-            # Escribir datos
-            for row, email_data in enumerate(emails, 2):
-                # Extraer solo la fecha sin hora en formato DD/MM/YYYY
-                fecha_completa = email_data['fecha']
-                try:
-                    # Parsear la fecha completa y convertir a DD/MM/YYYY
-                    fecha_obj = datetime.strptime(fecha_completa.split(' ')[0], '%Y-%m-%d')
-                    fecha_solo = fecha_obj.strftime('%d/%m/%Y')
-                except:
-                    fecha_solo = 'Fecha inválida'
-                
-                # Escribir datos en las columnas
-                ws.cell(row=row, column=1, value=fecha_solo)
-                ws.cell(row=row, column=2, value=email_data['fecha'])
-                ws.cell(row=row, column=3, value=email_data['asunto'])
-                ws.cell(row=row, column=4, value=email_data['remitente_email'])
-                ws.cell(row=row, column=5, value=email_data['dominio_remitente'])
-                ws.cell(row=row, column=6, value=email_data.get('carpeta', 'inbox'))
-            
-            # Ajustar ancho de columnas automáticamente
-            for column in ws.columns:
-                max_length = 0
-                column_letter = get_column_letter(column[0].column)
-                
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                
-                # Limitar el ancho máximo para evitar columnas demasiado anchas
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
+            # Los hilos se calculan antes para que cada correo tenga su columna "Hilo"
+            threads = group_threads(emails) if include_threads else None
             
-            # Guardar archivo
-            wb.save(filename)
+            # Cada hoja se serializa por bloques de filas en varios procesos
+            sheets = [("Correos", emails, get_export_columns(emails, default_folder='inbox'))]
+            if threads:
+                sheets.append(("Hilos", threads, THREAD_COLUMNS))
+            write_xlsx(filename, sheets)
             print(f"💾 Correos exportados a: {filename}")
             
         except Exception as e:
             print(f"❌ Error exportando: {str(e)}")
     
+    @property
+    def throttled(self):
+        """Respuestas 429/503/504 recibidas de Graph"""
+        return self.batch.throttled
+    
+    def ping(self):
+        """Consulta mínima (el usuario con solo el id) para medir el tiempo de ida y vuelta"""
+        response = self.session.get(f"{self.base_url}{self.user_path}?$select=id", headers=self.headers)
+        return response.status_code == 200
+    
+    def estimate_seconds(self, job, folders, days, rtt):
+        """
+        Tiempo estimado de un trabajo: las consultas de todas las carpetas van
+        agrupadas en /$batch (20 por petición HTTP)
+        """
+        folder_count = max(1, len(folders))
+        if job == JOB_DOWNLOAD:
+            # Búsqueda de carpetas + una ronda por página (todas las carpetas a la vez)
+            rounds = 1 + self.max_pages_per_folder * math.ceil(folder_count * self.date_slices / MAX_BATCH_SIZE)
+            return rounds * rtt
+        if job == JOB_COUNTS:
+            return (1 + math.ceil(folder_count * (days + 1) / MAX_BATCH_SIZE)) * rtt
+        # Vigilar: en promedio se espera medio intervalo de sondeo
+        return rtt + DEFAULT_WATCH_INTERVAL / 2
+    
     def get_user_info(self):
-        """Obtiene info del usuario"""
+        """Obtiene info del usuario (y, en el mismo /$batch, el índice de carpetas raíz)"""
+        if self._user_info:
+            return self._user_info
+        
         try:
-            response = requests.get(f"{self.base_url}/me", headers=self.headers)
+            get_requests = [{'id': 'me', 'url': self.user_path}]
+            if self._root_folders is None:
+                get_requests.append({
+                    'id': 'carpetas',
+                    'url': f"{self.user_path}/mailFolders?$top=100&$select=id,displayName,childFolderCount"
+                })
             
-            if response.status_code == 200:
-                data = response.json()
-                return {
+            results = self._execute_gets(get_requests)
+            
+            folders_result = results.get('carpetas')
+            if folders_result and folders_result['status'] == 200:
+                self._root_folders = folders_result['body'].get('value', [])
+                self._index_folders(self._root_folders)
+            
+            me_result = results.get('me', {'status': 0})
+            if me_result['status'] == 200:
+                data = me_result['body']
+                self._user_info = {
                     'nombre': data.get('displayName', 'Usuario'),
                     'email': data.get('mail') or data.get('userPrincipalName', 'No disponible')
                 }
+                return self._user_info
             else:
                 return {'nombre': 'Usuario Graph API', 'email': 'No disponible'}
                 
@@ -326,24 +938,35 @@ class GraphEmailManager:
     def get_folder_list(self):
         """Obtiene lista de carpetas disponibles"""
         try:
-            response = requests.get(f"{self.base_url}/me/mailFolders", headers=self.headers)
+            response = self.session.get(f"{self.base_url}{self.user_path}/mailFolders", headers=self.headers)
             
             if response.status_code == 200:
                 data = response.json()
                 folders = []
                 
                 for folder in data.get('value', []):
-                    folder_info = {
-                        'id': folder.get('id'),
-                        'name': folder.get('displayName'),
-                        'total': folder.get('totalItemCount', 0),
-                        'unread': folder.get('unreadItemCount', 0)
-                    }
-                    folders.append(folder_info)
+                    folders.append(self._folder_info(
+                        folder.get('id'), folder.get('displayName'),
+                        folder.get('totalItemCount', 0), folder.get('unreadItemCount', 0)
+                    ))
                 
                 return folders
             else:
-                return [{'id': 'inbox', 'name': 'Bandeja de entrada', 'total': 0, 'unread': 0}]
+                return [self._folder_info('inbox', 'Bandeja de entrada')]
                 
-        except:
-            return [{'id': 'inbox', 'name': 'Bandeja de entrada', 'total': 0, 'unread': 0}]
\ No newline at end of file
+        except Exception:
+            return [self._folder_info('inbox', 'Bandeja de entrada')]
+    
+    @staticmethod
+    def _folder_info(folder_id, name, total=0, unread=0):
+        """Carpeta con las mismas claves que EmailManager.get_folder_list"""
+        return {
+            'id': folder_id,
+            'name': name,
+            'path': name,
+            'delimiter': None,
+            'total': total,
+            'unread': unread,
+            'uidnext': None,
+            'uidvalidity': None
+        }
\ No newline at end of file
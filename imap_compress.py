@@ -0,0 +1,80 @@
+# imap_compress.py
+"""
+Compresión COMPRESS=DEFLATE (RFC 4978) para conexiones imaplib
+- Tras el OK del servidor, todo lo que se envía y recibe va comprimido con deflate
+- imaplib no lo soporta: se sustituyen send/read/readline de la conexión
+"""
+
+import imaplib
+import zlib
+
+
+class DeflateStream:
+    """Envía y recibe a través de deflate sobre el socket de una conexión imaplib"""
+    
+    def __init__(self, connection):
+        self.connection = connection
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self.decompressor = zlib.decompressobj(-15)
+        self.buffer = b''
+        self.bytes_in = 0
+        self.bytes_out = 0
+    
+    def send(self, data):
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_out += len(compressed)
+        self.connection.sock.sendall(compressed)
+    
+    def read(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+    
+    def readline(self):
+        position = self.buffer.find(b'\n')
+        while position < 0:
+            if len(self.buffer) > imaplib._MAXLINE:
+                raise self.connection.error(f"got more than {imaplib._MAXLINE} bytes")
+            start = len(self.buffer)
+            self._fill()
+            position = self.buffer.find(b'\n', start)
+        line, self.buffer = self.buffer[:position + 1], self.buffer[position + 1:]
+        return line
+    
+    def pending(self):
+        """Bytes ya descomprimidos pendientes de leer"""
+        return len(self.buffer)
+    
+    def _fill(self):
+        # read1 devuelve primero lo que quedó en el búfer de imaplib tras el OK
+        data = self.connection.file.read1(65536)
+        if not data:
+            raise self.connection.abort('socket error: EOF')
+        self.bytes_in += len(data)
+        self.buffer += self.decompressor.decompress(data)
+
+
+def enable_deflate(connection):
+    """
+    Negocia COMPRESS=DEFLATE si el servidor lo anuncia
+    
+    Args:
+        connection (imaplib.IMAP4): Conexión autenticada
+    
+    Returns:
+        DeflateStream: Flujo comprimido activo, o None si no se pudo activar
+    """
+    if 'COMPRESS=DEFLATE' not in connection.capabilities:
+        return None
+    
+    typ, _ = connection.xatom('COMPRESS', 'DEFLATE')
+    if typ != 'OK':
+        return None
+    
+    stream = DeflateStream(connection)
+    connection.send = stream.send
+    connection.read = stream.read
+    connection.readline = stream.readline
+    connection.deflate = stream
+    return stream
@@ -0,0 +1,214 @@
+# imap_idle.py
+"""
+Vigilancia de carpetas IMAP con IDLE (RFC 2177)
+- Una conexión y un hilo por carpeta; el servidor avisa de los correos nuevos
+- Solo se descargan las cabeceras de los UID nuevos (nunca se repite la búsqueda completa)
+"""
+
+import imaplib
+import re
+import select
+import threading
+import time
+
+from email_manager import parse_fetch_response
+
+# El servidor puede cerrar una sesión IDLE a los 30 minutos: se renueva antes
+IDLE_RENEW_SECONDS = 29 * 60
+
+# Cada cuánto se comprueba si hay que detener la vigilancia mientras se espera
+STOP_CHECK_SECONDS = 1
+
+# Espera máxima entre reintentos de reconexión
+MAX_RECONNECT_DELAY = 300
+
+EXISTS_PATTERN = re.compile(rb'^\* \d+ EXISTS', re.IGNORECASE)
+
+
+class ImapIdleSession:
+    """Sesión IDLE sobre una carpeta, que recuerda el último UID entregado"""
+    
+    def __init__(self, connection, folder, quoted_folder, last_uid=None):
+        """
+        Args:
+            connection (imaplib.IMAP4): Conexión autenticada, dedicada a esta carpeta
+            folder (str): Nombre de la carpeta (para los mensajes)
+            quoted_folder (str): Nombre de la carpeta listo para SELECT
+            last_uid (int): Último UID ya entregado (al reconectar); None para
+                empezar por los correos que lleguen a partir de ahora
+        """
+        self.connection = connection
+        self.folder = folder
+        self.quoted_folder = quoted_folder
+        self.last_uid = last_uid
+    
+    def start(self):
+        """Selecciona la carpeta y toma como punto de partida el UID actual más alto"""
+        result, _ = self.connection.select(self.quoted_folder, readonly=True)
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f"No se pudo seleccionar la carpeta {self.folder}")
+        
+        if self.last_uid is None:
+            _, data = self.connection.response('UIDNEXT')
+            if data and data[0]:
+                self.last_uid = int(data[0]) - 1
+            else:
+                # Sin UIDNEXT: UID del último mensaje (SEARCH sobre '*')
+                result, data = self.connection.uid('SEARCH', '*')
+                uids = data[0].split() if result == 'OK' and data and data[0] else []
+                self.last_uid = max((int(uid) for uid in uids), default=0)
+    
+    def wait(self, stop_event, timeout=IDLE_RENEW_SECONDS):
+        """
+        Espera en IDLE hasta que llegue un EXISTS, venza timeout o se pida parar
+        
+        Returns:
+            bool: True si el servidor anunció mensajes nuevos
+        """
+        connection = self.connection
+        tag = connection._new_tag()
+        connection.send(tag + b' IDLE\r\n')
+        
+        line = connection._get_line()
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"El servidor rechazó IDLE: {line!r}")
+        
+        announced = False
+        deadline = time.monotonic() + timeout
+        while not announced and not stop_event.is_set() and time.monotonic() < deadline:
+            if not self._readable(STOP_CHECK_SECONDS):
+                continue
+            line = connection._get_line()
+            if line.startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort(line.decode(errors='replace'))
+            announced = bool(EXISTS_PATTERN.match(line))
+        
+        # Salir de IDLE y leer hasta la respuesta etiquetada
+        connection.send(b'DONE\r\n')
+        while True:
+            line = connection._get_line()
+            if line.startswith(tag):
+                break
+            if EXISTS_PATTERN.match(line):
+                announced = True
+        
+        return announced
+    
+    def new_uids(self):
+        """UIDs posteriores al último entregado, en orden"""
+        result, data = self.connection.uid('SEARCH', f'UID {self.last_uid + 1}:*')
+        if result != 'OK' or not data or not data[0]:
+            return []
+        
+        # 'n:*' siempre incluye el último mensaje, aunque su UID sea menor que n
+        return sorted(int(uid) for uid in data[0].split() if int(uid) > self.last_uid)
+    
+    def fetch(self, uids, fetch_items):
+        """Descarga los elementos FETCH de los UIDs indicados"""
+        uid_set = ','.join(str(uid) for uid in uids)
+        result, msg_data = self.connection.uid('FETCH', uid_set, fetch_items)
+        if result != 'OK':
+            return []
+        return [items for _, items in parse_fetch_response(msg_data)]
+    
+    def _readable(self, timeout):
+        """Indica si hay datos pendientes de leer en la conexión"""
+        # Con COMPRESS=DEFLATE puede haber datos ya descomprimidos pendientes
+        deflate = getattr(self.connection, 'deflate', None)
+        if deflate and deflate.pending():
+            return True
+        
+        sock = self.connection.sock
+        # imaplib lee con un búfer (connection.file): una respuesta que llega junto
+        # a '+ idling' queda ya leída del socket y select no la detecta
+        if self._buffered(sock):
+            return True
+        # Con SSL puede haber datos ya descifrados que select no detecta
+        if hasattr(sock, 'pending') and sock.pending():
+            return True
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return bool(readable)
+    
+    def _buffered(self, sock):
+        """Indica si el búfer de lectura de imaplib tiene datos sin consumir"""
+        file = getattr(self.connection, 'file', None)
+        if file is None or not hasattr(file, 'peek'):
+            return False
+        # peek() solo lee del socket si el búfer está vacío: sin bloquear
+        previous = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(file.peek(1))
+        except OSError:
+            return False
+        finally:
+            sock.settimeout(previous)
+
+
+class ImapFolderWatcher(threading.Thread):
+    """Hilo que vigila una carpeta con IDLE y deja sus correos nuevos en una cola"""
+    
+    def __init__(self, connect, folder, quoted_folder, fetch_items, output, stop_event, close_connections=True):
+        """
+        Args:
+            connect (callable): Devuelve una conexión IMAP autenticada (se llama
+                de nuevo para reconectar si la sesión se corta)
+            folder (str): Nombre de la carpeta
+            quoted_folder (str): Nombre de la carpeta listo para SELECT
+            fetch_items (str): Elementos FETCH de cada correo nuevo
+            output (queue.Queue): Recibe tuplas (carpeta, elementos FETCH)
+            stop_event (threading.Event): Señal para terminar
+            close_connections (bool): Cerrar las conexiones al terminar (False si
+                connect devuelve una conexión compartida)
+        """
+        super().__init__(name=f"IDLE {folder}", daemon=True)
+        self.connect = connect
+        self.folder = folder
+        self.quoted_folder = quoted_folder
+        self.fetch_items = fetch_items
+        self.output = output
+        self.stop_event = stop_event
+        self.close_connections = close_connections
+    
+    def run(self):
+        session = None
+        last_uid = None
+        delay = 5
+        
+        while not self.stop_event.is_set():
+            try:
+                if session is None:
+                    session = ImapIdleSession(self.connect(), self.folder, self.quoted_folder, last_uid)
+                    session.start()
+                    print(f"👀 Vigilando '{self.folder}' (IDLE) desde el UID {session.last_uid + 1}")
+                    delay = 5
+                
+                # Correos llegados mientras no se estaba en IDLE (o tras reconectar)
+                uids = session.new_uids()
+                if uids:
+                    for items in session.fetch(uids, self.fetch_items):
+                        self.output.put((self.folder, items))
+                    session.last_uid = last_uid = uids[-1]
+                    continue
+                
+                last_uid = session.last_uid
+                session.wait(self.stop_event)
+            
+            except Exception as e:
+                print(f"⚠️ Sesión IDLE de '{self.folder}' interrumpida: {str(e)}. Reconectando en {delay} s...")
+                if session is not None:
+                    self._logout(session.connection)
+                    session = None
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        
+        if session is not None:
+            self._logout(session.connection)
+    
+    def _logout(self, connection):
+        if not self.close_connections:
+            return
+        try:
+            connection.logout()
+        except Exception:
+            pass
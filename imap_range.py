@@ -0,0 +1,106 @@
+# imap_range.py
+"""
+Localización de un rango de fechas en carpetas IMAP grandes por búsqueda binaria
+- Muestrea INTERNALDATE de mensajes sueltos: O(log n) idas y vueltas en lugar de SEARCH
+- Supone que la fecha de llegada crece con el número de secuencia (y el UID);
+  si una muestra lo contradice, se abandona para volver a SEARCH
+"""
+
+from datetime import datetime
+
+from email_manager import parse_fetch_response
+
+# Formato de INTERNALDATE (RFC 3501), p. ej. "17-Jul-1996 02:44:25 -0700"
+INTERNALDATE_FORMAT = '%d-%b-%Y %H:%M:%S %z'
+
+
+def parse_internaldate(value):
+    """Convierte un INTERNALDATE (bytes o str) en datetime con zona horaria"""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='ignore')
+    return datetime.strptime(value.strip().strip('"').strip(), INTERNALDATE_FORMAT)
+
+
+class InternalDateLocator:
+    """Busca por bisección los mensajes de la carpeta seleccionada que llegaron en un rango"""
+    
+    def __init__(self, connection, message_count):
+        """
+        Args:
+            connection (imaplib.IMAP4): Conexión con la carpeta ya seleccionada
+            message_count (int): Número de mensajes de la carpeta (EXISTS)
+        """
+        self.connection = connection
+        self.message_count = message_count
+        self.samples = {}  # número de secuencia -> (UID, INTERNALDATE)
+        self.ordered = True
+    
+    def locate(self, start_date, end_date):
+        """
+        Localiza los mensajes que llegaron entre start_date y end_date (ambos incluidos)
+        
+        Args:
+            start_date (datetime): Inicio (sin zona horaria = hora local)
+            end_date (datetime): Fin (sin zona horaria = hora local)
+        
+        Returns:
+            tuple: (primera secuencia, última secuencia), vacío si primera > última,
+                o None si las fechas de llegada no están ordenadas
+        """
+        # INTERNALDATE tiene precisión de segundos
+        start = start_date.astimezone().replace(microsecond=0)
+        end = end_date.astimezone().replace(microsecond=0)
+        
+        first = self._bisect(lambda date: date >= start)
+        if not self.ordered:
+            return None
+        last = self._bisect(lambda date: date > end) - 1
+        if not self.ordered:
+            return None
+        
+        return first, last
+    
+    def uid_at(self, sequence):
+        """UID del mensaje con ese número de secuencia (None si las fechas no están ordenadas)"""
+        sample = self.sample(sequence)
+        return sample[0] if self.ordered else None
+    
+    def sample(self, sequence):
+        """Obtiene (UID, INTERNALDATE) de un mensaje y comprueba el orden con las demás muestras"""
+        if sequence not in self.samples:
+            typ, data = self.connection.fetch(str(sequence), '(UID INTERNALDATE)')
+            responses = parse_fetch_response(data) if typ == 'OK' else []
+            if not responses:
+                raise self.connection.error(f"No se pudo leer INTERNALDATE del mensaje {sequence}")
+            
+            items = responses[0][1]
+            self.samples[sequence] = (int(items['UID']), parse_internaldate(items['INTERNALDATE']))
+            self._check_order(sequence)
+        
+        return self.samples[sequence]
+    
+    @property
+    def round_trips(self):
+        return len(self.samples)
+    
+    def _bisect(self, predicate):
+        """Primera secuencia cuya fecha cumple predicate (message_count + 1 si ninguna)"""
+        low, high = 1, self.message_count + 1
+        while low < high and self.ordered:
+            middle = (low + high) // 2
+            if predicate(self.sample(middle)[1]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+    
+    def _check_order(self, sequence):
+        """Marca la carpeta como desordenada si la muestra contradice a sus vecinas"""
+        date = self.samples[sequence][1]
+        previous = [seq for seq in self.samples if seq < sequence]
+        following = [seq for seq in self.samples if seq > sequence]
+        
+        if previous and self.samples[max(previous)][1] > date:
+            self.ordered = False
+        if following and self.samples[min(following)][1] < date:
+            self.ordered = False
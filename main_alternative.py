@@ -5,9 +5,17 @@ Aplicación principal con métodos alternativos de autenticación
 - Microsoft Graph API (alternativa sin IMAP)
 """
 
+import argparse
+import contextlib
+import os
 import sys
+import time
 from datetime import datetime, timedelta
 
+# Los módulos de cada función (SQLite, requests, openpyxl...) se importan al
+# usarla, para que el arranque de los comandos cortos sea rápido
+# (ver startup_benchmark.py)
+
 def choose_authentication_method():
     """Permite al usuario elegir el método de autenticación"""
     print("="*60)
@@ -27,17 +35,24 @@ def choose_authentication_method():
     print("   ❌ Requiere autorización en navegador web")
     print("   📧 Funciona con: Todas las cuentas Microsoft sin excepción\n")
     
+    print("🔹 MÉTODO AUTOMÁTICO: IMAP y Graph API a la vez")
+    print("   ✅ Mide la latencia de ambos y usa el más rápido para cada consulta")
+    print("   ✅ Si uno falla a mitad de descarga, continúa con el otro")
+    print("   ❌ Requiere autenticarse con los dos métodos\n")
+    
     while True:
-        choice = input("¿Qué método prefieres? (1=IMAP, 2=Graph API, h=ayuda): ").strip().lower()
+        choice = input("¿Qué método prefieres? (1=IMAP, 2=Graph API, a=automático, h=ayuda): ").strip().lower()
         
         if choice == '1':
             return 'imap'
         elif choice == '2':
             return 'graph'
+        elif choice == 'a' or choice == 'auto':
+            return 'auto'
         elif choice == 'h' or choice == 'help' or choice == 'ayuda':
             show_method_help()
         else:
-            print("❌ Opción inválida. Escribe 1, 2 o h para ayuda.")
+            print("❌ Opción inválida. Escribe 1, 2, a o h para ayuda.")
 
 def show_method_help():
     """Muestra ayuda detallada sobre los métodos"""
@@ -62,37 +77,56 @@ def show_method_help():
     print("   • Es más compatible y fácil de usar")
     print("   • Si no funciona, prueba el Método 1")
     
+    print("\n🔹 ¿Cuándo usar el método automático?")
+    print("   • Tienes IMAP habilitado y también puedes usar Graph API")
+    print("   • Descargas muchas carpetas o rangos largos y quieres el camino más rápido")
+    print("   • Tu conexión o el servidor fallan a veces y no quieres repetir la descarga")
+    
     print("\n" + "="*50 + "\n")
 
-def run_imap_method():
-    """Ejecuta la aplicación usando IMAP"""
-    try:
-        from auth import MicrosoftAuthenticator
-        from email_manager import EmailManager
-        
-        print("\n🔐 Iniciando autenticación IMAP...")
-        authenticator = MicrosoftAuthenticator()
-        
-        if not authenticator.authenticate():
-            print("\n❌ Autenticación IMAP falló.")
-            print("💡 Prueba el Método 2 (Graph API) escribiendo: python main_alternative.py")
-            return False
-        
-        # Crear gestor de correos
-        email_manager = EmailManager(authenticator.get_imap_connection(), authenticator.get_email_address())
-        
-        # Continuar con el flujo normal
-        return run_email_download(email_manager, authenticator)
-        
-    except ImportError as e:
-        print(f"❌ Error importando módulos IMAP: {str(e)}")
-        return False
-    except Exception as e:
-        print(f"❌ Error en método IMAP: {str(e)}")
-        return False
-
-def run_graph_method():
-    """Ejecuta la aplicación usando Graph API con Device Code"""
+def create_email_manager(method):
+    """
+    Autentica con el método indicado y crea el gestor de correos
+    
+    Returns:
+        tuple: (gestor de correos, autenticador), o (None, None) si falla
+    """
+    if method == 'auto':
+        return create_auto_manager()
+    
+    if method == 'imap':
+        try:
+            from auth import MicrosoftAuthenticator
+            from email_manager import EmailManager
+            
+            print("\n🔐 Iniciando autenticación IMAP...")
+            authenticator = MicrosoftAuthenticator()
+            
+            if not authenticator.authenticate():
+                print("\n❌ Autenticación IMAP falló.")
+                print("💡 Prueba el Método 2 (Graph API) escribiendo: python main_alternative.py")
+                return None, None
+            
+            # Crear gestor de correos (con conexiones adicionales para vigilar varias
+            # carpetas y un presupuesto de comandos compartido con otros procesos)
+            from rate_limiter import SharedRateLimiter
+            
+            email_address = authenticator.get_email_address()
+            email_manager = EmailManager(
+                authenticator.get_imap_connection(),
+                email_address,
+                connection_factory=getattr(authenticator, 'create_imap_connection', None),
+                rate_bucket=SharedRateLimiter().bucket('imap', email_address)
+            )
+            return email_manager, authenticator
+            
+        except ImportError as e:
+            print(f"❌ Error importando módulos IMAP: {str(e)}")
+            return None, None
+        except Exception as e:
+            print(f"❌ Error en método IMAP: {str(e)}")
+            return None, None
+    
     try:
         from device_auth import DeviceCodeAuthenticator
         from graph_email_manager import GraphEmailManager
@@ -104,20 +138,74 @@ def run_graph_method():
         if not authenticator.authenticate():
             print("\n❌ Autenticación Graph API falló.")
             print("💡 Prueba el Método 1 (IMAP) si tienes IMAP habilitado.")
-            return False
+            return None, None
         
-        # Crear gestor de correos
-        email_manager = GraphEmailManager(authenticator.get_access_token())
+        # Crear gestor de correos; el presupuesto de peticiones del buzón se comparte
+        # con otros procesos que lo estén consultando a la vez
+        from rate_limiter import SharedRateLimiter
         
-        # Continuar con el flujo normal
-        return run_email_download(email_manager, authenticator)
+        user_info = authenticator.get_user_info()
+        rate_bucket = SharedRateLimiter().bucket('graph', user_info['email']) if user_info else None
+        email_manager = GraphEmailManager(authenticator.get_access_token(), rate_bucket=rate_bucket)
+        return email_manager, authenticator
         
     except ImportError as e:
         print(f"❌ Error importando módulos Graph: {str(e)}")
-        return False
+        return None, None
     except Exception as e:
         print(f"❌ Error en método Graph: {str(e)}")
+        return None, None
+
+def create_auto_manager():
+    """
+    Autentica con IMAP y Graph API y los combina en un gestor automático
+    
+    Returns:
+        tuple: (AutoBackend, AutoBackend), o (None, None) si ningún método funciona
+    """
+    from backends import AutoBackend
+    
+    managers, authenticators = [], []
+    for method in ('imap', 'graph'):
+        email_manager, authenticator = create_email_manager(method)
+        if email_manager is not None:
+            managers.append(email_manager)
+            authenticators.append(authenticator)
+    
+    if not managers:
+        return None, None
+    
+    print("\n📶 Midiendo la latencia de cada método...")
+    auto = AutoBackend(managers)
+    auto.authenticators = authenticators
+    auto.probe()
+    return auto, auto
+
+def run_imap_method():
+    """Ejecuta la aplicación usando IMAP"""
+    email_manager, authenticator = create_email_manager('imap')
+    if email_manager is None:
         return False
+    
+    # Continuar con el flujo normal
+    return run_email_download(email_manager, authenticator)
+
+def run_graph_method():
+    """Ejecuta la aplicación usando Graph API con Device Code"""
+    email_manager, authenticator = create_email_manager('graph')
+    if email_manager is None:
+        return False
+    
+    # Continuar con el flujo normal
+    return run_email_download(email_manager, authenticator)
+
+def run_auto_method():
+    """Ejecuta la aplicación eligiendo automáticamente entre IMAP y Graph API"""
+    email_manager, authenticator = create_email_manager('auto')
+    if email_manager is None:
+        return False
+    
+    return run_email_download(email_manager, authenticator)
 
 def get_date_range():
     """Solicita rango de fechas al usuario"""
@@ -179,23 +267,90 @@ def run_email_download(email_manager, authenticator):
         # Obtener fechas
         start_date, end_date = get_date_range()
         
+        # Carpetas a revisar (incluyendo carpeta JIRA)
+        folders_to_search = ['inbox', '1 - JIRA']
+        
+        # Modo solo resumen: conteos calculados en el servidor, sin descargar mensajes
+        if choose_query_mode() == 'resumen':
+            counts = email_manager.get_email_counts(start_date, end_date, folders_to_search)
+            show_counts_summary(counts)
+            return True
+        
         print(f"\n📥 Buscando correos desde {start_date.strftime('%Y-%m-%d')} hasta {end_date.strftime('%Y-%m-%d')}...")
         
-        # Descargar correos (incluyendo carpeta JIRA)
-        folders_to_search = ['inbox', '1 - JIRA']
-        emails = email_manager.get_emails_in_date_range(start_date, end_date, folders_to_search)
+        # Metadatos opcionales de tamaño y adjuntos (sin descargar adjuntos)
+        attachment_info = choose_attachment_info()
+        
+        # Los hilos necesitan campos extra; se pregunta antes para pedir solo lo necesario
+        threads_choice = input("🧵 ¿Añadir hoja con resumen por hilo de conversación? (s/n): ").strip().lower()
+        include_threads = threads_choice in ['s', 'si', 'sí', 'yes', 'y']
+        
+        # Graph API: todas las carpetas en una sola consulta en lugar de una por carpeta (opcional)
+        graph_backends = [
+            backend for backend in getattr(email_manager, 'backends', [email_manager])
+            if hasattr(backend, 'cross_folder_query')
+        ]
+        if graph_backends:
+            cross_choice = input("🔗 ¿Pedir todas las carpetas en una sola consulta (Graph API)? (s/n): ").strip().lower()
+            for backend in graph_backends:
+                backend.cross_folder_query = cross_choice in ['s', 'si', 'sí', 'yes', 'y']
+        
+        # Vista previa: solo se descargan los primeros caracteres del cuerpo
+        preview_choice = input("📝 ¿Añadir vista previa del cuerpo? Número de caracteres (vacío = no): ").strip()
+        email_manager.preview_length = int(preview_choice) if preview_choice.isdigit() and int(preview_choice) > 0 else None
+        
+        # Descargar correos, actualizando el índice local de búsqueda a medida que llegan
+        # (los correos copiados en varias carpetas se cuentan y exportan una sola vez)
+        from dedup import MessageDeduplicator
+        from search_index import SearchIndex, DEFAULT_INDEX_PATH
+        
+        deduplicator = MessageDeduplicator(choose_dedup_mode())
+        try:
+            email_stream = email_manager.iter_emails_in_date_range(
+                start_date, end_date, folders_to_search,
+                attachment_info=attachment_info, deduplicator=deduplicator,
+                include_threads=include_threads
+            )
+            
+            # Etiquetas de clasificación si existe el archivo de reglas
+            rule_engine = load_rule_engine()
+            if rule_engine:
+                email_stream = rule_engine.classify_stream(email_stream)
+            with SearchIndex() as search_index:
+                emails = list(search_index.index_stream(email_stream))
+            print(f"🔎 Índice de búsqueda actualizado: {DEFAULT_INDEX_PATH}")
+        finally:
+            # En modo 'disco' el estado entre ejecuciones se guarda al cerrar
+            deduplicator.close()
+        
+        if deduplicator.duplicates:
+            print(f"🔁 Correos duplicados omitidos (presentes en varias carpetas): {deduplicator.duplicates}")
         
         # Mostrar resumen
         show_results_summary(emails)
+        if rule_engine:
+            print(f"🏷️ Correos etiquetados: {rule_engine.summary()}")
         
         # Exportar si hay correos
         if emails:
-            export_choice = input("\n💾 ¿Exportar a Excel? (s/n): ").strip().lower()
+            # Antes del Excel, para que incluya la columna con la ruta de cada cuerpo
+            body_choice = input("\n📄 ¿Guardar el cuerpo completo de cada correo (.eml comprimido)? (s/n): ").strip().lower()
+            if body_choice in ['s', 'si', 'sí', 'yes', 'y']:
+                email_manager.export_bodies(emails)
+            
+            export_choice = input("💾 ¿Exportar a Excel? (s/n): ").strip().lower()
             
             if export_choice in ['s', 'si', 'sí', 'yes', 'y']:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"correos_{timestamp}.xlsx"
-                email_manager.export_to_excel(emails, filename)
+                email_manager.export_to_excel(emails, filename, include_threads=include_threads)
+            
+            partition_choice = input("🗂️ ¿Exportar también particionado por carpeta y día (JSONL comprimido)? (s/n): ").strip().lower()
+            if partition_choice in ['s', 'si', 'sí', 'yes', 'y']:
+                from partitioned_writer import PartitionedWriter, DEFAULT_PARTITION_ROOT
+                with PartitionedWriter(DEFAULT_PARTITION_ROOT) as partitioned:
+                    for email_data in emails:
+                        partitioned.write(email_data)
         
         print(f"\n{'='*60}")
         print("✅ ¡Proceso completado exitosamente!")
@@ -215,6 +370,83 @@ def run_email_download(email_manager, authenticator):
         if hasattr(authenticator, 'disconnect'):
             authenticator.disconnect()
 
+def choose_query_mode():
+    """Pregunta si se descargan los correos o solo se muestra el volumen"""
+    print("\n🔹 Tipo de consulta:")
+    print("   1 = Descargar correos (detalle, dominios y exportación)")
+    print("   2 = Solo resumen de volumen por carpeta y día (rápido, sin descargar)")
+    
+    while True:
+        choice = input("¿Qué consulta quieres hacer? [1]: ").strip()
+        
+        if choice in ['', '1']:
+            return 'descarga'
+        elif choice == '2':
+            return 'resumen'
+        else:
+            print("❌ Opción inválida. Escribe 1 o 2.")
+
+def choose_attachment_info():
+    """Pregunta si se añaden columnas de tamaño y adjuntos a la exportación"""
+    print("\n📎 Columnas de tamaño y adjuntos (nunca se descargan los adjuntos):")
+    print("   n = No incluir")
+    print("   r = Resumen (tamaño y si tiene adjuntos)")
+    print("   d = Detalle (además número, nombres y tipos de adjuntos)")
+    
+    while True:
+        choice = input("¿Qué columnas quieres? [n]: ").strip().lower()
+        
+        if choice in ['', 'n', 'no']:
+            return None
+        elif choice == 'r':
+            return 'resumen'
+        elif choice == 'd':
+            return 'detalle'
+        else:
+            print("❌ Opción inválida. Escribe n, r o d.")
+
+def choose_dedup_mode():
+    """Pregunta cómo se recuerdan los correos ya vistos (de-duplicación)"""
+    from dedup import MODE_MEMORY, MODE_DISK, MODE_BLOOM, DEFAULT_DEDUP_PATH
+    
+    print("\n🔁 De-duplicación de correos repetidos:")
+    print("   m = Memoria (solo en esta ejecución)")
+    print(f"   d = Disco ({DEFAULT_DEDUP_PATH}; omite también los descargados en ejecuciones anteriores)")
+    print("   b = Bloom (memoria fija, para millones de correos; puede omitir algún correo único)")
+    
+    while True:
+        choice = input("¿Qué modo quieres? [m]: ").strip().lower()
+        
+        if choice in ['', 'm']:
+            return MODE_MEMORY
+        elif choice == 'd':
+            return MODE_DISK
+        elif choice == 'b':
+            return MODE_BLOOM
+        else:
+            print("❌ Opción inválida. Escribe m, d o b.")
+
+def show_counts_summary(counts):
+    """Muestra el resumen de volumen calculado en el servidor"""
+    print(f"\n{'='*50}")
+    print(f"📊 RESUMEN DE VOLUMEN (SERVIDOR)")
+    print(f"{'='*50}")
+    print(f"📧 Total de correos en el rango: {counts['total']}")
+    
+    if counts['carpetas']:
+        print(f"\n📂 Distribución por carpetas:")
+        for carpeta, count in counts['carpetas'].items():
+            estado = counts['estado_carpetas'].get(carpeta)
+            if estado:
+                print(f"   {carpeta}: {count} correos (carpeta: {estado['total']} en total, {estado['unread']} sin leer)")
+            else:
+                print(f"   {carpeta}: {count} correos")
+    
+    if counts['dias']:
+        print(f"\n📅 Distribución por días:")
+        for dia in sorted(counts['dias']):
+            print(f"   {dia}: {counts['dias'][dia]} correos")
+
 def show_results_summary(emails):
     """Muestra resumen de resultados incluyendo análisis por carpeta"""
     if not emails:
@@ -237,26 +469,424 @@ def show_results_summary(emails):
         for carpeta, count in carpetas.items():
             print(f"   {carpeta}: {count} correos")
     
-    # Contar dominios
+    # Contar dominios registrables (mail.atlassian.net y eu.atlassian.net -> atlassian.net)
+    from public_suffix import registrable_domain
+    
     domains = {}
     for email_data in emails:
-        domain = email_data['dominio_remitente']
+        domain = email_data.get('dominio_registrable') or registrable_domain(email_data['dominio_remitente'])
         domains[domain] = domains.get(domain, 0) + 1
     
     if domains:
-        print(f"\n🏢 Dominios más frecuentes:")
+        print(f"\n🏢 Dominios más frecuentes (dominio registrable):")
         sorted_domains = sorted(domains.items(), key=lambda x: x[1], reverse=True)
         for domain, count in sorted_domains[:5]:
             print(f"   {domain}: {count} correos")
 
+def load_rule_engine(path=None):
+    """
+    Carga las reglas de clasificación (por defecto, reglas_clasificacion.json si existe)
+    
+    Returns:
+        RuleEngine: Reglas compiladas, o None si no hay reglas o no son válidas
+    """
+    from classification_rules import RuleEngine, DEFAULT_RULES_PATH
+    
+    if path is None:
+        if not os.path.exists(DEFAULT_RULES_PATH):
+            return None
+        path = DEFAULT_RULES_PATH
+    
+    try:
+        rule_engine = RuleEngine.from_file(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ Reglas de clasificación no válidas ({path}): {str(e)}")
+        return None
+    
+    print(f"🏷️ Reglas de clasificación: {path} ({len(rule_engine.rules)} reglas, etiquetas: {', '.join(rule_engine.tags)})")
+    return rule_engine
+
+def run_search(args):
+    """Busca en el índice local sin conectarse al servidor de correo"""
+    from search_index import SearchIndex, DEFAULT_INDEX_PATH
+    
+    start = time.perf_counter()
+    
+    with SearchIndex(args.indice or DEFAULT_INDEX_PATH) as search_index:
+        results = search_index.search(
+            ' '.join(args.texto),
+            folder=args.carpeta,
+            start_date=args.desde,
+            end_date=args.hasta,
+            limit=args.limite
+        )
+    
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    if not results:
+        print(f"📭 Sin resultados ({elapsed_ms:.1f} ms)")
+        return True
+    
+    for result in results:
+        print(f"{result['fecha']} | {result['carpeta']} | {result['remitente_email']} | {result['asunto']}")
+    
+    print(f"\n🔎 {len(results)} resultados en {elapsed_ms:.1f} ms")
+    return True
+
+def run_watch(args):
+    """Vigila las carpetas y escribe cada correo nuevo en cuanto llega"""
+    from dedup import MessageDeduplicator
+    from watch_sink import RecordSink
+    
+    sink = RecordSink(args.salida)
+    
+    # Con salida estándar, el progreso va a stderr para no mezclarse con los datos
+    if sink.file is sys.stdout:
+        progress = contextlib.redirect_stdout(sys.stderr)
+    else:
+        progress = contextlib.nullcontext()
+    
+    with progress:
+        email_manager, authenticator = create_email_manager(args.metodo)
+        if email_manager is None:
+            sink.close()
+            return False
+        
+        deduplicator = MessageDeduplicator()
+        search_index = None
+        try:
+            if args.metodo == 'auto':
+                email_stream = email_manager.iter_new_emails(args.carpetas, deduplicator)
+            elif args.metodo == 'graph':
+                email_stream = email_manager.iter_new_emails(
+                    args.carpetas, deduplicator,
+                    min_interval=args.intervalo, max_interval=args.intervalo_max
+                )
+            else:
+                email_stream = email_manager.iter_new_emails(args.carpetas, deduplicator)
+            
+            if args.reglas:
+                rule_engine = load_rule_engine(args.reglas)
+                if rule_engine is None:
+                    return False
+                email_stream = rule_engine.classify_stream(email_stream)
+            
+            # Índice local de búsqueda: cada correo nuevo se confirma al llegar
+            if not args.sin_indice:
+                from search_index import SearchIndex
+                search_index = SearchIndex(batch_size=1)
+                email_stream = search_index.index_stream(email_stream)
+            
+            destination = args.salida if sink.path else 'salida estándar'
+            print(f"📝 Correos nuevos en: {destination} (Ctrl+C para terminar)")
+            
+            for email_data in email_stream:
+                sink.write(email_data)
+                print(f"📨 {email_data['fecha']} | {email_data['carpeta']} | {email_data['remitente_email']} | {email_data['asunto']}")
+                
+        except KeyboardInterrupt:
+            print(f"\n🛑 Vigilancia detenida: {sink.count} correos nuevos")
+        finally:
+            sink.close()
+            deduplicator.close()
+            if search_index is not None:
+                search_index.close()
+            if hasattr(authenticator, 'disconnect'):
+                authenticator.disconnect()
+    
+    return True
+
+def run_harvest(args):
+    """Descarga los correos de todos los buzones del tenant con permisos de aplicación"""
+    from app_auth import ClientCredentialsAuthenticator
+    from tenant_harvest import TenantHarvester, list_mailboxes
+    
+    try:
+        end_date = datetime.strptime(args.hasta, '%Y-%m-%d') if args.hasta else datetime.now()
+        end_date = end_date.replace(hour=23, minute=59, second=59)
+        start_date = datetime.strptime(args.desde, '%Y-%m-%d') if args.desde else end_date - timedelta(days=7)
+        start_date = start_date.replace(hour=0, minute=0, second=0)
+    except ValueError:
+        print("❌ Formato de fecha inválido. Usa YYYY-MM-DD")
+        return False
+    
+    if args.particiones:
+        from partitioned_writer import PartitionedWriter
+        try:
+            sink = PartitionedWriter(
+                args.particiones, file_format=args.formato, max_rows=args.filas_por_archivo, replace=args.reemplazar
+            )
+        except ImportError as e:
+            print(f"❌ {str(e)}")
+            return False
+    else:
+        from watch_sink import RecordSink
+        sink = RecordSink(args.salida)
+    
+    # Con salida estándar, el progreso va a stderr para no mezclarse con los datos
+    if getattr(sink, 'file', None) is sys.stdout:
+        progress = contextlib.redirect_stdout(sys.stderr)
+    else:
+        progress = contextlib.nullcontext()
+    
+    with progress:
+        rule_engine = None
+        if args.reglas:
+            rule_engine = load_rule_engine(args.reglas)
+            if rule_engine is None:
+                sink.close()
+                return False
+        
+        authenticator = ClientCredentialsAuthenticator()
+        if not authenticator.authenticate():
+            sink.close()
+            return False
+        
+        if args.buzones:
+            try:
+                with open(args.buzones, encoding='utf-8') as mailbox_file:
+                    mailboxes = [line.strip() for line in mailbox_file if line.strip() and not line.startswith('#')]
+            except OSError as e:
+                print(f"❌ No se pudo leer la lista de buzones ({args.buzones}): {str(e)}")
+                sink.close()
+                return False
+        else:
+            import requests
+            mailboxes = list_mailboxes(requests.Session(), authenticator.get_access_token())
+        
+        if not mailboxes:
+            print("📭 No hay buzones que descargar")
+            sink.close()
+            return False
+        
+        harvester = TenantHarvester(
+            authenticator, mailboxes,
+            max_concurrency=args.concurrencia, mailbox_concurrency=args.por_buzon,
+            max_pages_per_folder=args.paginas,
+            cross_folder_query=args.consulta_unica, ordered=not args.sin_orden
+        )
+        deduplicator = None
+        if args.deduplicar:
+            from dedup import MessageDeduplicator
+            deduplicator = MessageDeduplicator(args.deduplicar)
+        email_stream = harvester.iter_emails_in_date_range(
+            start_date, end_date, args.carpetas,
+            attachment_info=args.adjuntos, date_slices=args.tramos, deduplicator=deduplicator
+        )
+        if rule_engine:
+            email_stream = rule_engine.classify_stream(email_stream)
+        
+        # Índice local de búsqueda, actualizado a medida que llegan los correos
+        search_index = None
+        if not args.sin_indice:
+            from search_index import SearchIndex
+            search_index = SearchIndex()
+            email_stream = search_index.index_stream(email_stream)
+        
+        try:
+            for email_data in email_stream:
+                sink.write(email_data)
+        except KeyboardInterrupt:
+            print(f"\n🛑 Descarga detenida: {sink.count} correos escritos")
+        finally:
+            sink.close()
+            if deduplicator is not None:
+                deduplicator.close()
+            if search_index is not None:
+                search_index.close()
+        
+        if deduplicator is not None and deduplicator.duplicates:
+            print(f"🔁 Correos duplicados omitidos: {deduplicator.duplicates}")
+        
+        if rule_engine:
+            print(f"🏷️ Correos etiquetados: {rule_engine.summary()}")
+    
+    return True
+
+def run_daemon(args):
+    """Autentica una vez y atiende peticiones de exportación y resumen por la API local"""
+    from daemon import MailDaemon, UnixHTTPServer
+    
+    if args.socket and UnixHTTPServer is None:
+        print("❌ Este sistema no admite sockets Unix; usa --puerto")
+        return False
+    
+    rule_engine = None
+    if args.reglas:
+        rule_engine = load_rule_engine(args.reglas)
+        if rule_engine is None:
+            return False
+    
+    email_manager, authenticator = create_email_manager(args.metodo)
+    if email_manager is None:
+        return False
+    
+    mail_daemon = MailDaemon(
+        email_manager, authenticator, pool_size=args.gestores, rule_engine=rule_engine,
+        export_dir=args.exportaciones, token_path=args.token
+    )
+    try:
+        mail_daemon.serve(port=args.puerto, socket_path=args.socket)
+    finally:
+        if hasattr(authenticator, 'disconnect'):
+            authenticator.disconnect()
+    return True
+
+def iter_records(paths):
+    """Correos de archivos .jsonl / .jsonl.gz (los directorios, p. ej. de particiones, se recorren enteros)"""
+    import gzip
+    import json
+    
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                files += [os.path.join(directory, name) for name in sorted(names) if name.endswith(('.jsonl', '.jsonl.gz'))]
+        else:
+            files.append(path)
+    
+    for path in files:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as records:
+            for line in records:
+                if line.strip():
+                    yield json.loads(line)
+
+def run_classify(args):
+    """Etiqueta exportaciones anteriores (JSONL o particiones) con las reglas de clasificación"""
+    rule_engine = load_rule_engine(args.reglas)
+    if rule_engine is None:
+        return False
+    
+    if args.particiones:
+        from partitioned_writer import PartitionedWriter
+        sink = PartitionedWriter(args.particiones, replace=args.reemplazar)
+    else:
+        from watch_sink import RecordSink
+        sink = RecordSink(args.salida)
+    
+    # Con salida estándar, el progreso va a stderr para no mezclarse con los datos
+    if getattr(sink, 'file', None) is sys.stdout:
+        progress = contextlib.redirect_stdout(sys.stderr)
+    else:
+        progress = contextlib.nullcontext()
+    
+    with progress:
+        start = time.perf_counter()
+        records = iter_records(args.entradas)
+        if args.procesos > 1:
+            email_stream = rule_engine.classify_parallel(records, args.procesos)
+        else:
+            email_stream = rule_engine.classify_stream(records)
+        
+        try:
+            for email_data in email_stream:
+                sink.write(email_data)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error leyendo las entradas: {str(e)}")
+            return False
+        finally:
+            sink.close()
+        
+        elapsed = time.perf_counter() - start
+        print(f"🏷️ {sink.count} correos clasificados en {elapsed:.1f} s ({rule_engine.summary()})")
+    
+    return True
+
+def run_cli(argv):
+    """Ejecuta un comando no interactivo ('search', 'watch', 'harvest', 'classify' o 'daemon')"""
+    parser = argparse.ArgumentParser(
+        prog='main_alternative.py',
+        description='Descargador de correos de Microsoft (sin argumentos: modo interactivo)'
+    )
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    
+    search_parser = subparsers.add_parser('search', help='Busca en el índice local por asunto, remitente o dominio')
+    search_parser.add_argument('texto', nargs='+', help='Palabras a buscar (admite prefijos)')
+    search_parser.add_argument('--carpeta', help='Filtrar por carpeta (p. ej. "1 - JIRA")')
+    search_parser.add_argument('--desde', help='Fecha mínima YYYY-MM-DD')
+    search_parser.add_argument('--hasta', help='Fecha máxima YYYY-MM-DD')
+    search_parser.add_argument('--limite', type=int, default=50, help='Número máximo de resultados')
+    search_parser.add_argument('--indice', help='Archivo del índice (por defecto correos_index.db)')
+    
+    watch_parser = subparsers.add_parser('watch', help='Vigila carpetas y escribe cada correo nuevo en cuanto llega')
+    watch_parser.add_argument('carpetas', nargs='*', default=['inbox', '1 - JIRA'], help='Carpetas a vigilar')
+    watch_parser.add_argument('--metodo', choices=['graph', 'imap', 'auto'], default='graph', help='graph (consulta delta), imap (IDLE) o auto (el de menor latencia)')
+    watch_parser.add_argument('--salida', help='Archivo .csv o .jsonl donde añadir los correos (por defecto, salida estándar)')
+    watch_parser.add_argument('--intervalo', type=int, default=5, help='Segundos mínimos entre consultas (Graph)')
+    watch_parser.add_argument('--intervalo-max', type=int, default=60, help='Segundos máximos entre consultas sin correo nuevo (Graph)')
+    watch_parser.add_argument('--reglas', help='Archivo JSON de reglas de clasificación (añade columnas de etiquetas)')
+    watch_parser.add_argument('--sin-indice', action='store_true', help='No añadir los correos al índice local de búsqueda')
+    
+    harvest_parser = subparsers.add_parser('harvest', help='Descarga los correos de todos los buzones del tenant (permisos de aplicación)')
+    harvest_parser.add_argument('carpetas', nargs='*', default=['inbox'], help='Carpetas de cada buzón')
+    harvest_parser.add_argument('--buzones', help='Archivo con un buzón (dirección o ID) por línea (por defecto, todos los del tenant)')
+    harvest_parser.add_argument('--desde', help='Fecha de inicio YYYY-MM-DD (por defecto, hace 7 días)')
+    harvest_parser.add_argument('--hasta', help='Fecha de fin YYYY-MM-DD (por defecto, hoy)')
+    harvest_parser.add_argument('--salida', help='Archivo .csv o .jsonl (por defecto, salida estándar)')
+    harvest_parser.add_argument('--particiones', help='Directorio de salida particionada por carpeta y día (en lugar de --salida)')
+    harvest_parser.add_argument('--formato', choices=['jsonl.gz', 'parquet'], default='jsonl.gz', help='Formato de las particiones (parquet requiere pyarrow)')
+    harvest_parser.add_argument('--filas-por-archivo', type=int, default=100_000, help='Filas máximas por archivo de partición')
+    harvest_parser.add_argument('--reemplazar', action='store_true',
+                                help='Sustituir el contenido de las particiones que reciben correos (por defecto se añaden archivos)')
+    harvest_parser.add_argument('--adjuntos', choices=['resumen', 'detalle'], help='Añadir tamaño y adjuntos')
+    harvest_parser.add_argument('--concurrencia', type=int, default=16, help='Peticiones simultáneas en total')
+    harvest_parser.add_argument('--por-buzon', type=int, default=4, help='Peticiones simultáneas por buzón (Exchange admite 4)')
+    harvest_parser.add_argument('--tramos', type=int, default=1, help='Tramos de fechas por carpeta consultados en paralelo')
+    harvest_parser.add_argument('--paginas', type=int, help='Páginas máximas por carpeta (por defecto, todas)')
+    harvest_parser.add_argument('--reglas', help='Archivo JSON de reglas de clasificación (añade columnas de etiquetas)')
+    harvest_parser.add_argument('--consulta-unica', action='store_true', help='Una sola consulta por buzón para todas las carpetas')
+    harvest_parser.add_argument('--sin-orden', action='store_true', help='No pedir los correos ordenados por fecha (páginas más rápidas)')
+    harvest_parser.add_argument('--deduplicar', choices=['memoria', 'disco', 'bloom'],
+                                help='Omitir correos repetidos en varias carpetas de un buzón (disco: también entre ejecuciones; bloom: memoria fija)')
+    harvest_parser.add_argument('--sin-indice', action='store_true', help='No añadir los correos al índice local de búsqueda')
+    
+    daemon_parser = subparsers.add_parser('daemon', help='Servicio residente con la sesión abierta y una API local (HTTP o socket Unix)')
+    daemon_parser.add_argument('--metodo', choices=['graph', 'imap', 'auto'], default='graph', help='Método de conexión')
+    daemon_parser.add_argument('--puerto', type=int, default=8765, help='Puerto en 127.0.0.1')
+    daemon_parser.add_argument('--socket', help='Socket Unix en lugar del puerto (Linux/macOS)')
+    daemon_parser.add_argument('--gestores', type=int, default=4, help='Peticiones atendidas a la vez')
+    daemon_parser.add_argument('--reglas', help='Archivo JSON de reglas de clasificación')
+    daemon_parser.add_argument('--exportaciones', default='exportaciones', help='Directorio en el que /exportar escribe los archivos')
+    daemon_parser.add_argument('--token', help='Archivo del token de la API (por defecto, en el directorio de datos del usuario)')
+    
+    classify_parser = subparsers.add_parser('classify', help='Etiqueta exportaciones anteriores con las reglas de clasificación')
+    classify_parser.add_argument('entradas', nargs='+', help='Archivos .jsonl / .jsonl.gz o directorios de particiones')
+    classify_parser.add_argument('--reglas', default='reglas_clasificacion.json', help='Archivo JSON de reglas (por defecto reglas_clasificacion.json)')
+    classify_parser.add_argument('--salida', help='Archivo .csv o .jsonl (por defecto, salida estándar)')
+    classify_parser.add_argument('--particiones', help='Directorio de salida particionada por carpeta y día (en lugar de --salida)')
+    classify_parser.add_argument('--reemplazar', action='store_true',
+                                 help='Sustituir el contenido de las particiones que reciben correos (por defecto se añaden archivos)')
+    classify_parser.add_argument('--procesos', type=int, default=1, help='Procesos en paralelo (para reprocesar exportaciones grandes)')
+    
+    args = parser.parse_args(argv)
+    
+    if args.comando == 'harvest':
+        return run_harvest(args)
+    if args.comando == 'search':
+        return run_search(args)
+    if args.comando == 'watch':
+        return run_watch(args)
+    if args.comando == 'classify':
+        return run_classify(args)
+    if args.comando == 'daemon':
+        return run_daemon(args)
+    return False
+
 def main():
     """Función principal"""
+    if len(sys.argv) > 1:
+        success = run_cli(sys.argv[1:])
+        sys.exit(0 if success else 1)
+    
     try:
         # Elegir método
         method = choose_authentication_method()
         
         if method == 'imap':
             success = run_imap_method()
+        elif method == 'auto':
+            success = run_auto_method()
         else:  # graph
             success = run_graph_method()
         
@@ -0,0 +1,250 @@
+# partitioned_writer.py
+"""
+Salida particionada por carpeta y día para cargas posteriores en paralelo
+- Estructura: <raíz>/carpeta=inbox/dia=2026-10-01/part-<generación>-0000.jsonl.gz (o .parquet);
+  los correos de un harvest (con 'buzon') van bajo <raíz>/buzon=<buzón>/carpeta=...
+- Cada partición la escribe siempre el mismo hilo del pool, mientras llegan los correos
+- Cada archivo se escribe como temporal y se renombra al completarse
+- Cada ejecución es una generación nueva: por defecto sus archivos se añaden a
+  los anteriores (ejecuciones incrementales, subconjuntos de buzones); con
+  replace=True sustituyen a los de las particiones que reciben correos, que se
+  borran solo cuando la generación nueva está completa
+- _manifest.json lista particiones, archivos y filas
+"""
+
+import gzip
+import importlib.util
+import json
+import os
+import queue
+import secrets
+import threading
+from datetime import datetime
+from urllib.parse import quote
+
+from export_columns import INTERNAL_KEYS
+
+# Formatos disponibles (parquet requiere pyarrow)
+FORMAT_JSONL = 'jsonl.gz'
+FORMAT_PARQUET = 'parquet'
+
+# Filas máximas por archivo de una partición
+DEFAULT_MAX_ROWS = 100_000
+
+# Correos que se agrupan antes de enviarlos al hilo que escribe la partición
+BATCH_SIZE = 500
+
+MANIFEST_NAME = '_manifest.json'
+
+# Directorio por defecto de la exportación interactiva
+DEFAULT_PARTITION_ROOT = 'correos_particionados'
+
+
+def partition_path(folder, day, mailbox=None):
+    """Ruta relativa de una partición (los nombres de buzón y carpeta se escapan como en Hive)"""
+    path = f"carpeta={quote(folder, safe=' -_.')}/dia={day}"
+    if mailbox:
+        path = f"buzon={quote(mailbox, safe=' -_.@')}/{path}"
+    return path
+
+
+class PartitionedWriter:
+    """Reparte los correos por carpeta y día y escribe las particiones en paralelo"""
+    
+    def __init__(self, root, file_format=FORMAT_JSONL, max_rows=DEFAULT_MAX_ROWS, workers=4, replace=False):
+        """
+        Args:
+            root (str): Directorio raíz de la salida
+            file_format (str): 'jsonl.gz' o 'parquet'
+            max_rows (int): Filas máximas por archivo (part-<generación>-0000, -0001...)
+            workers (int): Hilos que escriben (la compresión libera el GIL)
+            replace (bool): Sustituir el contenido de las particiones que reciben
+                correos en lugar de añadir archivos
+        """
+        if file_format == FORMAT_PARQUET and importlib.util.find_spec('pyarrow') is None:
+            raise ImportError("El formato parquet requiere pyarrow (pip install pyarrow)")
+        
+        self.root = root
+        self.file_format = file_format
+        self.max_rows = max_rows
+        self.replace = replace
+        # Nombre único de esta ejecución: nunca sobrescribe archivos de otra
+        self.generation = f"{datetime.now():%Y%m%dT%H%M%S}-{secrets.token_hex(2)}"
+        self.count = 0
+        self.buffers = {}  # (carpeta, día, buzón) -> correos pendientes de enviar
+        self.partitions = {}  # (carpeta, día, buzón) -> {'partes': n, 'archivos': [...], 'filas': n}
+        self.errors = []
+        self.lock = threading.Lock()
+        
+        os.makedirs(root, exist_ok=True)
+        
+        self.queues = [queue.Queue(maxsize=64) for _ in range(max(1, workers))]
+        self.threads = [
+            threading.Thread(target=self._worker, args=(work_queue,), daemon=True)
+            for work_queue in self.queues
+        ]
+        for thread in self.threads:
+            thread.start()
+    
+    def write(self, email_data):
+        """Añade un correo a su partición"""
+        folder = email_data.get('carpeta') or 'inbox'
+        day = str(email_data.get('fecha', ''))[:10]
+        if len(day) != 10 or day[4] != '-':
+            day = 'desconocido'
+        
+        key = (folder, day, email_data.get('buzon'))
+        record = {name: value for name, value in email_data.items() if name not in INTERNAL_KEYS}
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(record)
+        self.count += 1
+        
+        if len(buffer) >= BATCH_SIZE:
+            self._send(key)
+    
+    def close(self):
+        """Termina de escribir, sustituye las particiones (si replace) y actualiza el manifiesto"""
+        for key in list(self.buffers):
+            self._send(key)
+        for work_queue in self.queues:
+            work_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        
+        for error in self.errors:
+            print(f"❌ Error escribiendo particiones: {error}")
+        
+        if self.replace and self.errors:
+            print("⚠️ Hubo errores: se conservan los archivos anteriores de las particiones")
+        elif self.replace:
+            self._remove_stale_files()
+        self._write_manifest()
+        print(f"🗂️ {self.count} correos en {len(self.partitions)} particiones: {self.root}")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _send(self, key):
+        """Envía los correos acumulados al hilo que escribe esa partición"""
+        rows = self.buffers.pop(key, None)
+        if rows:
+            self.queues[hash(key) % len(self.queues)].put((key, rows))
+    
+    def _worker(self, work_queue):
+        """Escribe las particiones asignadas a este hilo, una parte abierta por partición"""
+        open_parts = {}  # (carpeta, día, buzón) -> parte en curso
+        
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+            key, rows = item
+            
+            try:
+                for row in rows:
+                    part = open_parts.get(key)
+                    if part is None or part['filas'] >= self.max_rows:
+                        if part is not None:
+                            self._finish_part(key, part)
+                        part = open_parts[key] = self._open_part(key)
+                    self._write_row(part, row)
+            except Exception as e:
+                self.errors.append(str(e))
+        
+        for key, part in open_parts.items():
+            try:
+                self._finish_part(key, part)
+            except Exception as e:
+                self.errors.append(str(e))
+    
+    def _open_part(self, key):
+        """Abre el siguiente archivo temporal de la partición"""
+        directory = os.path.join(self.root, partition_path(*key))
+        os.makedirs(directory, exist_ok=True)
+        
+        with self.lock:
+            partition = self.partitions.setdefault(key, {'partes': 0, 'archivos': [], 'filas': 0})
+            name = f"part-{self.generation}-{partition['partes']:04d}.{self.file_format}"
+            partition['partes'] += 1
+        
+        path = os.path.join(directory, name)
+        part = {'ruta': path, 'temporal': path + '.tmp', 'filas': 0, 'nombre': name}
+        if self.file_format == FORMAT_PARQUET:
+            part['filas_pendientes'] = []
+        else:
+            part['archivo'] = gzip.open(part['temporal'], 'wt', encoding='utf-8')
+        return part
+    
+    def _write_row(self, part, row):
+        if self.file_format == FORMAT_PARQUET:
+            part['filas_pendientes'].append(row)
+        else:
+            part['archivo'].write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+        part['filas'] += 1
+    
+    def _finish_part(self, key, part):
+        """Cierra el archivo temporal y lo renombra (atómico) a su nombre final"""
+        if self.file_format == FORMAT_PARQUET:
+            import pyarrow
+            import pyarrow.parquet
+            
+            rows = [
+                {name: value if isinstance(value, (str, int, float, bool, list, dict)) or value is None else str(value)
+                 for name, value in row.items()}
+                for row in part['filas_pendientes']
+            ]
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), part['temporal'])
+        else:
+            part['archivo'].close()
+        
+        os.replace(part['temporal'], part['ruta'])
+        with self.lock:
+            self.partitions[key]['archivos'].append(part['nombre'])
+            self.partitions[key]['filas'] += part['filas']
+    
+    def _remove_stale_files(self):
+        """Borra las partes de otras generaciones en las particiones sustituidas por esta"""
+        for key, partition in self.partitions.items():
+            directory = os.path.join(self.root, partition_path(*key))
+            for name in os.listdir(directory):
+                if name.startswith('part-') and name not in partition['archivos']:
+                    os.remove(os.path.join(directory, name))
+    
+    def _write_manifest(self):
+        """Actualiza el manifiesto con las particiones escritas (las demás se conservan)"""
+        manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        manifest = {'particiones': {}}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, encoding='utf-8') as manifest_file:
+                    manifest = json.load(manifest_file)
+            except (OSError, ValueError):
+                print("⚠️ Manifiesto anterior ilegible; se crea de nuevo")
+        
+        updated = datetime.now().isoformat(timespec='seconds')
+        for (folder, day, mailbox), partition in self.partitions.items():
+            path = partition_path(folder, day, mailbox)
+            files, rows = partition['archivos'], partition['filas']
+            previous = manifest['particiones'].get(path)
+            if previous and not self.replace:
+                files = previous['archivos'] + files
+                rows += previous['filas']
+            manifest['particiones'][path] = {
+                'buzon': mailbox,
+                'carpeta': folder,
+                'dia': day,
+                'formato': self.file_format,
+                'archivos': files,
+                'filas': rows,
+                'actualizado': updated
+            }
+        manifest['actualizado'] = updated
+        manifest['filas'] = sum(entry['filas'] for entry in manifest['particiones'].values())
+        
+        temporary = manifest_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporary, manifest_path)
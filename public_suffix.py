@@ -0,0 +1,110 @@
+# public_suffix.py
+"""
+Dominio registrable (eTLD+1) a partir de la Public Suffix List
+- La lista incluida (public_suffix_list.dat) se compila una vez en un trie de
+  etiquetas invertidas: 'co.uk' -> {'uk': {'co': {}}}
+- Cada dominio distinto se calcula una sola vez (memoizado): agregar millones
+  de correos cuesta lo mismo que una consulta a un diccionario
+- Ejemplo: mail.notifications.atlassian.net -> atlassian.net
+"""
+
+import os
+from functools import lru_cache
+
+# Lista incluida (subconjunto de la sección ICANN; admite la lista completa)
+DEFAULT_LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+
+# Marcas del trie: fin de regla, comodín y excepción
+RULE = '$'
+WILDCARD = '*'
+EXCEPTION = '!'
+
+_trie = None
+
+
+def compile_public_suffixes(path=DEFAULT_LIST_PATH, include_private=False):
+    """
+    Compila la Public Suffix List en un trie de etiquetas invertidas
+    
+    Args:
+        path (str): Archivo con el formato de publicsuffix.org
+        include_private (bool): Incluir la sección de dominios privados
+            (p. ej. github.io); por defecto solo la sección ICANN
+    
+    Returns:
+        dict: Trie de diccionarios anidados
+    """
+    trie = {}
+    with open(path, encoding='utf-8') as suffix_file:
+        for line in suffix_file:
+            rule = line.strip()
+            if '===BEGIN PRIVATE DOMAINS===' in rule and not include_private:
+                break
+            if not rule or rule.startswith('//'):
+                continue
+            
+            rule = rule.split()[0].lower()
+            exception = rule.startswith('!')
+            labels = rule.lstrip('!').split('.')
+            
+            node = trie
+            for label in reversed(labels):
+                node = node.setdefault(label, {})
+            node[EXCEPTION if exception else RULE] = True
+    
+    return trie
+
+
+def load_public_suffixes(path=DEFAULT_LIST_PATH, include_private=False):
+    """Sustituye la lista en uso (p. ej. por la lista completa) y vacía la memoización"""
+    global _trie
+    _trie = compile_public_suffixes(path, include_private)
+    registrable_domain.cache_clear()
+
+
+def _suffix_length(labels):
+    """
+    Número de etiquetas (desde la derecha) del sufijo público más largo
+    
+    Sin regla aplicable se usa la regla por defecto '*' (el TLD es el sufijo).
+    """
+    node = _trie
+    length = 1
+    for depth, label in enumerate(reversed(labels), start=1):
+        child = node.get(label)
+        if child is not None and EXCEPTION in child:
+            # '!city.kawasaki.jp': la excepción anula al comodín del nivel superior
+            return depth - 1
+        if WILDCARD in node and RULE in node[WILDCARD]:
+            length = depth
+        if child is None:
+            break
+        if RULE in child:
+            length = depth
+        node = child
+    return length
+
+
+@lru_cache(maxsize=None)
+def registrable_domain(domain):
+    """
+    Dominio registrable (sufijo público + una etiqueta) de un dominio
+    
+    Args:
+        domain (str): Dominio del remitente (p. ej. 'eu.atlassian.net')
+    
+    Returns:
+        str: Dominio registrable ('atlassian.net'); el propio dominio si ya es
+            un sufijo público o no es un nombre de dominio
+    """
+    if _trie is None:
+        load_public_suffixes()
+    
+    if not domain or '.' not in domain:
+        return domain
+    
+    labels = domain.lower().strip('.').split('.')
+    suffix_length = _suffix_length(labels)
+    if suffix_length >= len(labels):
+        return domain
+    return '.'.join(labels[-suffix_length - 1:])
@@ -0,0 +1,240 @@
+# rate_limiter.py
+"""
+Límite de peticiones compartido entre procesos (cubo de fichas en SQLite)
+- Un cubo por backend y buzón: dos exportaciones simultáneas del mismo buzón
+  reparten un único presupuesto en lugar de sumar sus peticiones
+- Los Retry-After recibidos por cualquier proceso bloquean el cubo para todos
+- El estado está en un archivo SQLite por usuario (no depende del directorio
+  desde el que se lanza cada ejecución); BEGIN IMMEDIATE serializa las
+  actualizaciones entre procesos
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# Variable de entorno que indica otro archivo para el estado compartido
+LIMITER_PATH_ENV = 'CORREO_LIMITES_PETICIONES'
+
+# Nombre del archivo del estado compartido en el directorio de caché del usuario
+LIMITER_FILENAME = 'limites_peticiones.db'
+
+
+def user_cache_dir():
+    """Directorio de datos por usuario: %LOCALAPPDATA%/python_correo (Windows) o ~/.cache/python_correo"""
+    cache_dir = (
+        os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    )
+    return os.path.join(os.path.abspath(cache_dir), 'python_correo')
+
+
+def default_limiter_path():
+    """Archivo del estado compartido: CORREO_LIMITES_PETICIONES si está definida o, si no, en user_cache_dir()"""
+    path = os.environ.get(LIMITER_PATH_ENV)
+    if path:
+        return os.path.abspath(os.path.expanduser(path))
+    return os.path.join(user_cache_dir(), LIMITER_FILENAME)
+
+# Presupuesto por backend: (peticiones por segundo, ráfaga máxima)
+# Graph: 10.000 peticiones cada 10 minutos por buzón y aplicación (~16/s)
+DEFAULT_RATES = {
+    'graph': (15.0, 30),
+    'imap': (10.0, 20),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cubos (
+    clave TEXT PRIMARY KEY,
+    fichas REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    bloqueado_hasta REAL NOT NULL DEFAULT 0,
+    penalizaciones INTEGER NOT NULL DEFAULT 0,
+    consumidas INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class SharedRateLimiter:
+    """Cubos de fichas guardados en SQLite y compartidos por todos los procesos del equipo"""
+    
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): Archivo SQLite del estado compartido (por defecto, default_limiter_path())
+        """
+        path = os.path.abspath(path) if path else default_limiter_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()  # Una conexión compartida por los hilos del proceso
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(SCHEMA)
+    
+    def bucket(self, backend, mailbox):
+        """Cubo del backend y buzón indicados"""
+        return MailboxBucket(self, backend, mailbox)
+    
+    def try_acquire(self, key, cost, rate, burst):
+        """
+        Intenta consumir fichas del cubo
+        
+        Returns:
+            float: 0 si se consumieron, o segundos que hay que esperar antes de reintentar
+        """
+        cost = min(cost, burst)
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                tokens, blocked_until = self._refill(key, now, rate, burst)
+                
+                if blocked_until > now:
+                    wait = blocked_until - now
+                elif tokens >= cost:
+                    tokens -= cost
+                    wait = 0.0
+                else:
+                    wait = (cost - tokens) / rate
+                
+                self.connection.execute(
+                    'UPDATE cubos SET fichas = ?, actualizado = ?, consumidas = consumidas + ? WHERE clave = ?',
+                    (tokens, now, cost if wait == 0 else 0, key)
+                )
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        return wait
+    
+    def penalize(self, key, seconds, rate, burst):
+        """Vacía el cubo y lo bloquea durante el Retry-After recibido"""
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                self._refill(key, now, rate, burst)
+                self.connection.execute(
+                    'UPDATE cubos SET fichas = 0, actualizado = ?, bloqueado_hasta = MAX(bloqueado_hasta, ?), '
+                    'penalizaciones = penalizaciones + 1 WHERE clave = ?',
+                    (now, now + seconds, key)
+                )
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+    
+    def snapshot(self, key, rate, burst):
+        """Estado actual del cubo (sin consumir fichas)"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT fichas, actualizado, bloqueado_hasta, penalizaciones, consumidas FROM cubos WHERE clave = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return {'fichas': float(burst), 'bloqueado_s': 0.0, 'penalizaciones': 0, 'consumidas': 0}
+        
+        tokens, updated, blocked_until, penalties, consumed = row
+        now = time.time()
+        return {
+            'fichas': _refilled(tokens, updated, blocked_until, now, rate, burst),
+            'bloqueado_s': max(0.0, blocked_until - now),
+            'penalizaciones': penalties,
+            'consumidas': consumed
+        }
+    
+    def close(self):
+        self.connection.close()
+    
+    def _refill(self, key, now, rate, burst):
+        """Rellena el cubo según el tiempo transcurrido (lo crea lleno si no existe)"""
+        row = self.connection.execute(
+            'SELECT fichas, actualizado, bloqueado_hasta FROM cubos WHERE clave = ?', (key,)
+        ).fetchone()
+        if row is None:
+            self.connection.execute(
+                'INSERT INTO cubos (clave, fichas, actualizado) VALUES (?, ?, ?)', (key, float(burst), now)
+            )
+            return float(burst), 0.0
+        
+        tokens, updated, blocked_until = row
+        return _refilled(tokens, updated, blocked_until, now, rate, burst), blocked_until
+
+
+def _refilled(tokens, updated, blocked_until, now, rate, burst):
+    """Fichas tras rellenar el cubo; durante un bloqueo por Retry-After no se acumulan"""
+    elapsed = now - max(updated, blocked_until)
+    return min(burst, tokens + max(0.0, elapsed) * rate)
+
+
+class MailboxBucket:
+    """Presupuesto de peticiones de un buzón en un backend (lo usan los gestores)"""
+    
+    def __init__(self, limiter, backend, mailbox, rate=None, burst=None):
+        default_rate, default_burst = DEFAULT_RATES.get(backend, DEFAULT_RATES['graph'])
+        self.limiter = limiter
+        self.key = f"{backend}:{(mailbox or 'desconocido').lower()}"
+        self.rate = rate or default_rate
+        self.burst = burst or default_burst
+        self.waited = 0.0  # Segundos esperados por este proceso
+        self.acquired = 0
+    
+    def acquire(self, cost=1):
+        """Espera hasta que haya fichas para cost peticiones y las consume"""
+        while True:
+            wait = self.limiter.try_acquire(self.key, cost, self.rate, self.burst)
+            if wait <= 0:
+                self.acquired += cost
+                return
+            self.waited += wait
+            time.sleep(wait)
+    
+    def penalize(self, seconds):
+        """Comunica un Retry-After a todos los procesos que usan este buzón"""
+        self.limiter.penalize(self.key, seconds, self.rate, self.burst)
+    
+    def budget(self):
+        """Presupuesto actual del buzón (compartido) y espera acumulada en este proceso"""
+        state = self.limiter.snapshot(self.key, self.rate, self.burst)
+        state.update({
+            'clave': self.key,
+            'ritmo': self.rate,
+            'rafaga': self.burst,
+            'esperado_s': self.waited,
+            'peticiones': self.acquired
+        })
+        return state
+    
+    def summary(self):
+        """Resumen legible del presupuesto para el informe de la ejecución"""
+        state = self.budget()
+        text = (
+            f"{state['clave']}: {state['fichas']:.0f}/{state['rafaga']} fichas ({state['ritmo']:.0f}/s), "
+            f"{state['peticiones']} peticiones, {state['esperado_s']:.1f} s de espera, "
+            f"{state['penalizaciones']} Retry-After"
+        )
+        if state['bloqueado_s']:
+            text += f", bloqueado {state['bloqueado_s']:.0f} s más"
+        return text
+
+
+def limit_imap_connection(connection, bucket):
+    """
+    Hace que cada comando IMAP de la conexión consuma una ficha del cubo
+    
+    imaplib no tiene ganchos: se sustituye _command de la conexión (como
+    hace imap_compress con send/read).
+    """
+    if getattr(connection, 'rate_bucket', None) is not None:
+        return connection
+    
+    command = connection._command
+    
+    def limited_command(name, *args):
+        bucket.acquire()
+        return command(name, *args)
+    
+    connection._command = limited_command
+    connection.rate_bucket = bucket
+    return connection
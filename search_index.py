@@ -0,0 +1,212 @@
+# search_index.py
+"""
+Índice local de búsqueda (SQLite FTS5) sobre los correos descargados
+"""
+
+import hashlib
+import sqlite3
+import time
+
+# Archivo del índice por defecto (junto a la aplicación)
+DEFAULT_INDEX_PATH = 'correos_index.db'
+
+# Segundos que se espera a que otro proceso (vigilancia, harvest, servicio) libere el índice
+BUSY_TIMEOUT = 30
+
+# Segundos máximos que un correo espera en memoria antes de escribirse en el índice
+COMMIT_INTERVAL = 2.0
+
+UPSERT = """
+INSERT INTO correos (clave, fecha, carpeta, asunto, remitente, dominio)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(clave) DO UPDATE SET
+    fecha = excluded.fecha,
+    carpeta = excluded.carpeta,
+    asunto = excluded.asunto,
+    remitente = excluded.remitente,
+    dominio = excluded.dominio
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS correos (
+    id INTEGER PRIMARY KEY,
+    clave TEXT UNIQUE NOT NULL,
+    fecha TEXT,
+    carpeta TEXT,
+    asunto TEXT,
+    remitente TEXT,
+    dominio TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_correos_fecha ON correos(fecha);
+CREATE INDEX IF NOT EXISTS idx_correos_carpeta ON correos(carpeta);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS correos_fts USING fts5(
+    asunto, remitente, dominio,
+    content='correos', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS correos_ai AFTER INSERT ON correos BEGIN
+    INSERT INTO correos_fts(rowid, asunto, remitente, dominio)
+    VALUES (new.id, new.asunto, new.remitente, new.dominio);
+END;
+CREATE TRIGGER IF NOT EXISTS correos_ad AFTER DELETE ON correos BEGIN
+    INSERT INTO correos_fts(correos_fts, rowid, asunto, remitente, dominio)
+    VALUES ('delete', old.id, old.asunto, old.remitente, old.dominio);
+END;
+CREATE TRIGGER IF NOT EXISTS correos_au AFTER UPDATE ON correos BEGIN
+    INSERT INTO correos_fts(correos_fts, rowid, asunto, remitente, dominio)
+    VALUES ('delete', old.id, old.asunto, old.remitente, old.dominio);
+    INSERT INTO correos_fts(rowid, asunto, remitente, dominio)
+    VALUES (new.id, new.asunto, new.remitente, new.dominio);
+END;
+"""
+
+
+class SearchIndex:
+    """Índice de búsqueda por asunto, remitente y dominio, con fecha y carpeta"""
+    
+    def __init__(self, path=DEFAULT_INDEX_PATH, batch_size=500, commit_interval=COMMIT_INTERVAL):
+        """
+        Los correos se acumulan en memoria y se escriben en una transacción corta
+        (modo WAL): el índice nunca queda bloqueado mientras se espera a la red,
+        así que varios procesos pueden actualizarlo a la vez
+        
+        Args:
+            path (str): Ruta del archivo SQLite del índice
+            batch_size (int): Correos acumulados antes de confirmar (commit)
+            commit_interval (float): Segundos máximos entre confirmaciones
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.rows = []
+        self.last_commit = time.monotonic()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+    
+    def add(self, email_data):
+        """
+        Añade o actualiza un correo en el índice
+        
+        Args:
+            email_data (dict): Correo tal y como lo entregan EmailManager o GraphEmailManager
+        """
+        self.rows.append((
+            self._record_key(email_data),
+            email_data.get('fecha'),
+            email_data.get('carpeta', 'inbox'),
+            email_data.get('asunto'),
+            email_data.get('remitente_email'),
+            email_data.get('dominio_remitente')
+        ))
+        
+        if len(self.rows) >= self.batch_size or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+    
+    def index_stream(self, emails):
+        """
+        Indexa los correos a medida que pasan y los vuelve a entregar
+        
+        Args:
+            emails (iterable): Correos (p. ej. iter_emails_in_date_range)
+        
+        Yields:
+            dict: El mismo correo, ya indexado
+        """
+        for email_data in emails:
+            self.add(email_data)
+            yield email_data
+        self.commit()
+    
+    def commit(self):
+        """Escribe los correos pendientes en una única transacción"""
+        if self.rows:
+            with self.connection:
+                self.connection.executemany(UPSERT, self.rows)
+            self.rows = []
+        self.last_commit = time.monotonic()
+    
+    def search(self, text, folder=None, start_date=None, end_date=None, limit=50):
+        """
+        Busca correos por palabras de asunto, remitente o dominio
+        
+        Args:
+            text (str): Palabras a buscar (todas deben aparecer, admite prefijos)
+            folder (str): Filtrar por carpeta
+            start_date (str): Fecha mínima YYYY-MM-DD
+            end_date (str): Fecha máxima YYYY-MM-DD (incluida)
+            limit (int): Número máximo de resultados
+        
+        Returns:
+            list: Lista de diccionarios con fecha, carpeta, asunto, remitente y dominio
+        """
+        self.commit()
+        conditions = []
+        params = []
+        
+        query = self._build_match_query(text)
+        if query:
+            conditions.append("c.id IN (SELECT rowid FROM correos_fts WHERE correos_fts MATCH ?)")
+            params.append(query)
+        if folder:
+            conditions.append("c.carpeta = ? COLLATE NOCASE")
+            params.append(folder)
+        if start_date:
+            conditions.append("c.fecha >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("c.fecha <= ?")
+            params.append(f"{end_date} 23:59:59")
+        
+        sql = "SELECT c.fecha, c.carpeta, c.asunto, c.remitente, c.dominio FROM correos c"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY c.fecha DESC LIMIT ?"
+        params.append(limit)
+        
+        rows = self.connection.execute(sql, params).fetchall()
+        return [
+            {
+                'fecha': fecha,
+                'carpeta': carpeta,
+                'asunto': asunto,
+                'remitente_email': remitente,
+                'dominio_remitente': dominio
+            }
+            for fecha, carpeta, asunto, remitente, dominio in rows
+        ]
+    
+    def count(self):
+        """Número de correos en el índice"""
+        self.commit()
+        return self.connection.execute("SELECT COUNT(*) FROM correos").fetchone()[0]
+    
+    def close(self):
+        """Confirma lo pendiente y cierra el índice"""
+        self.commit()
+        self.connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _build_match_query(self, text):
+        """Convierte el texto del usuario en una consulta FTS5 segura (cada palabra como prefijo)"""
+        terms = []
+        for word in (text or '').split():
+            terms.append('"' + word.replace('"', '""') + '"*')
+        return ' AND '.join(terms)
+    
+    def _record_key(self, email_data):
+        """Clave estable del correo para actualizar en lugar de duplicar"""
+        parts = [
+            email_data.get('carpeta', 'inbox'),
+            email_data.get('fecha', ''),
+            email_data.get('remitente_email', ''),
+            email_data.get('asunto', '')
+        ]
+        return hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
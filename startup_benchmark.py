@@ -0,0 +1,99 @@
+# startup_benchmark.py
+"""
+Mide el arranque de main_alternative.py y falla si supera el presupuesto
+- Tiempo total de 'python main_alternative.py --help' (mejor de varias ejecuciones)
+- Desglose de importaciones con 'python -X importtime'
+- Comprueba que las dependencias pesadas no se cargan al arrancar
+
+Uso:
+    python startup_benchmark.py
+    python startup_benchmark.py --presupuesto-ms 150 --ejecuciones 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Presupuesto por defecto del arranque completo (intérprete incluido)
+DEFAULT_BUDGET_MS = 100
+
+# Módulos que solo deben importarse cuando se usa su funcionalidad
+LAZY_MODULES = ('openpyxl', 'pandas', 'requests', 'sqlite3', 'orjson')
+
+ENTRY_POINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main_alternative.py')
+
+
+def measure_wall_time(runs):
+    """Mejor tiempo (ms) de varias ejecuciones de la ayuda de la línea de comandos"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, ENTRY_POINT, '--help'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_imports():
+    """
+    Importa main_alternative con -X importtime
+    
+    Returns:
+        list: Tuplas (módulo, ms propios, ms acumulados) en orden de importación
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main_alternative'],
+        cwd=os.path.dirname(ENTRY_POINT), capture_output=True, text=True, check=True
+    )
+    
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return imports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Presupuesto de arranque de main_alternative.py')
+    parser.add_argument('--presupuesto-ms', type=float, default=DEFAULT_BUDGET_MS, help='Tiempo máximo de arranque (ms)')
+    parser.add_argument('--ejecuciones', type=int, default=5, help='Ejecuciones para medir el tiempo total')
+    parser.add_argument('--top', type=int, default=10, help='Importaciones más lentas a mostrar')
+    args = parser.parse_args(argv)
+    
+    imports = measure_imports()
+    loaded = {name for name, _, _ in imports}
+    main_cumulative = next((cumulative for name, _, cumulative in imports if name == 'main_alternative'), 0)
+    
+    print(f"📦 Importación de main_alternative: {main_cumulative:.1f} ms")
+    print("🐢 Importaciones más lentas (acumulado):")
+    for name, self_ms, cumulative_ms in sorted(imports, key=lambda entry: entry[2], reverse=True)[:args.top]:
+        print(f"   {cumulative_ms:8.1f} ms  {name}")
+    
+    wall_ms = measure_wall_time(args.ejecuciones)
+    print(f"⏱️ Arranque completo (--help, mejor de {args.ejecuciones}): {wall_ms:.1f} ms (presupuesto {args.presupuesto_ms:.0f} ms)")
+    
+    failures = []
+    eager = sorted(module for module in LAZY_MODULES if module in loaded)
+    if eager:
+        failures.append(f"se importan al arrancar: {', '.join(eager)}")
+    if wall_ms > args.presupuesto_ms:
+        failures.append(f"arranque de {wall_ms:.1f} ms supera el presupuesto de {args.presupuesto_ms:.0f} ms")
+    
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        return 1
+    
+    print("✅ Arranque dentro del presupuesto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
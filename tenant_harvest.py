@@ -0,0 +1,289 @@
+# tenant_harvest.py
+"""
+Descarga de metadatos de todos los buzones del tenant (permisos de aplicación)
+- Cada petición es una tarea (búsqueda de carpetas o una página de mensajes)
+- Límite de peticiones simultáneas por buzón (Exchange limita a 4 por buzón y
+  aplicación) y límite global de la aplicación
+- Reparto por turnos entre buzones: un buzón enorme no deja sin servicio al resto
+- Un 429/503 (o un error de conexión) pausa solo el buzón afectado durante el
+  Retry-After y se reintenta la petición
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote, urlencode
+
+from graph_email_manager import GraphEmailManager
+from graph_batch import RETRYABLE_STATUS, retry_after
+from rate_limiter import SharedRateLimiter
+
+# Peticiones simultáneas de toda la aplicación
+DEFAULT_MAX_CONCURRENCY = 16
+
+# Peticiones simultáneas por buzón (límite de Exchange Online por aplicación)
+DEFAULT_MAILBOX_CONCURRENCY = 4
+
+# Reintentos de una misma petición limitada (429/503/504) antes de abandonarla
+MAX_RETRIES = 5
+
+# Estado que devuelve GraphEmailManager._get si la petición no obtuvo respuesta
+# (conexión cortada, timeout): es transitorio y se reintenta como un 429
+CONNECTION_ERROR_STATUS = 0
+
+
+def list_mailboxes(session, access_token):
+    """
+    Obtiene los usuarios del tenant que tienen buzón (requiere User.Read.All)
+    
+    Returns:
+        list: Direcciones (mail) de los buzones
+    """
+    url = "https://graph.microsoft.com/v1.0/users?$select=id,mail&$top=999"
+    headers = {'Authorization': f'Bearer {access_token}'}
+    mailboxes = []
+    
+    while url:
+        response = session.get(url, headers=headers)
+        if response.status_code != 200:
+            print(f"❌ Error listando buzones: {response.status_code}")
+            break
+        data = response.json()
+        mailboxes.extend(user['mail'] for user in data.get('value', []) if user.get('mail'))
+        url = data.get('@odata.nextLink')
+    
+    return mailboxes
+
+
+class TenantHarvester:
+    """Reparte la descarga de muchos buzones respetando los límites por buzón y globales"""
+    
+    def __init__(self, authenticator, mailboxes, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 mailbox_concurrency=DEFAULT_MAILBOX_CONCURRENCY, max_pages_per_folder=None,
+                 cross_folder_query=False, ordered=True):
+        """
+        Args:
+            authenticator (ClientCredentialsAuthenticator): Autenticador de aplicación
+            mailboxes (list): IDs o direcciones de los buzones
+            max_concurrency (int): Peticiones simultáneas de toda la aplicación
+            mailbox_concurrency (int): Peticiones simultáneas por buzón
+            max_pages_per_folder (int): Páginas máximas por carpeta (None = todas)
+            cross_folder_query (bool): Una sola consulta por buzón para todas las
+                carpetas (filtrada por parentFolderId) en lugar de una por carpeta
+            ordered (bool): Pedir las páginas ordenadas por fecha ($orderby)
+        """
+        import requests
+        
+        self.authenticator = authenticator
+        self.max_concurrency = max_concurrency
+        self.mailbox_concurrency = mailbox_concurrency
+        self.max_pages_per_folder = max_pages_per_folder
+        self.cross_folder_query = cross_folder_query
+        
+        # Una sesión para todos los buzones, con tantas conexiones como peticiones simultáneas
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip'})
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency))
+        
+        # Presupuesto por buzón compartido con otros procesos del equipo
+        self.rate_limiter = SharedRateLimiter()
+        
+        self.token = authenticator.get_access_token()
+        self.managers = {
+            mailbox: GraphEmailManager(
+                self.token, mailbox=mailbox, session=self.session,
+                rate_bucket=self.rate_limiter.bucket('graph', mailbox)
+            )
+            for mailbox in dict.fromkeys(mailboxes)
+        }
+        for manager in self.managers.values():
+            manager.ordered = ordered
+        
+        self.http_requests = 0
+        self.throttled = 0
+        self.failures = 0
+    
+    def iter_emails_in_date_range(self, start_date, end_date, folders=['inbox'], attachment_info=None, include_threads=False, date_slices=1,
+                                  deduplicator=None):
+        """
+        Descarga los correos del rango en todos los buzones
+        
+        Args:
+            start_date (datetime): Fecha de inicio
+            end_date (datetime): Fecha de fin
+            folders (list): Carpetas de cada buzón
+            attachment_info (str): None, 'resumen' o 'detalle'
+            include_threads (bool): Pedir también conversationId
+            date_slices (int): Tramos de fechas por carpeta (más peticiones en paralelo por buzón)
+            deduplicator (MessageDeduplicator): Omite los correos repetidos en varias
+                carpetas de un buzón (o ya descargados en otra ejecución, en modo 'disco')
+        
+        Yields:
+            dict: Información de cada correo (incluye 'buzon' y 'carpeta')
+        """
+        if isinstance(folders, str):
+            folders = [folders]
+        
+        print(f"🏢 {len(self.managers)} buzones | {self.max_concurrency} peticiones simultáneas ({self.mailbox_concurrency} por buzón)")
+        
+        # Estado por buzón: tareas pendientes, peticiones en curso y pausa por limitación
+        queues = {mailbox: deque([{'tipo': 'carpetas'}]) for mailbox in self.managers}
+        in_flight = {mailbox: 0 for mailbox in self.managers}
+        paused_until = {mailbox: 0 for mailbox in self.managers}
+        totals = {mailbox: 0 for mailbox in self.managers}
+        turns = deque(self.managers)  # Turno de los buzones con tareas pendientes
+        running = {}  # future -> (buzón, tarea)
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while turns or running:
+                self._refresh_token()
+                
+                # Vueltas por turnos: cada buzón lanza como mucho una tarea por vuelta,
+                # hasta llenar el límite global o que ningún buzón pueda lanzar más
+                now = time.monotonic()
+                launched = True
+                while launched and len(running) < self.max_concurrency:
+                    launched = False
+                    for _ in range(len(turns)):
+                        if len(running) >= self.max_concurrency:
+                            break
+                        mailbox = turns.popleft()
+                        if in_flight[mailbox] < self.mailbox_concurrency and paused_until[mailbox] <= now:
+                            task = queues[mailbox].popleft()
+                            in_flight[mailbox] += 1
+                            running[executor.submit(self._run_task, mailbox, task, folders)] = (mailbox, task)
+                            launched = True
+                        if queues[mailbox]:
+                            turns.append(mailbox)
+                
+                if not running:
+                    # Todos los buzones pendientes están en pausa por limitación
+                    time.sleep(max(0.1, min(paused_until[mailbox] for mailbox in turns) - time.monotonic()))
+                    continue
+                
+                done, _ = wait(list(running), timeout=self._next_resume(turns, paused_until), return_when=FIRST_COMPLETED)
+                for future in done:
+                    mailbox, task = running.pop(future)
+                    in_flight[mailbox] -= 1
+                    had_tasks = bool(queues[mailbox])
+                    
+                    for email_data in self._handle_result(mailbox, task, future.result(), queues[mailbox], paused_until,
+                                                          start_date, end_date, attachment_info, include_threads, date_slices,
+                                                          deduplicator):
+                        totals[mailbox] += 1
+                        yield email_data
+                    
+                    if queues[mailbox] and not had_tasks:
+                        turns.append(mailbox)
+                    elif not queues[mailbox] and not in_flight[mailbox]:
+                        print(f"   📬 {mailbox}: {totals[mailbox]} correos")
+        
+        print(f"\n🏢 Total: {sum(totals.values())} correos de {len(self.managers)} buzones")
+        print(f"🌐 Peticiones HTTP: {self.http_requests} | limitadas (429/503): {self.throttled} | errores: {self.failures}")
+        
+        # Informe del presupuesto compartido: los buzones que más han esperado
+        buckets = sorted(
+            (manager.rate_bucket for manager in self.managers.values()),
+            key=lambda bucket: bucket.waited, reverse=True
+        )
+        print(f"🚦 Espera por presupuesto compartido: {sum(bucket.waited for bucket in buckets):.1f} s")
+        for bucket in buckets[:5]:
+            if bucket.waited:
+                print(f"   {bucket.summary()}")
+    
+    def _run_task(self, mailbox, task, folders):
+        """Ejecuta una tarea en un hilo del pool"""
+        manager = self.managers[mailbox]
+        if task['tipo'] == 'carpetas':
+            folder_ids = manager._resolve_folder_ids(folders)
+            found = [folder for folder in folders if folder_ids.get(folder)]
+            folder_by_id = None
+            if self.cross_folder_query and len(found) > 1:
+                folder_by_id = manager._parent_folder_index(found, folder_ids)
+            return folder_ids, folder_by_id
+        return manager._get(task['url'], manager._message_headers())
+    
+    def _handle_result(self, mailbox, task, result, queue, paused_until,
+                       start_date, end_date, attachment_info, include_threads, date_slices, deduplicator=None):
+        """Procesa el resultado de una tarea y encola las siguientes del buzón"""
+        manager = self.managers[mailbox]
+        self.http_requests += 1
+        
+        if task['tipo'] == 'carpetas':
+            folder_ids, folder_by_id = result
+            params = manager._message_params(
+                attachment_info, include_threads, deduplicator is not None, cross_folder=folder_by_id is not None
+            )
+            if self.max_pages_per_folder is None:
+                params['$top'] = 1000  # Máximo de Graph por página: menos peticiones
+            manager.date_slices = date_slices
+            
+            for folder, folder_id in folder_ids.items():
+                if not folder_id:
+                    print(f"   ❌ {mailbox}: carpeta '{folder}' no encontrada")
+            
+            for slice_start, slice_end in manager._iter_date_slices(start_date, end_date):
+                date_filter = f"receivedDateTime ge {slice_start} and receivedDateTime le {slice_end}"
+                if folder_by_id is not None:
+                    # Una consulta para todas las carpetas del buzón
+                    queue.append({
+                        'tipo': 'pagina',
+                        'carpeta': 'todas las carpetas',
+                        'carpetas': folder_by_id,
+                        'url': manager._cross_folder_url(params, date_filter, folder_by_id),
+                        'pagina': 1,
+                        'intentos': 0
+                    })
+                    continue
+                for folder, folder_id in folder_ids.items():
+                    if not folder_id:
+                        continue
+                    slice_params = dict(params, **{'$filter': date_filter})
+                    queue.append({
+                        'tipo': 'pagina',
+                        'carpeta': folder,
+                        'url': f"{manager._messages_url(folder_id)}?{urlencode(slice_params, safe='$', quote_via=quote)}",
+                        'pagina': 1,
+                        'intentos': 0
+                    })
+            return
+        
+        status = result['status']
+        if status == 200:
+            data = result['body']
+            if 'carpetas' in task:
+                yield from manager._process_cross_folder_page(data.get('value', []), task['carpetas'], attachment_info, deduplicator)
+            else:
+                yield from manager._process_page(data.get('value', []), task['carpeta'], attachment_info, deduplicator)
+            
+            # La siguiente página va al principio: cada carpeta termina antes de empezar otra
+            next_url = data.get('@odata.nextLink')
+            max_pages = self.max_pages_per_folder and self.max_pages_per_folder * len(task.get('carpetas') or [None])
+            if next_url and (max_pages is None or task['pagina'] < max_pages):
+                queue.appendleft(dict(task, url=next_url, pagina=task['pagina'] + 1, intentos=0))
+        
+        elif (status in RETRYABLE_STATUS or status == CONNECTION_ERROR_STATUS) and task['intentos'] < MAX_RETRIES:
+            # Solo se pausa este buzón; los demás siguen descargando
+            if status in RETRYABLE_STATUS:
+                self.throttled += 1
+            wait_seconds = retry_after(result.get('headers'), manager.batch.default_retry_after)
+            paused_until[mailbox] = max(paused_until[mailbox], time.monotonic() + wait_seconds)
+            queue.appendleft(dict(task, intentos=task['intentos'] + 1))
+        
+        else:
+            print(f"   ❌ {mailbox}: error API en '{task['carpeta']}': {status}")
+            self.failures += 1
+    
+    def _refresh_token(self):
+        """Aplica a todos los buzones el token renovado por el autenticador"""
+        token = self.authenticator.get_access_token()
+        if token and token != self.token:
+            self.token = token
+            for manager in self.managers.values():
+                manager.set_access_token(token)
+    
+    def _next_resume(self, turns, paused_until):
+        """Segundos hasta que termine la pausa más próxima (None si no hay pausas)"""
+        now = time.monotonic()
+        pauses = [paused_until[mailbox] - now for mailbox in turns if paused_until[mailbox] > now]
+        return max(0.0, min(pauses)) if pauses else None
@@ -0,0 +1,140 @@
+# threads.py
+"""
+Reconstrucción de hilos de conversación sobre los correos descargados
+- IMAP: cabeceras Message-ID, In-Reply-To y References
+- Graph API: conversationId
+"""
+
+import re
+
+# Prefijos de respuesta/reenvío que se ignoran al mostrar el asunto del hilo
+REPLY_PREFIX_PATTERN = re.compile(r'^\s*((re|fw|fwd|rv|aw|wg)\s*(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+
+class UnionFind:
+    """Conjuntos disjuntos sobre claves hashables (unión por tamaño y compresión de caminos)"""
+    
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+    
+    def add(self, key):
+        """Registra una clave como conjunto propio si no existe"""
+        if key not in self.parent:
+            self.parent[key] = key
+            self.size[key] = 1
+    
+    def find(self, key):
+        """Devuelve el representante del conjunto de la clave"""
+        self.add(key)
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        
+        # Compresión de caminos (iterativa para no agotar la pila)
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        
+        return root
+    
+    def union(self, first, second):
+        """Une los conjuntos de dos claves"""
+        first_root = self.find(first)
+        second_root = self.find(second)
+        if first_root == second_root:
+            return first_root
+        
+        if self.size[first_root] < self.size[second_root]:
+            first_root, second_root = second_root, first_root
+        
+        self.parent[second_root] = first_root
+        self.size[first_root] += self.size[second_root]
+        return first_root
+
+
+def normalize_subject(subject):
+    """Quita prefijos Re:/RV:/Fwd: para mostrar el asunto del hilo"""
+    return REPLY_PREFIX_PATTERN.sub('', subject or '').strip()
+
+
+def _thread_keys(email_data):
+    """Claves que relacionan el correo con su hilo"""
+    keys = []
+    if email_data.get('conversation_id'):
+        keys.append(('conv', email_data['conversation_id']))
+    if email_data.get('in_reply_to'):
+        keys.append(('msg', email_data['in_reply_to']))
+    for reference in email_data.get('referencias') or []:
+        keys.append(('msg', reference))
+    return keys
+
+
+def group_threads(emails):
+    """
+    Agrupa los correos en hilos y asigna a cada correo la clave 'hilo'
+    
+    Coste casi lineal: cada correo hace un número constante de uniones por
+    referencia sobre un índice hash (union-find).
+    
+    Args:
+        emails (list): Correos de EmailManager o GraphEmailManager
+    
+    Returns:
+        list: Resumen por hilo (hilo, asunto, mensajes, primer/último mensaje,
+            carpetas, remitentes), ordenado por fecha del primer mensaje
+    """
+    union_find = UnionFind()
+    nodes = []
+    
+    for position, email_data in enumerate(emails):
+        if email_data.get('message_id'):
+            node = ('msg', email_data['message_id'])
+        else:
+            node = ('pos', position)
+        union_find.add(node)
+        nodes.append(node)
+        
+        for key in _thread_keys(email_data):
+            union_find.union(node, key)
+    
+    threads = {}
+    for email_data, node in zip(emails, nodes):
+        root = union_find.find(node)
+        thread = threads.get(root)
+        if thread is None:
+            thread = {
+                'asunto': normalize_subject(email_data.get('asunto')),
+                'mensajes': 0,
+                'primer_mensaje': None,
+                'ultimo_mensaje': None,
+                'carpetas': set(),
+                'remitentes': set(),
+                'correos': []
+            }
+            threads[root] = thread
+        
+        thread['mensajes'] += 1
+        thread['carpetas'].add(email_data.get('carpeta', 'inbox'))
+        thread['remitentes'].add(email_data.get('remitente_email'))
+        thread['correos'].append(email_data)
+        
+        fecha = email_data.get('fecha', '')
+        if fecha[:1].isdigit():
+            if thread['primer_mensaje'] is None or fecha < thread['primer_mensaje']:
+                thread['primer_mensaje'] = fecha
+                thread['asunto'] = normalize_subject(email_data.get('asunto')) or thread['asunto']
+            if thread['ultimo_mensaje'] is None or fecha > thread['ultimo_mensaje']:
+                thread['ultimo_mensaje'] = fecha
+    
+    summaries = sorted(threads.values(), key=lambda thread: thread['primer_mensaje'] or '')
+    width = max(4, len(str(len(summaries))))
+    
+    for number, thread in enumerate(summaries, 1):
+        thread_id = f"H{number:0{width}d}"
+        for email_data in thread.pop('correos'):
+            email_data['hilo'] = thread_id
+        thread['hilo'] = thread_id
+        thread['carpetas'] = ', '.join(sorted(thread['carpetas']))
+        thread['remitentes'] = len(thread['remitentes'])
+    
+    return summaries
@@ -0,0 +1,74 @@
+# watch_sink.py
+"""
+Salida de los correos nuevos del modo vigilancia
+- JSONL o CSV en modo añadir (nunca se reescribe el archivo)
+- Salida estándar (una línea JSON por correo) si no se indica archivo
+"""
+
+import csv
+import json
+import os
+import sys
+
+from export_columns import OPTIONAL_COLUMNS, INTERNAL_KEYS, get_export_columns, tag_getter
+
+
+class RecordSink:
+    """Escribe cada correo en cuanto llega, vaciando el búfer tras cada registro"""
+    
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): Archivo .csv o .jsonl; None o '-' para la salida estándar
+        """
+        self.path = path if path and path != '-' else None
+        self.format = 'csv' if self.path and self.path.lower().endswith('.csv') else 'jsonl'
+        self.count = 0
+        self.columns = None
+        self.writer = None
+        
+        if self.path is None:
+            self.file = sys.stdout
+            return
+        
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        
+        if self.format == 'csv' and not new_file:
+            # Se continúa con las columnas que ya tiene el archivo
+            with open(self.path, newline='', encoding='utf-8-sig') as existing:
+                headers = next(csv.reader(existing), [])
+            getters = {header: getter for header, getter in get_export_columns([{}])}
+            getters.update({header: getter for _, header, getter in OPTIONAL_COLUMNS})
+            # Los encabezados desconocidos son etiquetas de clasificación
+            self.columns = [(header, getters.get(header) or tag_getter(header)) for header in headers]
+        
+        # utf-8-sig solo al crear el CSV, para que Excel reconozca los acentos
+        encoding = 'utf-8-sig' if self.format == 'csv' and new_file else 'utf-8'
+        self.file = open(self.path, 'a', newline='', encoding=encoding)
+        if self.format == 'csv':
+            self.writer = csv.writer(self.file)
+    
+    def write(self, email_data):
+        """Añade un correo a la salida"""
+        if self.format == 'csv':
+            if self.columns is None:
+                self.columns = get_export_columns([email_data])
+                self.writer.writerow([header for header, _ in self.columns])
+            self.writer.writerow([getter(email_data) for _, getter in self.columns])
+        else:
+            record = {key: value for key, value in email_data.items() if key not in INTERNAL_KEYS}
+            self.file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        
+        self.file.flush()
+        self.count += 1
+    
+    def close(self):
+        """Cierra el archivo (la salida estándar se deja abierta)"""
+        if self.file is not sys.stdout:
+            self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,307 @@
+# xlsx_writer.py
+"""
+Escritura de archivos Excel (.xlsx) en varios procesos
+- Cada hoja se divide en bloques de filas; cada bloque se serializa como XML
+  de SpreadsheetML (cadenas en línea) en un proceso distinto
+- El proceso principal escribe [Content_Types].xml, el libro, los estilos y
+  el contenedor zip, y une los bloques de cada hoja en orden
+- Mismo formato que la exportación con openpyxl: encabezados en negrita,
+  blancos sobre azul y centrados, y ancho de columna automático
+- Solo usa la biblioteca estándar; las exportaciones pequeñas se escriben
+  sin crear procesos
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+
+from export_columns import HEADER_FONT_COLOR, HEADER_FILL_COLOR, MAX_COLUMN_WIDTH
+
+# Filas de cada bloque que serializa un proceso
+ROWS_PER_PART = 50_000
+
+# Filas máximas de una hoja de Excel (encabezado incluido); si hay más, se
+# continúa en otra hoja con el mismo nombre y un número ("Correos 2")
+MAX_SHEET_ROWS = 1_048_576
+
+# Caracteres máximos de una celda de Excel
+MAX_CELL_LENGTH = 32_767
+
+# Filas acumuladas antes de escribir en el archivo del bloque
+WRITE_BATCH = 1000
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Caracteres de control que no admite XML 1.0 (openpyxl los rechaza)
+_ILLEGAL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def column_letter(number):
+    """Letra de la columna (1 -> A, 27 -> AA)"""
+    letters = ''
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _escape_attribute(text):
+    return _escape(text).replace('"', '&quot;')
+
+
+def _string_cell(reference, text, style=''):
+    """Celda de texto en línea (sin tabla de cadenas compartidas)"""
+    text = _ILLEGAL_RE.sub('', text)[:MAX_CELL_LENGTH]
+    space = ' xml:space="preserve"' if text[:1].isspace() or text[-1:].isspace() else ''
+    return f'<c r="{reference}"{style} t="inlineStr"><is><t{space}>{_escape(text)}</t></is></c>'
+
+
+def _cell(reference, value):
+    """XML de una celda ('' si está vacía; el texto vacío se conserva, como en openpyxl)"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{reference}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{reference}"><v>{value}</v></c>'
+    return _string_cell(reference, str(value))
+
+
+def _write_part(path, rows, columns, first_row):
+    """
+    Serializa un bloque de filas como elementos <row> de SpreadsheetML
+    
+    Se ejecuta en los procesos del pool: los valores de las celdas también se
+    obtienen aquí, con las funciones de las columnas.
+    
+    Returns:
+        list: Longitud máxima del texto de cada columna en el bloque
+    """
+    getters = [getter for _, getter in columns]
+    letters = [column_letter(number) for number in range(1, len(columns) + 1)]
+    widths = [0] * len(columns)
+    pending = []
+    
+    with open(path, 'w', encoding='utf-8', errors='replace', newline='') as output:
+        for row_number, row in enumerate(rows, first_row):
+            cells = []
+            for index, getter in enumerate(getters):
+                value = getter(row)
+                # Mismo cálculo que el ajuste de ancho con openpyxl (None cuenta como 'None')
+                length = len(str(value))
+                if length > widths[index]:
+                    widths[index] = length
+                cells.append(_cell(f"{letters[index]}{row_number}", value))
+            pending.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+            
+            if len(pending) >= WRITE_BATCH:
+                output.write(''.join(pending))
+                pending.clear()
+        output.write(''.join(pending))
+    
+    return widths
+
+
+def _split_sheets(sheets):
+    """Reparte las filas de cada hoja en hojas de como máximo MAX_SHEET_ROWS filas"""
+    capacity = MAX_SHEET_ROWS - 1
+    for name, rows, columns in sheets:
+        rows = list(rows)
+        for index, start in enumerate(range(0, max(len(rows), 1), capacity)):
+            sheet_name = name if index == 0 else f"{name[:28]} {index + 1}"
+            yield sheet_name, rows[start:start + capacity], columns
+
+
+def write_xlsx(filename, sheets, workers=None, rows_per_part=ROWS_PER_PART):
+    """
+    Escribe un libro de Excel con una hoja por entrada de sheets
+    
+    Args:
+        filename (str): Archivo de salida
+        sheets (list): Tuplas (nombre de hoja, filas, columnas); las columnas son
+            (encabezado, función que obtiene el valor), como en get_export_columns.
+            Con varios procesos, filas y funciones deben poder serializarse con
+            pickle (funciones de módulo, partial o itemgetter; no lambdas)
+        workers (int): Procesos que serializan las hojas (por defecto, uno por núcleo)
+        rows_per_part (int): Filas de cada bloque
+    
+    Returns:
+        int: Filas de datos escritas
+    """
+    sheets = list(_split_sheets(sheets))
+    total_rows = sum(len(rows) for _, rows, _ in sheets)
+    workers = workers or os.cpu_count() or 1
+    
+    output_dir = os.path.dirname(os.path.abspath(filename))
+    with tempfile.TemporaryDirectory(prefix='xlsx_', dir=output_dir) as temp_dir:
+        jobs = []  # (hoja, ruta del bloque, filas, primera fila)
+        for sheet_index, (_, rows, columns) in enumerate(sheets):
+            for part_index, start in enumerate(range(0, len(rows), rows_per_part)):
+                path = os.path.join(temp_dir, f"hoja{sheet_index}_{part_index:05d}.xml")
+                jobs.append((sheet_index, path, rows[start:start + rows_per_part], start + 2))
+        
+        if workers > 1 and total_rows > rows_per_part:
+            widths = _run_parallel(jobs, sheets, workers)
+        else:
+            widths = [
+                _write_part(path, rows, sheets[sheet_index][2], first_row)
+                for sheet_index, path, rows, first_row in jobs
+            ]
+        
+        parts = [[] for _ in sheets]
+        sheet_widths = [[len(str(header)) for header, _ in columns] for _, _, columns in sheets]
+        for (sheet_index, path, _, _), part_widths in zip(jobs, widths):
+            parts[sheet_index].append(path)
+            sheet_widths[sheet_index] = [max(pair) for pair in zip(sheet_widths[sheet_index], part_widths)]
+        
+        temporary = filename + '.tmp'
+        try:
+            with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_DEFLATED) as package:
+                _write_package(package, sheets, parts, sheet_widths)
+            os.replace(temporary, filename)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+    
+    return total_rows
+
+
+def _run_parallel(jobs, sheets, workers):
+    """Serializa los bloques en un pool de procesos, con pocos bloques en curso a la vez"""
+    from concurrent.futures import ProcessPoolExecutor
+    
+    widths = []
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for sheet_index, path, rows, first_row in jobs:
+            pending.append(executor.submit(_write_part, path, rows, sheets[sheet_index][2], first_row))
+            if len(pending) >= workers * 2:
+                widths.append(pending.popleft().result())
+        while pending:
+            widths.append(pending.popleft().result())
+    return widths
+
+
+def _write_package(package, sheets, parts, sheet_widths):
+    """Escribe las partes del libro en el zip; cada hoja se copia bloque a bloque"""
+    names = [name for name, _, _ in sheets]
+    package.writestr('[Content_Types].xml', _content_types(len(names)))
+    package.writestr('_rels/.rels', _root_relationships())
+    package.writestr('xl/workbook.xml', _workbook(names))
+    package.writestr('xl/_rels/workbook.xml.rels', _workbook_relationships(len(names)))
+    package.writestr('xl/styles.xml', _styles())
+    
+    for sheet_index, (_, rows, columns) in enumerate(sheets):
+        with package.open(f"xl/worksheets/sheet{sheet_index + 1}.xml", 'w', force_zip64=True) as output:
+            output.write(_sheet_head(columns, len(rows), sheet_widths[sheet_index], sheet_index == 0).encode('utf-8'))
+            for path in parts[sheet_index]:
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, output, 1024 * 1024)
+            output.write(b'</sheetData><pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/></worksheet>')
+
+
+def _sheet_head(columns, row_count, widths, selected):
+    """Comienzo de la hoja: dimensiones, anchos de columna y fila de encabezados"""
+    last_column = column_letter(len(columns))
+    tab = ' tabSelected="1"' if selected else ''
+    cols = ''.join(
+        f'<col min="{number}" max="{number}" width="{min(width + 2, MAX_COLUMN_WIDTH)}" customWidth="1"/>'
+        for number, width in enumerate(widths, 1)
+    )
+    header = ''.join(
+        _string_cell(f"{column_letter(number)}1", str(title), ' s="1"')
+        for number, (title, _) in enumerate(columns, 1)
+    )
+    return (
+        f'{XML_DECLARATION}<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+        f'<dimension ref="A1:{last_column}{row_count + 1}"/>'
+        f'<sheetViews><sheetView{tab} workbookViewId="0"><selection activeCell="A1" sqref="A1"/></sheetView></sheetViews>'
+        f'<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>'
+        f'<cols>{cols}</cols><sheetData><row r="1">{header}</row>'
+    )
+
+
+def _content_types(sheet_count):
+    overrides = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{number}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for number in range(1, sheet_count + 1)
+    )
+    return (
+        f'{XML_DECLARATION}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{overrides}</Types>'
+    )
+
+
+def _root_relationships():
+    return (
+        f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_NS}">'
+        f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+
+
+def _workbook(names):
+    sheets = ''.join(
+        f'<sheet name="{_escape_attribute(name[:31])}" sheetId="{number}" r:id="rId{number}"/>'
+        for number, name in enumerate(names, 1)
+    )
+    return (
+        f'{XML_DECLARATION}<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+        f'<bookViews><workbookView activeTab="0"/></bookViews><sheets>{sheets}</sheets></workbook>'
+    )
+
+
+def _workbook_relationships(sheet_count):
+    sheets = ''.join(
+        f'<Relationship Id="rId{number}" Type="{REL_NS}/worksheet" Target="worksheets/sheet{number}.xml"/>'
+        for number in range(1, sheet_count + 1)
+    )
+    return (
+        f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_NS}">{sheets}'
+        f'<Relationship Id="rId{sheet_count + 1}" Type="{REL_NS}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    )
+
+
+def _styles():
+    """Estilo 0: normal; estilo 1: encabezado (negrita, blanco sobre azul, centrado)"""
+    return (
+        f'{XML_DECLARATION}<styleSheet xmlns="{MAIN_NS}">'
+        '<fonts count="2">'
+        '<font><sz val="11"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>'
+        f'<font><b/><sz val="11"/><color rgb="FF{HEADER_FONT_COLOR}"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>'
+        '</fonts>'
+        '<fills count="3">'
+        '<fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill>'
+        f'<fill><patternFill patternType="solid"><fgColor rgb="FF{HEADER_FILL_COLOR}"/>'
+        f'<bgColor rgb="FF{HEADER_FILL_COLOR}"/></patternFill></fill>'
+        '</fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+        '<alignment horizontal="center" vertical="center"/></xf>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    )